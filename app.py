@@ -1,13 +1,21 @@
-from flask import Flask, render_template, request, jsonify, send_file
-from flask_socketio import SocketIO, emit
+from flask import Flask, render_template, request, jsonify, Response
+from flask_socketio import SocketIO, emit, join_room, leave_room
 from flask_cors import CORS
 import os
 import sys
 import threading
 from pathlib import Path
 import json
-from datetime import datetime
+from datetime import datetime, timedelta
 import uuid
+import concurrent.futures
+import functools
+import itertools
+import mimetypes
+import shutil
+import time
+from urllib.parse import quote
+from werkzeug.wsgi import wrap_file
 
 # Load .env file if it exists
 def load_env_file():
@@ -24,7 +32,35 @@ def load_env_file():
 load_env_file()
 
 # Import the existing download functionality
-from descargar_audio import descargar_audio_mp3, leer_urls_csv, setup_logging
+from descargar_audio import leer_urls_csv, setup_logging, setup_console_encoding, convertir_audio, PREFERRED_CODEC, PREFERRED_QUALITY
+from job_queue import JobQueue, QueueFullError
+from metadata_cache import extract_info_cached, download_with_info, downloaded_filepath, get_metadata_cache
+from result_cache import get_result_cache, result_key, HIT, COALESCED
+from job_store import JobStore, InvalidCursorError, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from streaming import StreamingTranscode, StreamingError, select_stream_format
+from output_policy import OutputPolicy, DEFAULT_ACCEPTED_CODECS, parse_codecs
+from progress_rooms import ProgressBroadcaster, PROGRESS_EVENT, job_room, batch_room
+from metrics import get_metrics, CONTENT_TYPE as METRICS_CONTENT_TYPE, EXTRACT, DOWNLOAD, TOTAL
+from tracing import get_tracer, enable_tracing, hook_tracer
+from playlist import iter_playlist_urls
+from bandwidth import get_bandwidth_limiter, parse_rate
+from concurrency import AdaptiveLimit, ConcurrencyController, job_sample, DEFAULT_INTERVAL
+from ydl_pool import get_ydl_pool
+from file_serving import evaluate_request, proxy_headers, iter_file_range, SENDING_MODES, DIRECT
+from zip_stream import iter_zip
+from disk_quota import DiskQuota, InsufficientStorageError, parse_size
+from event_loop import Offloader, ASYNC_MODES, THREADING
+from retry import RetryPolicy, CircuitBreaker, RetryScheduler, DEFAULT_MAX_ATTEMPTS, DEFAULT_BASE_DELAY, DEFAULT_MAX_DELAY
+
+# Serving mode: 'threading' (development server, one thread per connection) or
+# 'eventlet' (one green-thread event loop for HTTP and Socket.IO; downloads and
+# transcodes still run on the native worker threads)
+ASYNC_MODE = os.environ.get('ASYNC_MODE', THREADING).lower()
+if ASYNC_MODE not in ASYNC_MODES:
+    raise ValueError(f"ASYNC_MODE must be one of {', '.join(ASYNC_MODES)}, not {ASYNC_MODE!r}")
+offload = Offloader(ASYNC_MODE)
+HOST = os.environ.get('HOST', '0.0.0.0')
+PORT = int(os.environ.get('PORT', '5000'))
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'youtube2mp3-secret-key'
@@ -33,21 +69,105 @@ CORS(app)
 socketio = SocketIO(
     app, 
     cors_allowed_origins="*",
-    async_mode='threading',
+    async_mode=ASYNC_MODE,
     ping_timeout=60,
     ping_interval=25,
     logger=False,
     engineio_logger=False
 )
 
-# Global state to track downloads
-downloads = {}
-downloads_lock = threading.Lock()
-
 # Configure download directory
 DOWNLOAD_DIR = os.environ.get('DOWNLOAD_DIR', os.path.join(os.getcwd(), 'downloads'))
 Path(DOWNLOAD_DIR).mkdir(parents=True, exist_ok=True)
 
+# Durable state to track downloads (survives restarts)
+JOBS_DB = os.environ.get('JOBS_DB', os.path.join(DOWNLOAD_DIR, 'jobs.db'))
+job_store = JobStore(JOBS_DB)
+
+# Worker pool configuration
+MAX_WORKERS = int(os.environ.get('MAX_WORKERS', '3'))
+MAX_QUEUE_SIZE = int(os.environ.get('MAX_QUEUE_SIZE', '200'))
+QUEUE_RETRY_AFTER = 30  # Seconds suggested to clients when the queue is full
+
+# Adaptive mode: the active download workers move between MIN_WORKERS and
+# MAX_WORKERS following throughput, errors and HTTP 429/403 responses
+ADAPTIVE_WORKERS = os.environ.get('ADAPTIVE_WORKERS', '').lower() in ('1', 'true', 'yes')
+MIN_WORKERS = int(os.environ.get('MIN_WORKERS', '1'))
+ADAPTIVE_INTERVAL = float(os.environ.get('ADAPTIVE_INTERVAL', str(DEFAULT_INTERVAL)))
+
+# Transcode stage: CPU-bound, sized to the core count by default
+MAX_TRANSCODE_WORKERS = int(os.environ.get('MAX_TRANSCODE_WORKERS', str(os.cpu_count() or 1)))
+TRANSCODE_QUEUE_SIZE = int(os.environ.get('TRANSCODE_QUEUE_SIZE', str(MAX_TRANSCODE_WORKERS)))
+
+# Streaming transcodes run outside the worker pool, with their own limit
+MAX_STREAMS = int(os.environ.get('MAX_STREAMS', str(MAX_WORKERS)))
+stream_slots = threading.BoundedSemaphore(MAX_STREAMS)
+# Extraction of the streams being started (a slot each), off the event loop
+stream_starts = concurrent.futures.ThreadPoolExecutor(max_workers=MAX_STREAMS, thread_name_prefix='stream-start')
+
+# Bandwidth budget shared by every download (bytes/s, e.g. '4M'); adjustable via /api/bandwidth
+bandwidth = get_bandwidth_limiter()
+bandwidth.set_limits(
+    parse_rate(os.environ.get('BANDWIDTH_LIMIT')),
+    parse_rate(os.environ.get('JOB_BANDWIDTH_LIMIT'))
+)
+
+# Playlists and channels being expanded into the queue at the same time
+MAX_PLAYLISTS = int(os.environ.get('MAX_PLAYLISTS', '2'))
+playlist_slots = threading.BoundedSemaphore(MAX_PLAYLISTS)
+PLAYLIST_RETRY_INTERVAL = 1  # Seconds an expansion waits for room in a full queue
+playlists = {}  # batch_id -> expansion state
+playlists_lock = threading.Lock()
+
+# Transient download errors (HTTP 429/5xx, timeouts) go back to the queue with
+# exponential backoff and jitter; the circuit breaker holds new starts while
+# most recent downloads fail that way
+retry_policy = RetryPolicy(
+    int(os.environ.get('RETRY_ATTEMPTS', str(DEFAULT_MAX_ATTEMPTS))),
+    float(os.environ.get('RETRY_BASE_DELAY', str(DEFAULT_BASE_DELAY))),
+    float(os.environ.get('RETRY_MAX_DELAY', str(DEFAULT_MAX_DELAY)))
+)
+circuit_breaker = CircuitBreaker(cooldown=float(os.environ.get('BREAKER_COOLDOWN', '30')))
+retry_scheduler = RetryScheduler()
+
+# Output policy: 'mp3' always transcodes, 'passthrough' keeps accepted codecs as they are
+output_policy = OutputPolicy(
+    os.environ.get('OUTPUT_POLICY', PREFERRED_CODEC),
+    parse_codecs(os.environ.get('ACCEPTED_CODECS', ','.join(DEFAULT_ACCEPTED_CODECS))),
+    PREFERRED_QUALITY
+)
+
+# Progress frames: one per room and tick, with only the changed fields
+PROGRESS_INTERVAL = float(os.environ.get('PROGRESS_INTERVAL', '0.5'))
+# Worker threads only queue their events: the broadcaster emits them from the
+# server's own task (on the event loop it is started from a loop greenlet)
+progress = ProgressBroadcaster(socketio, interval=PROGRESS_INTERVAL, autostart=ASYNC_MODE == THREADING)
+
+# Latency histograms and byte/failure counters (shared with the conversion code)
+metrics = get_metrics()
+
+# Finished files: 'direct' lets the WSGI server send them (os.sendfile under gunicorn or
+# uWSGI), 'x-accel' (nginx) and 'x-sendfile' (Apache, lighttpd) hand the transfer to the
+# front proxy. Ranges, ETags and 304 answers are handled here in every mode.
+FILE_SENDING = os.environ.get('FILE_SENDING', DIRECT).lower()
+if FILE_SENDING not in SENDING_MODES:
+    raise ValueError(f"FILE_SENDING must be one of {', '.join(SENDING_MODES)}, not {FILE_SENDING!r}")
+X_ACCEL_PREFIX = os.environ.get('X_ACCEL_PREFIX', '/protected-downloads/')
+FILE_CACHE_MAX_AGE = int(os.environ.get('FILE_CACHE_MAX_AGE', '0'))
+
+# Finished files are evicted least recently served first once they exceed
+# DOWNLOAD_QUOTA (e.g. '20G') or were not served for DOWNLOAD_TTL seconds, and
+# new jobs only start with MIN_FREE_SPACE free on the disk; evicted jobs become 'expired'
+DOWNLOAD_QUOTA = parse_size(os.environ.get('DOWNLOAD_QUOTA'))
+DOWNLOAD_TTL = float(os.environ['DOWNLOAD_TTL']) if os.environ.get('DOWNLOAD_TTL') else None
+MIN_FREE_SPACE = parse_size(os.environ.get('MIN_FREE_SPACE'))
+QUOTA_SWEEP_INTERVAL = float(os.environ.get('QUOTA_SWEEP_INTERVAL', '300'))
+
+# Opt-in per-job traces (GET /api/download/<id>/trace), keeping only the most recent events
+TRACE_JOBS = os.environ.get('TRACE_JOBS', '').lower() in ('1', 'true', 'yes')
+TRACE_MAX_EVENTS = int(os.environ.get('TRACE_MAX_EVENTS', '100000'))
+tracer = enable_tracing(TRACE_MAX_EVENTS) if TRACE_JOBS else get_tracer()
+
 # Configure FFmpeg location
 def find_ffmpeg():
     """Find FFmpeg location from environment or local installation"""
@@ -65,66 +185,147 @@ def find_ffmpeg():
 FFMPEG_LOCATION = find_ffmpeg()
 
 class WebProgressHook:
-    """Custom progress hook for web interface with SocketIO updates"""
+    """Custom progress hook for web interface, feeding the progress broadcaster"""
     
-    def __init__(self, download_id, socketio_instance):
+    def __init__(self, download_id, rooms):
         self.download_id = download_id
-        self.socketio = socketio_instance
-        self.last_update = datetime.now()
+        self.rooms = rooms
         self.final_filename = None
         
     def __call__(self, d):
-        """Hook function called by yt-dlp"""
-        now = datetime.now()
-        # Throttle updates to every 500ms
-        if (now - self.last_update).total_seconds() < 0.5 and d['status'] != 'finished':
-            return
-            
-        self.last_update = now
-        
-        status_data = {
-            'download_id': self.download_id,
-            'status': d['status']
-        }
-        
+        """Hook function called by yt-dlp (updates are coalesced per tick by the broadcaster)"""
         if d['status'] == 'downloading':
-            status_data.update({
-                'percent': d.get('_percent_str', 'N/A'),
-                'speed': d.get('_speed_str', 'N/A'),
-                'eta': d.get('_eta_str', 'N/A')
-            })
+            progress.update(
+                self.download_id, self.rooms,
+                status='downloading',
+                percent=d.get('_percent_str', 'N/A'),
+                speed=d.get('_speed_str', 'N/A'),
+                eta=d.get('_eta_str', 'N/A')
+            )
         elif d['status'] == 'finished':
-            status_data['filename'] = d.get('filename', 'audio.mp3')
             self.final_filename = d.get('filename')
-            
-        # Emit progress update via WebSocket
-        self.socketio.emit('download_progress', status_data, namespace='/')
+            progress.update(self.download_id, self.rooms, percent='100%', eta='00:00')
 
-def download_task(download_id, url, output_dir):
-    """Background task for downloading audio"""
-    print(f"[DEBUG] Starting download task for {download_id}: {url}")
+def download_rooms(download_id, record=None):
+    """Socket.IO rooms a job publishes to: its own and its batch's"""
+    record = record or job_store.get(download_id) or {}
+    rooms = [job_room(download_id)]
+    if record.get('batch_id'):
+        rooms.append(batch_room(record['batch_id']))
+    return rooms
+
+def observe_total_time(record):
+    """Record the time from queued to completed of a job that did run"""
+    try:
+        created_at = datetime.fromisoformat(record['created_at'])
+    except (KeyError, TypeError, ValueError):
+        return
+    metrics.phase_seconds.observe((datetime.now() - created_at).total_seconds(), phase=TOTAL)
+
+def mark_download_completed(download_id, filepath, title=None, cached=False):
+    """Record a finished download and notify the clients"""
+    filename = os.path.basename(filepath)
+    fields = {
+        'status': 'completed',
+        'filename': filename,
+        'filepath': filepath,
+        'completed_at': datetime.now().isoformat()
+    }
+    if title:
+        fields['title'] = title
+    if cached:
+        fields['cached'] = True
+    job_store.update(download_id, **fields)
+    record = job_store.get(download_id) or {}
+    if not cached:
+        observe_total_time(record)
+        disk_quota.add_file(filepath)
+    tracer.finish_job(download_id, status='completed', cached=cached)
+    
+    # Notify completion to the job and batch rooms
+    rooms = download_rooms(download_id, record)
+    progress.update(download_id, rooms, status='completed')
+    progress.finish(download_id)
+    progress.emit('download_complete', {
+        'download_id': download_id,
+        'title': title,
+        'filename': filename
+    }, rooms)
+
+def mark_download_failed(download_id, error):
+    """Record a failed download and notify the clients"""
+    job_store.update(
+        download_id,
+        status='failed',
+        error=str(error),
+        failed_at=datetime.now().isoformat()
+    )
+    tracer.finish_job(download_id, status='failed', error=str(error))
+    
+    rooms = download_rooms(download_id)
+    progress.update(download_id, rooms, status='failed')
+    progress.finish(download_id)
+    progress.emit('download_error', {
+        'download_id': download_id,
+        'error': str(error)
+    }, rooms)
+
+def mark_file_expired(filepath):
+    """Disk quota callback: the jobs of an evicted file become 'expired'"""
+    expired_at = datetime.now().isoformat()
+    for download_id in job_store.expire_filepath(filepath, expired_at):
+        rooms = download_rooms(download_id)
+        progress.emit('download_expired', {
+            'download_id': download_id,
+            'expired_at': expired_at
+        }, rooms)
+    result_cache.invalidate_filepath(filepath)
+    print(f"[INFO] Evicted {filepath}")
+
+def finish_coalesced_download(download_id, future):
+    """Complete a download that was attached to an identical in-flight job"""
+    try:
+        entry = future.result()
+    except Exception as e:
+        mark_download_failed(download_id, e)
+        return
+    mark_download_completed(download_id, entry['filepath'], entry.get('title'), cached=True)
+
+def download_task(download_id, url, output_dir, cache_key=None, attempt=1):
+    """Background task for downloading audio (network stage, no conversion)"""
+    print(f"[DEBUG] Starting download task for {download_id}: {url} (attempt {attempt})")
     print(f"[DEBUG] Output directory: {output_dir}")
     
-    with downloads_lock:
-        downloads[download_id]['status'] = 'downloading'
-        downloads[download_id]['started_at'] = datetime.now().isoformat()
+    # Before the breaker: a job failing here must not be taken as its half-open trial
+    try:
+        disk_quota.check_free_space()
+    except InsufficientStorageError as e:
+        print(f"[ERROR] {e}")
+        tracer.end(download_id, 'queued', cat='wait')
+        if cache_key:
+            result_cache.fail(cache_key, e)
+        mark_download_failed(download_id, e)
+        return
+    
+    # While the circuit is open the worker holds its slot instead of starting another download
+    breaker_token = circuit_breaker.wait()
+    tracer.end(download_id, 'queued', cat='wait')
+    job_store.update(download_id, status='downloading', started_at=datetime.now().isoformat())
+    rooms = download_rooms(download_id)
+    progress.update(download_id, rooms, status='downloading')
+    phase = EXTRACT
     
     try:
         # Create custom yt-dlp options with web progress hook
         import yt_dlp
         print(f"[DEBUG] yt-dlp imported successfully")
         
-        progress_hook = WebProgressHook(download_id, socketio)
+        progress_hook = WebProgressHook(download_id, rooms)
         
         ydl_opts = {
             'format': 'bestaudio/best',
-            'postprocessors': [{
-                'key': 'FFmpegExtractAudio',
-                'preferredcodec': 'mp3',
-                'preferredquality': '320',
-            }],
             'outtmpl': os.path.join(output_dir, '%(title)s.%(ext)s'),
-            'progress_hooks': [progress_hook],
+            'progress_hooks': [progress_hook, hook_tracer(download_id), bandwidth.job().progress_hook],
             'noplaylist': True,
             'quiet': True,
             'socket_timeout': 30,  # 30 seconds socket timeout
@@ -133,65 +334,45 @@ def download_task(download_id, url, output_dir):
             'extractor_args': {'youtube': ['player_client=ios,mweb']},
             'no_warnings': True  # Suppress yt-dlp warnings
         }
-        
+        # Download fixups (e.g. FixupM4a) run FFmpeg too
         if FFMPEG_LOCATION:
             ydl_opts['ffmpeg_location'] = FFMPEG_LOCATION
         
-        print(f"[DEBUG] Creating YoutubeDL with options: {ydl_opts}")
+        print(f"[DEBUG] Using this worker's YoutubeDL with options: {ydl_opts}")
         
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        # Warm instance kept by the worker thread; only the hooks and template change per job
+        with ydl_pool.job(ydl_opts) as ydl:
             print(f"[DEBUG] Extracting info for: {url}")
-            info = ydl.extract_info(url, download=False)
+            with metrics.time_phase(EXTRACT), tracer.span(download_id, EXTRACT):
+                info, from_cache = extract_info_cached(ydl, url)
             title = info.get('title', 'audio')
-            print(f"[DEBUG] Video title: {title}")
+            print(f"[DEBUG] Video title: {title} (cached metadata: {from_cache})")
             
-            with downloads_lock:
-                downloads[download_id]['title'] = title
+            job_store.update(download_id, title=title)
+            progress.update(download_id, rooms, title=title)
             
-            # Perform download
+            # Perform download reusing the extracted info (no second extraction)
             print(f"[DEBUG] Starting download...")
-            ydl.download([url])
+            phase = DOWNLOAD
+            with metrics.time_phase(DOWNLOAD), tracer.span(download_id, DOWNLOAD):
+                result = download_with_info(ydl, url, info, from_cache)
             print(f"[DEBUG] Download completed")
-            
-            # Get the actual downloaded file from progress hook
-            filepath = None
-            filename = None
-            
-            if progress_hook.final_filename:
-                # The progress hook captured the final filename (before post-processing)
-                # But post-processing changes the extension to .mp3
-                base_path = os.path.splitext(progress_hook.final_filename)[0]
-                filepath = f"{base_path}.mp3"
-                filename = os.path.basename(filepath)
-                print(f"[DEBUG] Filepath from progress hook: {filepath}")
-            else:
-                # Fallback: search for the most recently created .mp3 file
-                print(f"[DEBUG] Progress hook didn't capture filename, searching directory...")
-                import glob
-                mp3_files = glob.glob(os.path.join(output_dir, "*.mp3"))
-                if mp3_files:
-                    filepath = max(mp3_files, key=os.path.getctime)
-                    filename = os.path.basename(filepath)
-                    print(f"[DEBUG] Found most recent file: {filepath}")
-            
-            print(f"[DEBUG] Final filepath: {filepath}")
-            print(f"[DEBUG] File exists: {os.path.exists(filepath) if filepath else False}")
-            
-            if not filepath or not os.path.exists(filepath):
-                raise FileNotFoundError(f"Downloaded file not found. Expected: {filepath}")
-            
-            with downloads_lock:
-                downloads[download_id]['status'] = 'completed'
-                downloads[download_id]['filename'] = filename
-                downloads[download_id]['filepath'] = filepath
-                downloads[download_id]['completed_at'] = datetime.now().isoformat()
-            
-            # Notify completion
-            socketio.emit('download_complete', {
-                'download_id': download_id,
-                'title': title,
-                'filename': filename
-            }, namespace='/')
+        
+        # The source audio as downloaded, before conversion
+        source_path = downloaded_filepath(result) or progress_hook.final_filename
+        print(f"[DEBUG] Source file: {source_path}")
+        
+        if not source_path or not os.path.exists(source_path):
+            raise FileNotFoundError(f"Downloaded file not found. Expected: {source_path}")
+        metrics.downloaded_bytes.inc(os.path.getsize(source_path))
+        circuit_breaker.record(token=breaker_token)
+        
+        # Hand over to the transcode stage; blocks while it is saturated so
+        # downloads cannot run arbitrarily far ahead of the encoders
+        job_store.update(download_id, status='transcode_queued', source_codec=result.get('acodec'))
+        progress.update(download_id, rooms, status='transcode_queued')
+        tracer.start(download_id, 'transcode_queued')
+        transcode_queue.put(download_id, source_path, title, cache_key, result.get('acodec'), result.get('duration'))
             
     except Exception as e:
         print(f"[ERROR] Download failed for {download_id}: {e}")
@@ -199,15 +380,324 @@ def download_task(download_id, url, output_dir):
         import traceback
         traceback.print_exc()
         
-        with downloads_lock:
-            downloads[download_id]['status'] = 'failed'
-            downloads[download_id]['error'] = str(e)
-            downloads[download_id]['failed_at'] = datetime.now().isoformat()
+        metrics.record_failure(phase, e)
+        circuit_breaker.record(e, token=breaker_token)
+        if retry_policy.should_retry(e, attempt):
+            # Identical jobs coalesced on this one keep waiting for the retry
+            schedule_retry(download_id, url, output_dir, cache_key, attempt, e)
+            return
+        if cache_key:
+            result_cache.fail(cache_key, e)
+        mark_download_failed(download_id, e)
+
+def schedule_retry(download_id, url, output_dir, cache_key, attempt, error):
+    """Send a failed download back to the queue once its backoff expires"""
+    delay = retry_policy.delay(attempt)
+    metrics.record_retry(error)
+    print(f"[INFO] Retrying {download_id} in {delay:.1f}s (attempt {attempt + 1}/{retry_policy.max_attempts})")
+    job_store.update(
+        download_id,
+        status='retry_scheduled',
+        attempts=attempt,
+        last_error=str(error),
+        next_retry_at=(datetime.now() + timedelta(seconds=delay)).isoformat()
+    )
+    progress.update(download_id, download_rooms(download_id), status='retry_scheduled', attempt=attempt,
+                    retry_in=round(delay, 1))
+    tracer.start(download_id, 'backoff')
+    retry_scheduler.schedule(delay, resubmit_download, download_id, url, output_dir, cache_key, attempt + 1)
+
+def resubmit_download(download_id, url, output_dir, cache_key, attempt):
+    """Retry scheduler callback: queue the next attempt of a download"""
+    tracer.end(download_id, 'backoff', cat='wait')
+    tracer.start(download_id, 'queued')
+    job_store.update(download_id, status='queued')
+    try:
+        download_queue.submit(download_id, url, output_dir, cache_key, attempt)
+    except QueueFullError:
+        # Wait for room without spending an attempt
+        job_store.update(download_id, status='retry_scheduled')
+        retry_scheduler.schedule(retry_policy.base_delay, resubmit_download, download_id, url, output_dir, cache_key, attempt)
+
+def transcode_task(download_id, source_path, title, cache_key=None, source_codec=None, duration=None):
+    """Background task for converting a downloaded file per the output policy (CPU stage)"""
+    print(f"[DEBUG] Starting transcode task for {download_id}: {source_path}")
+    tracer.end(download_id, 'transcode_queued', cat='wait')
+    job_store.update(download_id, status='transcoding')
+    progress.update(download_id, download_rooms(download_id), status='transcoding')
+    
+    try:
+        filepath = convertir_audio(
+            source_path, download_id, FFMPEG_LOCATION,
+            acodec=source_codec, duracion=duration, politica=output_policy
+        )
+        if not filepath or not os.path.exists(filepath):
+            raise RuntimeError(f"Conversion failed for {source_path}")
         
-        socketio.emit('download_error', {
-            'download_id': download_id,
-            'error': str(e)
-        }, namespace='/')
+        print(f"[DEBUG] Final filepath: {filepath}")
+        if cache_key:
+            result_cache.complete(cache_key, os.path.abspath(filepath), title=title)
+        mark_download_completed(download_id, filepath, title)
+    
+    except Exception as e:
+        # Conversion errors are already counted in the metrics by convertir_audio
+        print(f"[ERROR] Transcode failed for {download_id}: {e}")
+        if cache_key:
+            result_cache.fail(cache_key, e)
+        mark_download_failed(download_id, e)
+
+# Fixed-size worker pools: downloads (network) feed transcodes (CPU)
+download_gate = AdaptiveLimit(max(MIN_WORKERS, min(3, MAX_WORKERS))) if ADAPTIVE_WORKERS else None
+download_queue = JobQueue(
+    download_task, num_workers=MAX_WORKERS, max_size=MAX_QUEUE_SIZE, name='download-worker', gate=download_gate
+)
+transcode_queue = JobQueue(transcode_task, num_workers=MAX_TRANSCODE_WORKERS, max_size=TRANSCODE_QUEUE_SIZE, name='transcode-worker')
+
+# Saturation gauges, read on every scrape
+metrics.gauge(
+    'youtube2mp3_queue_depth', 'Jobs waiting per pipeline stage', ('stage',),
+    lambda: {'download': download_queue.depth(), 'transcode': transcode_queue.depth()}
+)
+metrics.gauge(
+    'youtube2mp3_active_workers', 'Jobs being processed per pipeline stage', ('stage',),
+    lambda: {'download': download_queue.active(), 'transcode': transcode_queue.active()}
+)
+metrics.gauge(
+    'youtube2mp3_workers', 'Worker pool size per pipeline stage', ('stage',),
+    lambda: {'download': download_queue.limit(), 'transcode': transcode_queue.limit()}
+)
+metrics.gauge(
+    'youtube2mp3_disk_free_bytes', 'Free space in DOWNLOAD_DIR',
+    callback=lambda: shutil.disk_usage(DOWNLOAD_DIR).free
+)
+
+concurrency_controller = None
+if ADAPTIVE_WORKERS:
+    concurrency_controller = ConcurrencyController(
+        download_gate, functools.partial(job_sample, metrics, bandwidth),
+        floor=MIN_WORKERS, ceiling=MAX_WORKERS, interval=ADAPTIVE_INTERVAL,
+        log=lambda message: print(f"[INFO] {message}")
+    ).start()
+
+# Configured YoutubeDL instances reused by each download and transcode worker
+ydl_pool = get_ydl_pool()
+
+# Index of finished files shared with the CLI, plus in-flight coalescing
+result_cache = get_result_cache()
+
+# Only the files of completed jobs are evicted (never partial downloads or the database)
+disk_quota = DiskQuota(
+    DOWNLOAD_DIR, job_store.completed_filepaths, mark_file_expired,
+    max_bytes=DOWNLOAD_QUOTA, ttl=DOWNLOAD_TTL, min_free_bytes=MIN_FREE_SPACE
+)
+if disk_quota.enabled:
+    disk_quota.start(QUOTA_SWEEP_INTERVAL)
+
+def schedule_downloads(urls, output_dir, batch_id=None):
+    """
+    Create a download record per URL and dispatch them (see dispatch_downloads).
+    
+    :param batch_id: Optional batch the downloads belong to (its room gets their progress)
+    :return: List of download IDs, in the same order as the URLs
+    :raises QueueFullError: If the new jobs do not fit in the queue (nothing is scheduled)
+    """
+    records = [{
+        'id': str(uuid.uuid4()),
+        'url': url,
+        'status': 'queued',
+        'output_dir': output_dir,
+        'batch_id': batch_id,
+        'created_at': datetime.now().isoformat()
+    } for url in urls]
+    
+    job_store.create_many(records)
+    try:
+        dispatch_downloads(records)
+    except QueueFullError:
+        job_store.delete_many([record['id'] for record in records])
+        raise
+    
+    return [record['id'] for record in records]
+
+def acquire_results(urls, codec):
+    """
+    Result key of each URL and its result_cache.acquire() outcome. The keys
+    match the URL against every yt-dlp extractor, so in eventlet mode this
+    runs through offload.call instead of on the loop.
+    
+    :return: List of (cache_key, status, value), in the same order as the URLs
+    """
+    acquired = []
+    for url in urls:
+        cache_key = result_key(url, codec, PREFERRED_QUALITY)
+        acquired.append((cache_key,) + result_cache.acquire(cache_key))
+    return acquired
+
+def dispatch_downloads(records):
+    """
+    Route each download record to the cheapest source: an existing file
+    (cache hit), an identical in-flight job (coalesced) or a new job on
+    the worker pool.
+    
+    :raises QueueFullError: If the new jobs do not fit in the queue (nothing is dispatched)
+    """
+    dispatched = []
+    jobs = []
+    acquired = offload.call(acquire_results, [record['url'] for record in records], output_policy.cache_codec)
+    for record, (cache_key, status, value) in zip(records, acquired):
+        dispatched.append((record['id'], status, value))
+        if status not in (HIT, COALESCED):
+            jobs.append((record['id'], record['url'], record['output_dir'], cache_key))
+        tracer.name_job(record['id'], f"{record['id'][:8]} {record['url']}")
+        tracer.start(record['id'], 'job')
+        tracer.start(record['id'], 'queued')
+    
+    # New jobs are accepted or rejected as a whole
+    try:
+        download_queue.submit_many(jobs)
+    except QueueFullError as e:
+        for _, _, _, cache_key in jobs:
+            result_cache.fail(cache_key, e)
+        raise
+    
+    for download_id, status, value in dispatched:
+        if status == HIT:
+            mark_download_completed(download_id, value['filepath'], value.get('title'), cached=True)
+        elif status == COALESCED:
+            job_store.update(download_id, coalesced=True)
+            value.add_done_callback(functools.partial(finish_coalesced_download, download_id))
+
+def resume_interrupted_downloads():
+    """
+    Re-dispatch the jobs that were queued or running when the server stopped.
+    Jobs that no longer fit in the queue are marked as failed.
+    
+    :return: Number of jobs dispatched again
+    """
+    resumed = 0
+    for record in job_store.iter_by_status(['queued', 'retry_scheduled', 'downloading', 'transcode_queued', 'transcoding']):
+        record.setdefault('output_dir', DOWNLOAD_DIR)
+        job_store.update(record['id'], status='queued')
+        try:
+            dispatch_downloads([record])
+            resumed += 1
+        except QueueFullError:
+            mark_download_failed(record['id'], 'Interrupted by a server restart and the queue is full')
+    return resumed
+
+def expand_playlist(batch_id, url, output_dir):
+    """
+    Background task: schedule every video of a playlist or channel as soon
+    as it is discovered, waiting while the download queue is full so the
+    expansion never runs far ahead of the workers.
+    """
+    state = playlists[batch_id]
+    try:
+        for video_url in iter_playlist_urls(url):
+            while True:
+                try:
+                    schedule_downloads([video_url], output_dir, batch_id)
+                    break
+                except QueueFullError:
+                    time.sleep(PLAYLIST_RETRY_INTERVAL)
+            with playlists_lock:
+                state['discovered'] += 1
+        with playlists_lock:
+            state['status'] = 'completed'
+    except Exception as e:
+        print(f"[ERROR] Playlist expansion failed for {url}: {e}")
+        with playlists_lock:
+            state['status'] = 'failed'
+            state['error'] = str(e)
+    finally:
+        playlist_slots.release()
+        with playlists_lock:
+            state['finished_at'] = datetime.now().isoformat()
+            snapshot = dict(state)
+        progress.emit('playlist_expanded', snapshot, [batch_room(batch_id)])
+
+def queue_full_response(error, requested=1):
+    """Build the HTTP response for a job submission rejected by the queue"""
+    if error.free_slots > 0:
+        # There is room, just not for this many jobs at once
+        status_code = 429
+        message = f'Too many URLs: {requested} requested, {error.free_slots} free slots in the queue'
+    else:
+        status_code = 503
+        message = 'Download queue is full, try again later'
+
+    response = jsonify({
+        'error': message,
+        'free_slots': error.free_slots,
+        'max_queue_size': MAX_QUEUE_SIZE
+    })
+    response.status_code = status_code
+    response.headers['Retry-After'] = str(QUEUE_RETRY_AFTER)
+    return response
+
+def start_stream_transcode(download_id, url, cache_key):
+    """
+    Extract a URL and start piping its best HTTP audio stream through FFmpeg.
+    
+    The pipeline releases its stream slot and records the job result
+    (and the result cache entry) when it finishes.
+    
+    :return: Started StreamingTranscode
+    """
+    import yt_dlp
+    from yt_dlp.networking import Request
+    from yt_dlp.postprocessor import FFmpegPostProcessor
+    
+    ydl_opts = {
+        'noplaylist': True,
+        'quiet': True,
+        'no_warnings': True,
+        'socket_timeout': 30,
+        'extractor_args': {'youtube': ['player_client=ios,mweb']}
+    }
+    if FFMPEG_LOCATION:
+        ydl_opts['ffmpeg_location'] = FFMPEG_LOCATION
+    
+    ydl = yt_dlp.YoutubeDL(ydl_opts)
+    try:
+        ffmpeg_path = FFmpegPostProcessor(ydl).executable
+        if not ffmpeg_path:
+            raise StreamingError('FFmpeg not found')
+        
+        with tracer.span(download_id, EXTRACT):
+            info, from_cache = extract_info_cached(ydl, url)
+        stream_format = select_stream_format(info)
+        tracer.start(download_id, 'stream')
+        title = info.get('title', 'audio')
+        output_path = os.path.splitext(ydl.prepare_filename(
+            info, outtmpl=os.path.join(DOWNLOAD_DIR, '%(title)s.%(ext)s')
+        ))[0] + '.mp3'
+        source = ydl.urlopen(Request(stream_format['url'], headers=stream_format.get('http_headers') or {}))
+    except Exception:
+        ydl.close()
+        raise
+    
+    print(f"[DEBUG] Streaming {url} (format {stream_format.get('format_id')}) to {output_path}")
+    job_store.update(download_id, title=title)
+    
+    def on_done(filepath, error):
+        stream_slots.release()
+        ydl.close()
+        tracer.end(download_id, 'stream', error=None if error is None else str(error))
+        if error is not None:
+            metrics.record_failure('stream', error)
+            result_cache.fail(cache_key, error)
+            mark_download_failed(download_id, error)
+        else:
+            metrics.written_bytes.inc(os.path.getsize(filepath))
+            result_cache.complete(cache_key, os.path.abspath(filepath), title=title)
+            mark_download_completed(download_id, filepath, title)
+    
+    transcode = StreamingTranscode(
+        ffmpeg_path, source, output_path,
+        bitrate=f'{PREFERRED_QUALITY}k', on_done=on_done, throttle=bandwidth.job().consume
+    )
+    return transcode.start()
 
 @app.route('/')
 def index():
@@ -228,28 +718,30 @@ def api_download():
     if not (url.startswith('http://') or url.startswith('https://')):
         return jsonify({'error': 'Invalid URL format'}), 400
     
-    # Generate unique download ID
-    download_id = str(uuid.uuid4())
+    # Hand the job to the worker pool (or reuse an existing result)
+    output_dir = data.get('output_dir', DOWNLOAD_DIR)
+    try:
+        download_id, = schedule_downloads([url], output_dir)
+    except QueueFullError as e:
+        return queue_full_response(e)
     
-    # Initialize download tracking
-    with downloads_lock:
-        downloads[download_id] = {
-            'id': download_id,
-            'url': url,
-            'status': 'pending',
-            'created_at': datetime.now().isoformat()
-        }
+    download = job_store.get(download_id)
     
-    # Start download in background thread
-    output_dir = data.get('output_dir', DOWNLOAD_DIR)
-    thread = threading.Thread(target=download_task, args=(download_id, url, output_dir))
-    thread.daemon = True
-    thread.start()
+    if download['status'] == 'completed':
+        return jsonify({
+            'success': True,
+            'download_id': download_id,
+            'status': 'completed',
+            'title': download.get('title'),
+            'filename': download.get('filename'),
+            'message': 'Download served from cache'
+        }), 200
     
     return jsonify({
         'success': True,
         'download_id': download_id,
-        'message': 'Download started'
+        'status': 'queued',
+        'message': 'Download queued'
     }), 202
 
 @app.route('/api/batch-download', methods=['POST'])
@@ -285,97 +777,362 @@ def api_batch_download():
     if not urls:
         return jsonify({'error': 'No valid URLs found'}), 400
     
-    # Start downloads for each URL
-    download_ids = []
+    # Queue a download for each URL
     output_dir = request.form.get('output_dir', DOWNLOAD_DIR) if not request.is_json else data.get('output_dir', DOWNLOAD_DIR)
     
-    for url in urls:
-        download_id = str(uuid.uuid4())
-        
-        with downloads_lock:
-            downloads[download_id] = {
-                'id': download_id,
-                'url': url,
-                'status': 'pending',
-                'created_at': datetime.now().isoformat()
-            }
-        
-        thread = threading.Thread(target=download_task, args=(download_id, url, output_dir))
-        thread.daemon = True
-        thread.start()
-        
-        download_ids.append(download_id)
+    # The whole batch is accepted or rejected, never half-queued
+    batch_id = str(uuid.uuid4())
+    try:
+        download_ids = schedule_downloads(urls, output_dir, batch_id)
+    except QueueFullError as e:
+        return queue_full_response(e, requested=len(urls))
     
     return jsonify({
         'success': True,
+        'batch_id': batch_id,
         'download_ids': download_ids,
         'count': len(download_ids),
-        'message': f'Started {len(download_ids)} downloads'
+        'message': f'Queued {len(download_ids)} downloads'
     }), 202
 
+@app.route('/api/playlist-download', methods=['POST'])
+def api_playlist_download():
+    """Expand a playlist or channel into the queue while its first videos download"""
+    data = request.get_json(silent=True) or {}
+    url = (data.get('url') or '').strip()
+    if not (url.startswith('http://') or url.startswith('https://')):
+        return jsonify({'error': 'Invalid URL format'}), 400
+    
+    if not playlist_slots.acquire(blocking=False):
+        response = jsonify({'error': 'Too many playlists being expanded, try again later'})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(QUEUE_RETRY_AFTER)
+        return response
+    
+    batch_id = str(uuid.uuid4())
+    with playlists_lock:
+        playlists[batch_id] = {
+            'batch_id': batch_id,
+            'url': url,
+            'status': 'expanding',
+            'discovered': 0,
+            'started_at': datetime.now().isoformat()
+        }
+    output_dir = data.get('output_dir', DOWNLOAD_DIR)
+    threading.Thread(
+        target=expand_playlist, args=(batch_id, url, output_dir), name=f'playlist-{batch_id[:8]}', daemon=True
+    ).start()
+    
+    return jsonify({
+        'success': True,
+        'batch_id': batch_id,
+        'status': 'expanding',
+        'message': 'Playlist expansion started, subscribe to the batch for its downloads'
+    }), 202
+
+@app.route('/api/playlist/<batch_id>', methods=['GET'])
+def api_playlist_status(batch_id):
+    """Expansion state of a playlist (videos discovered so far)"""
+    with playlists_lock:
+        state = playlists.get(batch_id)
+        state = dict(state) if state else None
+    if state is None:
+        return jsonify({'error': 'Playlist not found'}), 404
+    return jsonify(state)
+
 @app.route('/api/downloads', methods=['GET'])
 def api_downloads():
-    """Get list of all downloads"""
-    with downloads_lock:
-        return jsonify({
-            'downloads': list(downloads.values())
-        })
+    """Get a page of downloads, newest first (?status=a,b&limit=N&cursor=...)"""
+    statuses = [status for status in request.args.get('status', '').split(',') if status]
+    cursor = request.args.get('cursor')
+    try:
+        limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+        page, next_cursor = job_store.list(statuses, limit=limit, cursor=cursor)
+    except (ValueError, InvalidCursorError) as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return jsonify({
+        'downloads': page,
+        'next_cursor': next_cursor
+    })
 
 @app.route('/api/download/<download_id>', methods=['GET'])
 def api_download_status(download_id):
     """Get status of a specific download"""
-    with downloads_lock:
-        if download_id not in downloads:
-            return jsonify({'error': 'Download not found'}), 404
-        return jsonify(downloads[download_id])
+    download = job_store.get(download_id)
+    if download is None:
+        return jsonify({'error': 'Download not found'}), 404
+    return jsonify(download)
+
+@app.route('/api/download/<download_id>/trace', methods=['GET'])
+def api_download_trace(download_id):
+    """Trace of a job in the Chrome trace-event format (open it in Perfetto)"""
+    if not tracer.enabled:
+        return jsonify({'error': 'Tracing is disabled, start the server with TRACE_JOBS=1'}), 404
+    if job_store.get(download_id) is None:
+        return jsonify({'error': 'Download not found'}), 404
+    trace = tracer.trace(download_id)
+    if trace is None:
+        return jsonify({'error': 'No trace recorded for this download'}), 404
+    response = jsonify(trace)
+    response.headers['Content-Disposition'] = f'attachment; filename="trace-{download_id}.json"'
+    return response
+
+def send_finished_file(filepath, filename, mimetype):
+    """
+    Send a finished file as an attachment, answering conditional requests
+    (304/412) and single byte ranges (206/416) so clients can seek, resume
+    and revalidate; the bytes go through FILE_SENDING.
+    """
+    stat = os.stat(filepath)
+    # Even a 304 counts as a use for the LRU eviction
+    disk_quota.touch(filepath)
+    status, headers, byte_range = evaluate_request(request.headers, stat, request.method, FILE_CACHE_MAX_AGE)
+    headers['Content-Disposition'] = f"attachment; filename*=UTF-8''{quote(filename)}"
+    if status not in (200, 206):
+        return Response(status=status, headers=headers)
+    
+    handover = proxy_headers(FILE_SENDING, filepath, DOWNLOAD_DIR, X_ACCEL_PREFIX)
+    if handover:
+        # The proxy sends the body and answers the Range itself
+        for header in ('Content-Length', 'Content-Range'):
+            headers.pop(header, None)
+        headers.update(handover)
+        return Response(status=200, headers=headers, mimetype=mimetype)
+    if request.method == 'HEAD':
+        return Response(status=status, headers=headers, mimetype=mimetype)
+    
+    start, length = byte_range
+    file = open(filepath, 'rb')
+    if status == 200:
+        # The server's wsgi.file_wrapper can send the whole file with os.sendfile
+        body = wrap_file(request.environ, file)
+    else:
+        body = iter_file_range(file, start, length)
+    return Response(offload.iterate(body), status=status, headers=headers, mimetype=mimetype, direct_passthrough=True)
+
+def expired_response(download):
+    """410 for a job whose file was evicted: the client can download it again"""
+    return jsonify({
+        'error': 'File expired, start the download again',
+        'status': 'expired',
+        'expired_at': download.get('expired_at'),
+        'url': download.get('url')
+    }), 410
 
 @app.route('/api/download/<download_id>/file', methods=['GET'])
 def api_download_file(download_id):
-    """Download the MP3 file"""
+    """Download the audio file"""
     print(f"[DEBUG] File download requested for: {download_id}")
     
-    with downloads_lock:
-        if download_id not in downloads:
-            print(f"[DEBUG] Download ID not found: {download_id}")
-            return jsonify({'error': 'Download not found'}), 404
-        
-        download = downloads[download_id]
-        print(f"[DEBUG] Download status: {download['status']}")
-        
-        if download['status'] != 'completed':
-            return jsonify({'error': 'Download not completed yet'}), 400
-        
-        filepath = download.get('filepath')
-        filename = download.get('filename')
-        
-        print(f"[DEBUG] Filepath: {filepath}")
-        print(f"[DEBUG] Filename: {filename}")
-        print(f"[DEBUG] File exists: {os.path.exists(filepath) if filepath else False}")
-        
-        if not filepath or not os.path.exists(filepath):
-            return jsonify({'error': 'File not found', 'filepath': filepath}), 404
+    download = job_store.get(download_id)
+    if download is None:
+        print(f"[DEBUG] Download ID not found: {download_id}")
+        return jsonify({'error': 'Download not found'}), 404
+    
+    print(f"[DEBUG] Download status: {download['status']}")
+    
+    if download['status'] == 'expired':
+        return expired_response(download)
+    if download['status'] != 'completed':
+        return jsonify({'error': 'Download not completed yet'}), 400
+    
+    filepath = download.get('filepath')
+    filename = download.get('filename')
+    
+    print(f"[DEBUG] Filepath: {filepath}")
+    print(f"[DEBUG] Filename: {filename}")
+    print(f"[DEBUG] File exists: {os.path.exists(filepath) if filepath else False}")
+    
+    if not filepath or not os.path.exists(filepath):
+        if filepath:
+            # Deleted outside the quota sweeps: expire it like an eviction
+            mark_file_expired(filepath)
+            download = job_store.get(download_id) or download
+            if download.get('status') == 'expired':
+                return expired_response(download)
+        return jsonify({'error': 'File not found', 'filepath': filepath}), 404
     
     try:
-        return send_file(filepath, as_attachment=True, download_name=filename, mimetype='audio/mpeg')
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        return send_finished_file(filepath, filename, mimetype)
     except Exception as e:
         print(f"[ERROR] Failed to send file: {e}")
         import traceback
         traceback.print_exc()
         return jsonify({'error': f'Failed to send file: {str(e)}'}), 500
 
+def send_zip(records, archive_name):
+    """
+    Stream a ZIP of the finished files of some jobs; the archive is built
+    while it is sent (no temporary file, constant memory).
+
+    :param records: Iterable of job records (consumed lazily)
+    :param archive_name: File name offered to the client
+    """
+    def archive_entries():
+        for record in records:
+            if record.get('status') == 'completed' and record.get('filepath'):
+                disk_quota.touch(record['filepath'])
+                yield record['filepath'], record.get('filename') or os.path.basename(record['filepath'])
+    
+    entries = archive_entries()
+    first = offload.call(next, entries, None)
+    if first is None:
+        return jsonify({'error': 'No completed downloads to archive'}), 404
+    
+    body = offload.iterate(iter_zip(itertools.chain([first], entries)))
+    response = Response(body, mimetype='application/zip', direct_passthrough=True)
+    response.headers['Content-Disposition'] = f"attachment; filename*=UTF-8''{quote(archive_name)}"
+    # Let the proxy pass the archive on as it is produced
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/api/batch/<batch_id>/zip', methods=['GET'])
+def api_batch_zip(batch_id):
+    """Download every completed file of a batch as one ZIP"""
+    records = job_store.iter_by_batch(batch_id, ['completed'])
+    return send_zip(records, f"batch-{batch_id[:8]}.zip")
+
+@app.route('/api/downloads/zip', methods=['GET'])
+def api_downloads_zip():
+    """Download a selection of completed files as one ZIP (?ids=a,b,c)"""
+    download_ids = [download_id for download_id in request.args.get('ids', '').split(',') if download_id]
+    if not download_ids:
+        return jsonify({'error': 'No download ids provided'}), 400
+    if len(download_ids) > MAX_PAGE_SIZE:
+        return jsonify({'error': f'At most {MAX_PAGE_SIZE} downloads per archive'}), 400
+    return send_zip(job_store.get_many(download_ids), f"youtube2mp3-{datetime.now():%Y%m%d-%H%M%S}.zip")
+
+@app.route('/api/stream', methods=['GET'])
+def api_stream():
+    """Stream the MP3 while it is still being downloaded and transcoded (?url=...)"""
+    url = request.args.get('url', '').strip()
+    if not (url.startswith('http://') or url.startswith('https://')):
+        return jsonify({'error': 'Invalid URL format'}), 400
+    
+    # Streams are always encoded to MP3, whatever the output policy
+    [(cache_key, status, value)] = offload.call(acquire_results, [url], PREFERRED_CODEC)
+    
+    if status == COALESCED:
+        # Another job is producing this file: wait for it and serve the result
+        try:
+            value = offload.wait(value)
+        except Exception as e:
+            return jsonify({'error': f'Download failed: {e}'}), 502
+        status = HIT
+    
+    if status == HIT:
+        return send_finished_file(value['filepath'], os.path.basename(value['filepath']), 'audio/mpeg')
+    
+    try:
+        disk_quota.check_free_space()
+    except InsufficientStorageError as e:
+        result_cache.fail(cache_key, e)
+        return jsonify({'error': str(e)}), 507
+    
+    if not stream_slots.acquire(blocking=False):
+        result_cache.fail(cache_key, QueueFullError())
+        response = jsonify({'error': 'Too many streams in progress, try again later'})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(QUEUE_RETRY_AFTER)
+        return response
+    
+    download_id = str(uuid.uuid4())
+    now = datetime.now().isoformat()
+    job_store.create({
+        'id': download_id,
+        'url': url,
+        'status': 'downloading',
+        'output_dir': DOWNLOAD_DIR,
+        'created_at': now,
+        'started_at': now,
+        'streaming': True
+    })
+    tracer.name_job(download_id, f"{download_id[:8]} {url} (stream)")
+    tracer.start(download_id, 'job')
+    
+    try:
+        # Extraction and FFmpeg start-up run on their own threads, not on the event loop
+        transcode = offload.run(stream_starts, start_stream_transcode, download_id, url, cache_key)
+    except Exception as e:
+        print(f"[ERROR] Stream failed for {download_id}: {e}")
+        metrics.record_failure('stream', e)
+        stream_slots.release()
+        result_cache.fail(cache_key, e)
+        mark_download_failed(download_id, e)
+        return jsonify({'error': f'Stream failed: {e}', 'download_id': download_id}), 502
+    
+    filename = os.path.basename(transcode.output_path)
+    # On the event loop the buffer is polled: a slow or throttled stream holds no thread
+    response = Response(transcode.iter_chunks(sleep=offload.sleep), mimetype='audio/mpeg', direct_passthrough=True)
+    # If the client goes away before the body is consumed the file is still finished
+    response.call_on_close(transcode.detach)
+    response.headers['Content-Disposition'] = f"attachment; filename*=UTF-8''{quote(filename)}"
+    response.headers['X-Download-Id'] = download_id
+    return response
+
 @app.route('/api/health', methods=['GET'])
 def health():
     """Health check endpoint"""
     return jsonify({
         'status': 'healthy',
         'version': '1.0.0',
-        'downloads_dir': DOWNLOAD_DIR
+        'downloads_dir': DOWNLOAD_DIR,
+        'queue': download_queue.stats(),
+        'transcode_queue': transcode_queue.stats(),
+        'metadata_cache': get_metadata_cache().stats(),
+        'result_cache': result_cache.stats(),
+        'output_policy': output_policy.stats(),
+        'progress': progress.stats(),
+        'bandwidth': bandwidth.stats(),
+        'ydl_pool': ydl_pool.stats(),
+        'concurrency': concurrency_controller.stats() if concurrency_controller else None,
+        'retries': {
+            'max_attempts': retry_policy.max_attempts,
+            'scheduled': retry_scheduler.pending(),
+            'circuit_breaker': circuit_breaker.stats()
+        },
+        'metrics': metrics.summary(),
+        'disk_free_bytes': shutil.disk_usage(DOWNLOAD_DIR).free,
+        'disk_quota': disk_quota.stats(),
+        'jobs': job_store.count_by_status()
+    })
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Metrics in the Prometheus text format"""
+    return Response(metrics.render(), content_type=METRICS_CONTENT_TYPE)
+
+@app.route('/api/bandwidth', methods=['GET', 'PUT'])
+def api_bandwidth():
+    """Read or change the bandwidth budget ({"limit": "4M", "per_job_limit": "1M"}, null = unlimited)"""
+    if request.method == 'PUT':
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({'error': 'JSON body required'}), 400
+        try:
+            limit = parse_rate(data['limit']) if 'limit' in data else bandwidth.rate
+            per_job_limit = parse_rate(data['per_job_limit']) if 'per_job_limit' in data else bandwidth.per_job_rate
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        bandwidth.set_limits(limit, per_job_limit)
+        print(f"[INFO] Bandwidth limits changed: total {limit or 'unlimited'}, per job {per_job_limit or 'unlimited'}")
+    return jsonify(bandwidth.stats())
+
+@app.route('/api/cache/stats', methods=['GET'])
+def api_cache_stats():
+    """Hit, miss and coalesce counters of the caches"""
+    return jsonify({
+        'results': result_cache.stats(),
+        'metadata': get_metadata_cache().stats()
     })
 
 @socketio.on('connect')
 def handle_connect():
     """Handle WebSocket connection"""
     print(f"[DEBUG] Client connected")
+    progress.start()
     emit('connected', {'message': 'Connected to YouTube2MP3 server'})
 
 @socketio.on('disconnect')
@@ -383,16 +1140,62 @@ def handle_disconnect():
     """Handle WebSocket disconnection"""
     print(f"[DEBUG] Client disconnected")
 
+@socketio.on('subscribe')
+def handle_subscribe(data):
+    """Join the rooms of some jobs and/or batches and send the jobs' current state"""
+    data = data if isinstance(data, dict) else {}
+    download_ids = [str(download_id) for download_id in data.get('download_ids') or []][:MAX_PAGE_SIZE]
+    batch_ids = [str(batch_id) for batch_id in data.get('batch_ids') or []][:MAX_PAGE_SIZE]
+    
+    for download_id in download_ids:
+        join_room(job_room(download_id))
+    for batch_id in batch_ids:
+        join_room(batch_room(batch_id))
+    
+    # Jobs without live progress (not started yet or already finished) come from the store
+    updates = progress.snapshot(download_ids)
+    missing = [download_id for download_id in download_ids if download_id not in updates]
+    for record in job_store.get_many(missing):
+        updates[record['id']] = {
+            key: record[key] for key in ('status', 'title', 'filename', 'error') if key in record
+        }
+    if updates:
+        emit(PROGRESS_EVENT, {'updates': updates})
+
+@socketio.on('unsubscribe')
+def handle_unsubscribe(data):
+    """Leave the rooms of some jobs and/or batches"""
+    data = data if isinstance(data, dict) else {}
+    for download_id in data.get('download_ids') or []:
+        leave_room(job_room(str(download_id)))
+    for batch_id in data.get('batch_ids') or []:
+        leave_room(batch_room(str(batch_id)))
+
 @socketio.on('ping')
 def handle_ping():
     """Handle ping from client"""
     emit('pong')
 
 if __name__ == '__main__':
+    setup_console_encoding()
     print("=" * 60)
     print("YouTube2MP3 Web Server")
     print("=" * 60)
     print(f"Download directory: {DOWNLOAD_DIR}")
+    if ADAPTIVE_WORKERS:
+        print(f"Workers: adaptive {MIN_WORKERS}-{MAX_WORKERS}, starting at {download_gate.limit} (queue size: {MAX_QUEUE_SIZE})")
+    else:
+        print(f"Workers: {MAX_WORKERS} (queue size: {MAX_QUEUE_SIZE})")
+    print(f"Transcode workers: {MAX_TRANSCODE_WORKERS} (queue size: {TRANSCODE_QUEUE_SIZE})")
+    print(f"Retries: up to {retry_policy.max_attempts} attempts per download (backoff {retry_policy.base_delay:g}-{retry_policy.max_delay:g}s)")
+    print(f"Output policy: {output_policy.mode} (accepted codecs: {', '.join(output_policy.accepted_codecs)})")
+    print(f"Job store: {JOBS_DB}")
+    print(f"Serving mode: {ASYNC_MODE}")
+    print(f"Log file: {setup_logging()}")
+    
+    resumed = resume_interrupted_downloads()
+    if resumed:
+        print(f"Resumed {resumed} interrupted download(s)")
     
     if FFMPEG_LOCATION:
         print(f"FFmpeg location: {FFMPEG_LOCATION}")
@@ -401,8 +1204,9 @@ if __name__ == '__main__':
         print("   Please run: python setup_ffmpeg.py")
         print("   Or install FFmpeg and add to PATH")
     
-    print(f"Starting server on http://localhost:5000")
+    print(f"Starting server on http://localhost:{PORT}")
     print("=" * 60)
     
-    # Run the Flask-SocketIO server
-    socketio.run(app, host='0.0.0.0', port=5000, debug=True, use_reloader=False, log_output=True)
+    # Run the Flask-SocketIO server: Werkzeug in threading mode, eventlet's WSGI server otherwise
+    progress.start()
+    socketio.run(app, host=HOST, port=PORT, debug=ASYNC_MODE == THREADING, use_reloader=False, log_output=True)
@@ -0,0 +1,173 @@
+"""
+Process-wide bandwidth budget: a token bucket shared by every download,
+plus an optional cap per job, both adjustable while downloads are running
+"""
+import re
+import threading
+import time
+
+# Seconds of traffic a bucket may accumulate while idle (burst size)
+BURST_SECONDS = 1.0
+
+_RATE_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+
+def parse_rate(value):
+    """
+    Parse a rate in bytes per second: a number or a yt-dlp style string
+    such as '500K' or '4.2M'. Empty, zero or None mean unlimited.
+
+    :return: Bytes per second, or None for unlimited
+    :raises ValueError: If the value cannot be parsed
+    """
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        rate = float(value)
+    else:
+        if not str(value).strip():
+            return None
+        match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([KMG]?)(?:i?B)?(?:/s)?\s*', str(value), re.IGNORECASE)
+        if not match:
+            raise ValueError(f"Invalid rate: {value!r} (expected bytes per second, e.g. 500K or 4.2M)")
+        rate = float(match.group(1)) * _RATE_UNITS[match.group(2).upper()]
+    if rate < 0:
+        raise ValueError(f"Invalid rate: {value!r} (must not be negative)")
+    return rate or None
+
+
+class TokenBucket:
+    """
+    Token bucket in bytes. Callers reserve the bytes they just transferred
+    and sleep for the returned time, so the debt of a big chunk is paid by
+    that caller and the long-run rate stays at the configured ceiling.
+    """
+
+    def __init__(self, rate=None):
+        """
+        :param rate: Bytes per second (None: unlimited)
+        """
+        self._lock = threading.Lock()
+        self._rate = None
+        self._tokens = 0.0
+        self._updated = time.monotonic()
+        self.set_rate(rate)
+
+    @property
+    def rate(self):
+        return self._rate
+
+    def _refill(self, now):
+        if self._rate:
+            self._tokens = min(self._tokens + (now - self._updated) * self._rate, self._rate * BURST_SECONDS)
+        self._updated = now
+
+    def set_rate(self, rate):
+        """Change the rate; the debt already reserved is paid at the new rate"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._rate = rate or None
+            if self._rate is None:
+                self._tokens = 0.0
+            else:
+                self._tokens = min(self._tokens, self._rate * BURST_SECONDS)
+
+    def reserve(self, nbytes):
+        """
+        Take nbytes from the bucket.
+
+        :return: Seconds the caller has to wait to stay within the rate
+        """
+        with self._lock:
+            if not self._rate:
+                return 0.0
+            self._refill(time.monotonic())
+            self._tokens -= nbytes
+            return -self._tokens / self._rate if self._tokens < 0 else 0.0
+
+
+class JobThrottle:
+    """Throttle of a single job: the shared budget plus the job's own cap"""
+
+    def __init__(self, limiter):
+        self._limiter = limiter
+        self._bucket = TokenBucket(limiter.per_job_rate)
+        self._last_bytes = {}  # file name -> bytes seen so far
+
+    def consume(self, nbytes):
+        """Account for nbytes just transferred, sleeping if over budget"""
+        if nbytes <= 0:
+            return
+        limiter = self._limiter
+        if self._bucket.rate != limiter.per_job_rate:
+            self._bucket.set_rate(limiter.per_job_rate)
+        wait = max(limiter.bucket.reserve(nbytes), self._bucket.reserve(nbytes))
+        limiter.record(nbytes, wait)
+        if wait > 0:
+            time.sleep(wait)
+
+    def progress_hook(self, d):
+        """yt-dlp progress hook: throttles the downloading thread itself"""
+        if d.get('status') != 'downloading':
+            return
+        downloaded = d.get('downloaded_bytes') or 0
+        name = d.get('tmpfilename') or d.get('filename')
+        last = self._last_bytes.get(name, 0)
+        # A restarted download starts counting again
+        self._last_bytes[name] = downloaded
+        self.consume(downloaded - last if downloaded >= last else downloaded)
+
+
+class BandwidthLimiter:
+    """Shared budget for every download of the process"""
+
+    def __init__(self, rate=None, per_job_rate=None):
+        """
+        :param rate: Total bytes per second for all jobs (None: unlimited)
+        :param per_job_rate: Bytes per second for any single job (None: unlimited)
+        """
+        self.bucket = TokenBucket(rate)
+        self.per_job_rate = per_job_rate or None
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.throttled_seconds = 0.0
+
+    @property
+    def rate(self):
+        return self.bucket.rate
+
+    def set_limits(self, rate=None, per_job_rate=None):
+        """Change the total and per-job rates (running downloads pick them up)"""
+        self.bucket.set_rate(rate)
+        self.per_job_rate = per_job_rate or None
+
+    def job(self):
+        """New throttle for a job (use its progress_hook or consume())"""
+        return JobThrottle(self)
+
+    def record(self, nbytes, wait):
+        with self._lock:
+            self.bytes += nbytes
+            self.throttled_seconds += wait
+
+    def stats(self):
+        with self._lock:
+            return {
+                'limit': self.rate,
+                'per_job_limit': self.per_job_rate,
+                'bytes': self.bytes,
+                'throttled_seconds': round(self.throttled_seconds, 3),
+            }
+
+
+_default_limiter = None
+_default_limiter_lock = threading.Lock()
+
+
+def get_bandwidth_limiter():
+    """Process-wide limiter (unlimited until set_limits() is called)"""
+    global _default_limiter
+    with _default_limiter_lock:
+        if _default_limiter is None:
+            _default_limiter = BandwidthLimiter()
+        return _default_limiter
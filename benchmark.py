@@ -0,0 +1,390 @@
+"""
+Offline end-to-end throughput benchmark: serves generated audio/video files
+from a local HTTP server and runs descargar_audio_mp3 (sync) and
+procesar_urls_async (async) against it through yt-dlp's generic extractor,
+sweeping the concurrency, file sizes and codecs. Needs FFmpeg, never
+touches YouTube.
+
+    python benchmark.py --concurrency 1,3,6 --sizes 1,10 --codecs aac,opus --output results.json
+    python benchmark.py --baseline results.json  # exit code 1 on a throughput regression
+    python benchmark.py --ydl-overhead --modes ''  # per-job cost of a new YoutubeDL vs a warm one
+"""
+import argparse
+import asyncio
+import functools
+import http.server
+import json
+import math
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from output_policy import OutputPolicy, POLICIES, MP3, DEFAULT_ACCEPTED_CODECS
+
+# Codec -> (file extension, FFmpeg input and encoding arguments); the
+# bitrate is filled in so the files reach the requested size
+AUDIO_BITRATE = 128_000
+VIDEO_BITRATE = 1_000_000
+CODECS = {
+    'aac': ('m4a', ['-f', 'lavfi', '-i', 'sine=frequency=440:duration={duration}', '-c:a', 'aac', '-b:a', '{audio}']),
+    'opus': ('webm', ['-f', 'lavfi', '-i', 'sine=frequency=440:duration={duration}', '-c:a', 'libopus', '-b:a', '{audio}']),
+    'mp3': ('mp3', ['-f', 'lavfi', '-i', 'sine=frequency=440:duration={duration}', '-c:a', 'libmp3lame', '-b:a', '{audio}']),
+    'h264': ('mp4', [
+        '-f', 'lavfi', '-i', 'testsrc=size=640x360:rate=25:duration={duration}',
+        '-f', 'lavfi', '-i', 'sine=frequency=440:duration={duration}',
+        '-c:v', 'libx264', '-preset', 'ultrafast', '-b:v', '{video}', '-c:a', 'aac', '-b:a', '{audio}', '-shortest',
+    ]),
+}
+MIME_TYPES = {'.m4a': 'audio/mp4', '.webm': 'audio/webm', '.mp3': 'audio/mpeg', '.mp4': 'video/mp4'}
+
+MODES = ('sync', 'async')
+
+
+def parse_list(value, convert=str):
+    """Comma separated list ('1,3,6') converted item by item"""
+    return [convert(item.strip()) for item in value.split(',') if item.strip()]
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a list of numbers (None if empty)"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(math.ceil(fraction * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+def generate_media(ffmpeg, media_dir, codec, size_mb):
+    """
+    Generate a test file of roughly size_mb megabytes (cached in media_dir).
+
+    :return: File name inside media_dir
+    """
+    extension, arguments = CODECS[codec]
+    name = f"{codec}-{size_mb:g}mb.{extension}"
+    path = os.path.join(media_dir, name)
+    if os.path.exists(path):
+        return name
+
+    bitrate = AUDIO_BITRATE + (VIDEO_BITRATE if codec == 'h264' else 0)
+    duration = max(size_mb * 1024 * 1024 * 8 / bitrate, 1)
+    arguments = [a.format(duration=f"{duration:.1f}", audio=AUDIO_BITRATE, video=VIDEO_BITRATE) for a in arguments]
+    subprocess.run(
+        [ffmpeg, '-hide_banner', '-loglevel', 'error', '-y', *arguments, path],
+        check=True, stdin=subprocess.DEVNULL
+    )
+    return name
+
+
+class MediaRequestHandler(http.server.SimpleHTTPRequestHandler):
+    """
+    Serves the generated files under any number of unique names: a request
+    for /<prefix>_<file> returns <file>, so every job gets its own URL,
+    title and output file without copying the media
+    """
+
+    extensions_map = dict(http.server.SimpleHTTPRequestHandler.extensions_map, **MIME_TYPES)
+
+    def translate_path(self, path):
+        directory, _, name = path.split('?', 1)[0].rpartition('/')
+        return super().translate_path(f"{directory}/{name.split('_', 1)[-1]}")
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MediaServer:
+    """Local HTTP server for the benchmark media, on a background thread"""
+
+    def __init__(self, media_dir):
+        handler = functools.partial(MediaRequestHandler, directory=media_dir)
+        self._server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name='media-server', daemon=True)
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+
+def cpu_seconds():
+    """CPU time of this process and its finished children (FFmpeg)"""
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def run_sync(urls, output_dir):
+    """Download the URLs one after the other; returns (ok, latencies in seconds)"""
+    from descargar_audio import descargar_audio_mp3
+
+    ok = 0
+    latencies = []
+    for i, url in enumerate(urls, 1):
+        start = time.perf_counter()
+        if descargar_audio_mp3(url, output_dir, f"S{i:02d}", show_animation=False):
+            ok += 1
+        latencies.append(time.perf_counter() - start)
+    return ok, latencies
+
+
+def run_async(urls, output_dir, max_concurrent, max_transcodes):
+    """Download the URLs with the async scheduler; returns (ok, latencies in seconds)"""
+    from descargar_audio import procesar_urls_async
+    from tracing import enable_tracing, now_us
+
+    # The per-job latency comes from the 'job' spans of the trace
+    tracer = enable_tracing()
+    started = now_us()
+    ok, _ = asyncio.run(procesar_urls_async(urls, output_dir, max_concurrent, max_transcodes))
+    latencies = [
+        event['dur'] / 1e6 for event in tracer.trace()['traceEvents']
+        if event.get('cat') == 'job' and event['ts'] >= started
+    ]
+    return ok, latencies
+
+
+def measure_ydl_overhead(base_url, media_name, jobs):
+    """
+    Per-job fixed cost of yt-dlp: extract every URL with a new YoutubeDL
+    per job (the old behaviour) and with the warm instance of a YdlPool.
+
+    :return: Result dict with the mean seconds per job of each variant
+    """
+    import yt_dlp
+    from ydl_pool import YdlPool
+
+    options = {'quiet': True, 'no_warnings': True, 'noplaylist': True, 'format': 'bestaudio/best'}
+
+    def timed(extract, prefix):
+        # Unique URLs so both variants do the same extraction work
+        urls = [f"{base_url}/{prefix}{job:03d}_{media_name}" for job in range(1, jobs + 1)]
+        start = time.perf_counter()
+        for url in urls:
+            extract(url)
+        return (time.perf_counter() - start) / jobs
+
+    def cold(url):
+        with yt_dlp.YoutubeDL(options) as ydl:
+            ydl.extract_info(url, download=False)
+
+    pool = YdlPool()
+
+    def warm(url):
+        with pool.job(dict(options, outtmpl='%(title)s.%(ext)s')) as ydl:
+            ydl.extract_info(url, download=False)
+
+    start = time.perf_counter()
+    yt_dlp.YoutubeDL(options).close()
+    construction = time.perf_counter() - start
+    # One untimed warm-up: imports and the first instance are paid by both variants
+    warm(f"{base_url}/warmup_{media_name}")
+    cold_seconds = timed(cold, 'c')
+    warm_seconds = timed(warm, 'w')
+    pool.close_thread()
+    return {
+        'media': media_name,
+        'jobs': jobs,
+        'construction_seconds': round(construction, 4),
+        'cold_seconds_per_job': round(cold_seconds, 4),
+        'warm_seconds_per_job': round(warm_seconds, 4),
+        'saved_seconds_per_job': round(cold_seconds - warm_seconds, 4),
+        'saved_fraction': round(1 - warm_seconds / cold_seconds, 3) if cold_seconds else None,
+    }
+
+
+def run_case(base_url, media_name, media_bytes, work_dir, run_number, mode, jobs, max_concurrent, max_transcodes):
+    """
+    Run one point of the sweep in a fresh output directory.
+
+    :return: Result dict (throughput, latency percentiles, CPU utilization)
+    """
+    # Unique names so no job is served from the result or metadata caches
+    urls = [f"{base_url}/r{run_number:03d}j{job:03d}_{media_name}" for job in range(1, jobs + 1)]
+    output_dir = os.path.join(work_dir, f"run-{run_number:03d}")
+    os.makedirs(output_dir)
+
+    cpu_before = cpu_seconds()
+    start = time.perf_counter()
+    if mode == 'sync':
+        ok, latencies = run_sync(urls, output_dir)
+    else:
+        ok, latencies = run_async(urls, output_dir, max_concurrent, max_transcodes)
+    wall = time.perf_counter() - start
+    cpu = cpu_seconds() - cpu_before
+    shutil.rmtree(output_dir, ignore_errors=True)
+
+    return {
+        'mode': mode,
+        'media': media_name,
+        'max_concurrent': max_concurrent if mode == 'async' else 1,
+        'jobs': jobs,
+        'ok': ok,
+        'failed': jobs - ok,
+        'media_bytes': media_bytes,
+        'wall_seconds': round(wall, 3),
+        'jobs_per_minute': round(ok * 60 / wall, 2) if wall else None,
+        'mb_per_second': round(ok * media_bytes / (1024 * 1024) / wall, 3) if wall else None,
+        'latency_p50': round(percentile(latencies, 0.5), 3) if latencies else None,
+        'latency_p95': round(percentile(latencies, 0.95), 3) if latencies else None,
+        'cpu_seconds': round(cpu, 3),
+        # Share of all cores used during the run
+        'cpu_utilization': round(cpu / wall / (os.cpu_count() or 1), 3) if wall else None,
+    }
+
+
+def result_id(result):
+    return (result['mode'], result['media'], result['max_concurrent'])
+
+
+def compare_to_baseline(results, baseline, tolerance):
+    """
+    Points of the sweep whose throughput fell more than `tolerance` (a
+    fraction) below the baseline run.
+
+    :return: List of (result, baseline jobs per minute)
+    """
+    previous = {result_id(result): result for result in baseline.get('results', [])}
+    regressions = []
+    for result in results:
+        before = previous.get(result_id(result))
+        if not before or not before.get('jobs_per_minute') or result['jobs_per_minute'] is None:
+            continue
+        if result['jobs_per_minute'] < before['jobs_per_minute'] * (1 - tolerance):
+            regressions.append((result, before['jobs_per_minute']))
+    return regressions
+
+
+def environment(ffmpeg):
+    """Versions and hardware the results were measured on"""
+    import yt_dlp
+
+    ffmpeg_version = subprocess.run(
+        [ffmpeg, '-version'], capture_output=True, text=True, stdin=subprocess.DEVNULL
+    ).stdout.split('\n', 1)[0]
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'yt_dlp': yt_dlp.version.__version__,
+        'ffmpeg': ffmpeg_version,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline throughput benchmark against a local media server')
+    parser.add_argument('--modes', default='sync,async', help='Modes to run: sync, async (default: both)')
+    parser.add_argument('--concurrency', default='1,3,6', help='max_concurrent values for the async mode (default: 1,3,6)')
+    parser.add_argument('--max-transcodes', type=int, default=os.cpu_count() or 1,
+                        help='Concurrent conversions in the async mode (default: number of CPUs)')
+    parser.add_argument('--sizes', default='1,10', help='File sizes in MB (default: 1,10)')
+    parser.add_argument('--codecs', default='aac,opus', help=f"Source codecs: {', '.join(CODECS)} (default: aac,opus)")
+    parser.add_argument('--jobs', type=int, default=6, help='Jobs per point of the sweep (default: 6)')
+    parser.add_argument('--output-policy', choices=POLICIES, default=MP3, help='Output policy of the conversions (default: mp3)')
+    parser.add_argument('--ydl-overhead', action='store_true',
+                        help='Also measure the per-job cost of a new YoutubeDL against a warm per-worker one')
+    parser.add_argument('--ffmpeg', default=shutil.which('ffmpeg'), help='FFmpeg executable (default: from PATH)')
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    parser.add_argument('--baseline', help='Results JSON of a previous run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Allowed throughput drop against the baseline, as a fraction (default: 0.2)')
+    args = parser.parse_args()
+
+    modes = parse_list(args.modes)
+    codecs = parse_list(args.codecs)
+    unknown = [m for m in modes if m not in MODES] + [c for c in codecs if c not in CODECS]
+    if unknown:
+        parser.error(f"Unknown modes or codecs: {', '.join(unknown)}")
+    if not args.ffmpeg:
+        parser.error('FFmpeg not found, install it or pass --ffmpeg')
+    if args.jobs < 1:
+        parser.error('--jobs must be at least 1')
+
+    work_dir = tempfile.mkdtemp(prefix='youtube2mp3-bench-')
+    # Isolated caches: results and metadata from other runs must not be reused
+    os.environ['CACHE_DIR'] = os.path.join(work_dir, 'cache')
+
+    import descargar_audio
+
+    descargar_audio.politica_salida = OutputPolicy(
+        args.output_policy, DEFAULT_ACCEPTED_CODECS, descargar_audio.PREFERRED_QUALITY
+    )
+    descargar_audio.setup_logging()
+
+    results = []
+    overhead = []
+    media_dir = os.path.join(work_dir, 'media')
+    os.makedirs(media_dir)
+    try:
+        with MediaServer(media_dir) as server:
+            run_number = 0
+            for codec in codecs:
+                for size_mb in parse_list(args.sizes, float):
+                    media_name = generate_media(args.ffmpeg, media_dir, codec, size_mb)
+                    media_bytes = os.path.getsize(os.path.join(media_dir, media_name))
+                    if args.ydl_overhead:
+                        overhead.append(measure_ydl_overhead(server.base_url, media_name, args.jobs))
+                        print(f"[BENCH] ydl   {media_name:18s}: {overhead[-1]['cold_seconds_per_job']} s/job new, "
+                              f"{overhead[-1]['warm_seconds_per_job']} s/job warm "
+                              f"({overhead[-1]['saved_seconds_per_job']} s saved per job)", flush=True)
+                    for mode in modes:
+                        for max_concurrent in (parse_list(args.concurrency, int) if mode == 'async' else [1]):
+                            run_number += 1
+                            result = run_case(
+                                server.base_url, media_name, media_bytes, work_dir, run_number,
+                                mode, args.jobs, max_concurrent, args.max_transcodes
+                            )
+                            results.append(result)
+                            print(f"[BENCH] {mode:5s} {media_name:18s} x{result['max_concurrent']}: "
+                                  f"{result['jobs_per_minute']} jobs/min, {result['mb_per_second']} MB/s, "
+                                  f"p50 {result['latency_p50']} s, p95 {result['latency_p95']} s, "
+                                  f"CPU {result['cpu_utilization']}, {result['failed']} failed", flush=True)
+    finally:
+        descargar_audio.renderer.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        'environment': environment(args.ffmpeg),
+        'config': {
+            'jobs': args.jobs, 'max_transcodes': args.max_transcodes, 'output_policy': args.output_policy,
+        },
+        'results': results,
+    }
+    if overhead:
+        report['ydl_overhead'] = overhead
+    if args.output:
+        tmp_path = f"{args.output}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        os.replace(tmp_path, args.output)
+    else:
+        print(json.dumps(report, indent=2))
+
+    exit_code = 1 if any(result['failed'] for result in results) else 0
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            regressions = compare_to_baseline(results, json.load(f), args.tolerance)
+        for result, before in regressions:
+            print(f"[REGRESSION] {result['mode']} {result['media']} x{result['max_concurrent']}: "
+                  f"{result['jobs_per_minute']} jobs/min (baseline {before})")
+        if regressions:
+            exit_code = 1
+    return exit_code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,193 @@
+"""
+Cold-start benchmark of the entry points: runs each command in a fresh
+interpreter several times and reports its wall time, plus the heavy
+modules it imported. --help, --version and argument errors of the CLI
+must not load yt-dlp or asyncio.
+
+    python benchmark_startup.py --runs 10 --output startup.json
+    python benchmark_startup.py --baseline startup.json  # exit code 1 on a regression
+"""
+import argparse
+import json
+import os
+import platform
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmark import parse_list, percentile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CLI = os.path.join(HERE, 'descargar_audio.py')
+
+# Entry point -> command line (run from the project directory)
+COMMANDS = {
+    'cli_help': [CLI, '--help'],
+    'cli_version': [CLI, '--version'],
+    'cli_bad_args': [CLI, '--max-transcodes', 'many'],
+    'web_import': ['-c', 'import app'],
+}
+
+# Exit code of a healthy run (argparse exits with 2 on bad arguments); a
+# crashing entry point would otherwise look fast
+EXPECTED_EXIT_CODES = {'cli_bad_args': 2}
+
+# Modules an entry point must not import
+HEAVY_MODULES = ('yt_dlp', 'asyncio', 'concurrent.futures')
+FORBIDDEN_IMPORTS = {
+    'cli_help': ('yt_dlp', 'asyncio', 'concurrent.futures'),
+    'cli_version': ('yt_dlp', 'asyncio', 'concurrent.futures'),
+    'cli_bad_args': ('yt_dlp', 'asyncio', 'concurrent.futures'),
+    'web_import': ('yt_dlp',),
+}
+
+# Absolute slack on top of the relative tolerance: startup times of a few
+# tens of milliseconds are noisy
+MIN_SLACK_SECONDS = 0.02
+
+_IMPORT_LINE = re.compile(r'import time:\s+(\d+)\s+\|\s+(\d+)\s+\|\s*(\S+)')
+
+
+def parse_importtime(stderr):
+    """
+    Modules listed by `python -X importtime`, with their cumulative time.
+
+    :return: Dict module name -> cumulative microseconds
+    """
+    modules = {}
+    for line in stderr.splitlines():
+        match = _IMPORT_LINE.match(line)
+        if match:
+            modules[match.group(3)] = int(match.group(2))
+    return modules
+
+
+def command_environment(work_dir):
+    """Environment of the runs: every directory the entry points write to is temporary"""
+    return dict(
+        os.environ,
+        DOWNLOAD_DIR=os.path.join(work_dir, 'downloads'),
+        LOGS_DIR=os.path.join(work_dir, 'logs'),
+        CACHE_DIR=os.path.join(work_dir, 'cache'),
+    )
+
+
+def measure_command(name, runs, work_dir, python=sys.executable, timeout=60):
+    """
+    Start the entry point `runs` times (after one warm-up run that also
+    records the imported modules) and time each process.
+
+    :return: Result dict with the wall time percentiles and the imports
+    """
+    command = [python, *COMMANDS[name]]
+    env = command_environment(work_dir)
+    profile = subprocess.run(
+        [python, '-X', 'importtime', *COMMANDS[name]], cwd=HERE, env=env, capture_output=True,
+        text=True, timeout=timeout, stdin=subprocess.DEVNULL
+    )
+    imports = parse_importtime(profile.stderr)
+
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=HERE, env=env, capture_output=True, timeout=timeout, stdin=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+
+    slowest = sorted(imports.items(), key=lambda item: item[1], reverse=True)
+    return {
+        'command': name,
+        'runs': runs,
+        'exit_code': profile.returncode,
+        'ok': profile.returncode == EXPECTED_EXIT_CODES.get(name, 0),
+        'median_seconds': round(percentile(times, 0.5), 4) if times else None,
+        'p95_seconds': round(percentile(times, 0.95), 4) if times else None,
+        'min_seconds': round(min(times), 4) if times else None,
+        'heavy_imports': [module for module in HEAVY_MODULES if module in imports],
+        'forbidden_imports': [module for module in FORBIDDEN_IMPORTS.get(name, ()) if module in imports],
+        'slowest_imports_ms': {module: round(us / 1000, 1) for module, us in slowest[:8] if '.' not in module},
+    }
+
+
+def find_regressions(results, baseline, tolerance):
+    """
+    Entry points whose median start time grew more than `tolerance` (a
+    fraction, plus MIN_SLACK_SECONDS) over the baseline run.
+
+    :return: List of (result, baseline median seconds)
+    """
+    previous = {result['command']: result for result in baseline.get('results', [])}
+    regressions = []
+    for result in results:
+        before = previous.get(result['command'])
+        if not before or before.get('median_seconds') is None or result['median_seconds'] is None:
+            continue
+        if result['median_seconds'] > before['median_seconds'] * (1 + tolerance) + MIN_SLACK_SECONDS:
+            regressions.append((result, before['median_seconds']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cold-start time of the CLI and web entry points')
+    parser.add_argument('--commands', default=','.join(COMMANDS),
+                        help=f"Entry points to measure: {', '.join(COMMANDS)} (default: all)")
+    parser.add_argument('--runs', type=int, default=10, help='Timed runs per entry point (default: 10)')
+    parser.add_argument('--python', default=sys.executable, help='Interpreter to run the entry points with')
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    parser.add_argument('--baseline', help='Results JSON of a previous run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Allowed growth of the median start time over the baseline, as a fraction (default: 0.2)')
+    args = parser.parse_args()
+
+    commands = parse_list(args.commands)
+    unknown = [command for command in commands if command not in COMMANDS]
+    if unknown:
+        parser.error(f"Unknown entry points: {', '.join(unknown)}")
+    if args.runs < 1:
+        parser.error('--runs must be at least 1')
+
+    work_dir = tempfile.mkdtemp(prefix='youtube2mp3-startup-')
+    results = []
+    try:
+        for name in commands:
+            result = measure_command(name, args.runs, work_dir, args.python)
+            results.append(result)
+            forbidden = f", FORBIDDEN: {', '.join(result['forbidden_imports'])}" if result['forbidden_imports'] else ''
+            failed = '' if result['ok'] else f", FAILED with exit code {result['exit_code']}"
+            print(f"[BENCH] {name:12s} median {result['median_seconds']} s, p95 {result['p95_seconds']} s, "
+                  f"heavy imports: {', '.join(result['heavy_imports']) or 'none'}{forbidden}{failed}", flush=True)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'config': {'runs': args.runs},
+        'results': results,
+    }
+    if args.output:
+        tmp_path = f"{args.output}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        os.replace(tmp_path, args.output)
+    else:
+        print(json.dumps(report, indent=2))
+
+    exit_code = 1 if any(result['forbidden_imports'] or not result['ok'] for result in results) else 0
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            regressions = find_regressions(results, json.load(f), args.tolerance)
+        for result, before in regressions:
+            print(f"[REGRESSION] {result['command']}: median {result['median_seconds']} s (baseline {before} s)")
+        if regressions:
+            exit_code = 1
+    return exit_code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,130 @@
+"""
+Checkpoint journal for CLI batch runs: records the state of every URL so an
+interrupted batch can be resumed without starting over
+"""
+import json
+import os
+import threading
+import time
+
+JOURNAL_NAME = '.youtube2mp3-journal.jsonl'
+
+# URL states
+PENDING = 'pending'
+DOWNLOADING = 'downloading'
+TRANSCODING = 'transcoding'
+COMPLETED = 'completed'
+FAILED = 'failed'
+
+
+class CheckpointJournal:
+    """
+    Append-only JSON lines file, one line per state change; the last line
+    for a URL wins. Every line is fsync'ed so the journal survives a crash
+    or an OOM kill of the process.
+
+    Memory does not grow with the batch: only the URLs completed by a
+    previous run (to skip them) and the ones in progress are kept, every
+    other state goes straight to the file.
+    """
+
+    def __init__(self, path, resume=False):
+        """
+        :param path: Journal file path
+        :param resume: Keep the states of a previous run (otherwise the journal starts empty)
+        """
+        self.path = str(path)
+        self._lock = threading.Lock()
+        self._completed = self._load() if resume else {}  # url -> filepath, from previous runs
+        self._active = {}                                   # url -> state, this run
+        self._counts = {}                                   # final states recorded by this run
+        self.skipped = 0
+
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        # Rewrite compacted (one line per completed URL) so the file does not grow across resumes
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for url, filepath in self._completed.items():
+                f.write(json.dumps({'url': url, 'state': COMPLETED, 'filepath': filepath}, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self._file = open(self.path, 'a', encoding='utf-8')
+
+    @classmethod
+    def for_output_dir(cls, output_dir, resume=False):
+        """Journal kept in the output directory of the batch"""
+        return cls(os.path.join(output_dir, JOURNAL_NAME), resume=resume)
+
+    def _load(self):
+        """URLs whose last line is COMPLETED, with their file"""
+        completed = {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Line cut short by a crash
+                        continue
+                    if not isinstance(entry, dict) or 'url' not in entry:
+                        continue
+                    if entry.get('state') == COMPLETED:
+                        completed[entry['url']] = entry.get('filepath', '')
+                    else:
+                        completed.pop(entry['url'], None)
+        except OSError:
+            pass
+        return completed
+
+    def record(self, url, state, **fields):
+        """Persist the new state of a URL"""
+        entry = dict(fields, url=url, state=state, updated_at=time.time())
+        line = json.dumps(entry, ensure_ascii=False) + '\n'
+        with self._lock:
+            # Being processed again: no longer a leftover of a previous run
+            self._completed.pop(url, None)
+            if state in (DOWNLOADING, TRANSCODING):
+                self._active[url] = state
+            else:
+                self._active.pop(url, None)
+                self._counts[state] = self._counts.get(state, 0) + 1
+            if self._file.closed:
+                return
+            self._file.write(line)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def state(self, url):
+        """State of a URL in progress, or COMPLETED if a previous run finished it"""
+        with self._lock:
+            if url in self._active:
+                return self._active[url]
+        return COMPLETED if url in self._completed else PENDING
+
+    def is_done(self, url):
+        """True if the URL finished in a previous run and its file still exists"""
+        filepath = self._completed.get(url)
+        return bool(filepath and os.path.exists(filepath))
+
+    def pending(self, urls):
+        """Lazily yield the URLs not finished in a previous run, counting the skipped ones"""
+        for url in urls:
+            if self.is_done(url):
+                self.skipped += 1
+            else:
+                yield url
+
+    def counts(self):
+        """Number of URLs per state: completed by previous runs, in progress and finished by this run"""
+        with self._lock:
+            counts = dict(self._counts)
+            if self._completed:
+                counts[COMPLETED] = counts.get(COMPLETED, 0) + len(self._completed)
+            for state in self._active.values():
+                counts[state] = counts.get(state, 0) + 1
+        return counts
+
+    def close(self):
+        with self._lock:
+            self._file.close()
@@ -0,0 +1,197 @@
+"""
+Adaptive concurrency: an AIMD controller that grows the number of active
+download workers while throughput keeps improving and shrinks it on
+errors or upstream throttling (HTTP 429/403)
+"""
+import threading
+import time
+
+# Controller defaults
+DEFAULT_INTERVAL = 15          # Seconds per observation window
+DEFAULT_FLOOR = 1
+DEFAULT_CEILING = 10
+DECREASE_FACTOR = 0.5          # Multiplicative decrease on errors or throttling
+ERROR_RATE_THRESHOLD = 0.25    # Share of failed attempts in a window that triggers a decrease
+MIN_GAIN = 0.05                # Throughput drop after an increase that undoes it
+THROTTLING_STATUSES = ('403', '429')
+DOWNLOAD_PHASES = ('extract', 'download', 'stream')
+
+# Decisions
+INCREASE = 'increase'
+DECREASE = 'decrease'
+HOLD = 'hold'
+
+
+class AdaptiveLimit:
+    """Gate with a number of slots that can change while it is in use"""
+
+    def __init__(self, limit):
+        self._condition = threading.Condition()
+        self._limit = max(int(limit), 1)
+        self._active = 0
+
+    @property
+    def limit(self):
+        return self._limit
+
+    def set_limit(self, limit):
+        """Change the number of slots; extra holders finish their current job"""
+        with self._condition:
+            self._limit = max(int(limit), 1)
+            self._condition.notify_all()
+
+    def acquire(self):
+        with self._condition:
+            while self._active >= self._limit:
+                self._condition.wait()
+            self._active += 1
+
+    def release(self):
+        with self._condition:
+            self._active -= 1
+            self._condition.notify()
+
+    def active(self):
+        with self._condition:
+            return self._active
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+def job_sample(metrics, bandwidth):
+    """
+    Cumulative counters the controller works from: bytes received (updated
+    per chunk by the bandwidth limiter), download attempts, failures and
+    throttling responses.
+    """
+    series = metrics.phase_seconds.series()
+    failures = metrics.failures.values()
+    http_errors = metrics.http_errors.values()
+    return {
+        'bytes': bandwidth.stats()['bytes'],
+        'attempts': series.get(('extract',), (None, 0, 0))[2],
+        'failures': sum(n for (phase, _), n in failures.items() if phase in DOWNLOAD_PHASES),
+        'throttled': sum(n for (status,), n in http_errors.items() if status in THROTTLING_STATUSES),
+    }
+
+
+class ConcurrencyController:
+    """
+    Additive-increase/multiplicative-decrease controller for an AdaptiveLimit.
+
+    Every interval it compares the window with the previous one: throttling
+    or a high error rate halve the limit, a throughput drop right after an
+    increase takes it back, and a saturated pool whose throughput held up
+    gets one more worker.
+    """
+
+    def __init__(self, gate, sample, floor=DEFAULT_FLOOR, ceiling=DEFAULT_CEILING,
+                 interval=DEFAULT_INTERVAL, log=print, clock=time.monotonic):
+        """
+        :param gate: AdaptiveLimit whose limit is driven
+        :param sample: Callable returning the cumulative counters (see job_sample)
+        :param floor: Minimum number of workers
+        :param ceiling: Maximum number of workers
+        :param interval: Seconds per observation window
+        :param log: Callable receiving a message per decision
+        :param clock: Monotonic clock in seconds (replaceable in tests)
+        """
+        if floor < 1 or ceiling < floor:
+            raise ValueError(f"Invalid concurrency bounds: {floor}..{ceiling}")
+        self.gate = gate
+        self.sample = sample
+        self.floor = floor
+        self.ceiling = ceiling
+        self.interval = interval
+        self.log = log
+        self.clock = clock
+        gate.set_limit(min(max(gate.limit, floor), ceiling))
+
+        self._previous = (self.clock(), sample())
+        self._previous_throughput = None
+        self._last_decision = HOLD
+        self._stop = threading.Event()
+        self._thread = None
+        self.decisions = {INCREASE: 0, DECREASE: 0, HOLD: 0}
+
+    def start(self):
+        """Run step() every interval on a background thread"""
+        if self._thread is None:
+            self._previous = (self.clock(), self.sample())
+            self._thread = threading.Thread(target=self._run, name='concurrency-controller', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.step()
+            except Exception as e:
+                self.log(f"Concurrency controller step failed: {e}")
+
+    def decide(self, window, limit, active):
+        """
+        Pick the next limit from one observation window.
+
+        :param window: Deltas of the counters plus 'throughput' (bytes/s)
+        :return: Tuple (decision, new limit, reason)
+        """
+        attempts = window['attempts']
+        error_rate = window['failures'] / attempts if attempts else 0.0
+        throughput = window['throughput']
+
+        if window['throttled']:
+            return DECREASE, max(self.floor, int(limit * DECREASE_FACTOR)), f"{window['throttled']} HTTP 429/403 responses"
+        if attempts >= 2 and error_rate > ERROR_RATE_THRESHOLD:
+            return DECREASE, max(self.floor, int(limit * DECREASE_FACTOR)), f"error rate {error_rate:.0%}"
+        previous = self._previous_throughput
+        if self._last_decision == INCREASE and previous and throughput < previous * (1 - MIN_GAIN):
+            return DECREASE, max(self.floor, limit - 1), \
+                f"throughput fell from {previous / 1e6:.2f} to {throughput / 1e6:.2f} MB/s after the last increase"
+        if active < limit:
+            return HOLD, limit, f"{limit - active} idle worker(s)"
+        if limit >= self.ceiling:
+            return HOLD, limit, 'at the ceiling'
+        return INCREASE, limit + 1, f"saturated at {throughput / 1e6:.2f} MB/s"
+
+    def step(self):
+        """Close the current window and apply the decision"""
+        now, sample = self.clock(), self.sample()
+        previous_time, previous = self._previous
+        self._previous = (now, sample)
+        window = {key: sample[key] - previous[key] for key in sample}
+        window['throughput'] = window['bytes'] / (now - previous_time) if now > previous_time else 0.0
+
+        limit = self.gate.limit
+        decision, new_limit, reason = self.decide(window, limit, self.gate.active())
+        new_limit = min(max(new_limit, self.floor), self.ceiling)
+        if new_limit == limit and decision != HOLD:
+            decision = HOLD
+        self.decisions[decision] += 1
+        self._last_decision = decision
+        self._previous_throughput = window['throughput']
+
+        if new_limit != limit:
+            self.gate.set_limit(new_limit)
+            self.log(f"Concurrency {decision}: {limit} -> {new_limit} workers ({reason})")
+        return decision, new_limit, reason
+
+    def stats(self):
+        return {
+            'limit': self.gate.limit,
+            'active': self.gate.active(),
+            'floor': self.floor,
+            'ceiling': self.ceiling,
+            'decisions': dict(self.decisions),
+        }
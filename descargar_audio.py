@@ -1,15 +1,46 @@
-import yt_dlp
+# yt_dlp, asyncio y concurrent.futures se importan solo en las funciones que
+# los usan: --help, --version y los errores de argumentos arrancan sin cargarlos
 import os
 import sys
 import argparse
 import csv
 from pathlib import Path
-import asyncio
-import concurrent.futures
 from threading import Lock, Thread, Event
 import time
+import itertools
+import functools
+import json
+import queue
+import atexit
 import logging
 from datetime import datetime
+import shutil
+from metadata_cache import extract_info_cached, download_with_info, downloaded_filepath
+from result_cache import get_result_cache, result_key, HIT, COALESCED
+from output_policy import OutputPolicy, MP3, POLICIES, DEFAULT_ACCEPTED_CODECS, parse_codecs
+from checkpoint import CheckpointJournal, JOURNAL_NAME, DOWNLOADING, TRANSCODING, COMPLETED, FAILED
+from metrics import get_metrics, EXTRACT, DOWNLOAD, TRANSCODE, TOTAL
+from tracing import get_tracer, enable_tracing, hook_tracer, postprocessor_tracer
+from playlist import iter_playlist_urls
+from bandwidth import get_bandwidth_limiter, parse_rate
+from concurrency import AdaptiveLimit, ConcurrencyController, job_sample, DEFAULT_FLOOR, DEFAULT_CEILING, DEFAULT_INTERVAL
+from ydl_pool import get_ydl_pool
+from retry import RetryPolicy, CircuitBreaker, DEFAULT_MAX_ATTEMPTS, DEFAULT_BASE_DELAY
+
+# Ajustes de codificacion del MP3 (forman parte de la clave de la cache de resultados)
+PREFERRED_CODEC = 'mp3'
+PREFERRED_QUALITY = '320'
+
+# Politica de salida: por defecto todo se convierte a MP3 (main() la cambia con --output-policy)
+politica_salida = OutputPolicy(MP3, quality=PREFERRED_QUALITY)
+
+# Metricas de la sesion (tiempos por fase, bytes y errores), compartidas con la web
+metricas = get_metrics()
+
+# Reintentos de los errores transitorios (main() los ajusta con --retries y --retry-delay)
+# y cortacircuitos que frena los nuevos arranques cuando YouTube falla en bloque
+politica_reintentos = RetryPolicy()
+cortacircuitos = CircuitBreaker()
 
 # Fix Windows console encoding issues
 def setup_console_encoding():
@@ -60,32 +91,79 @@ def safe_print(*args, **kwargs):
                 safe_args.append(arg)
         print(*safe_args, **kwargs)
 
-# Initialize console encoding
-setup_console_encoding()
+# Segundos minimos entre dos lineas de progreso de un mismo trabajo en el log
+PROGRESS_LOG_INTERVAL = float(os.environ.get('PROGRESS_LOG_INTERVAL', '5'))
+
+# Formatos de log disponibles (LOG_FORMAT o --log-format)
+LOG_FORMATS = ('text', 'json')
+
+# Campos estructurados (extra=) que se vuelcan en los logs JSON
+CAMPOS_LOG = ('job_id', 'phase', 'url', 'path', 'downloaded_bytes', 'total_bytes', 'speed', 'eta')
+
+class JsonLinesFormatter(logging.Formatter):
+    """Formatea cada registro como una linea JSON con los campos del trabajo"""
+    
+    def format(self, record):
+        entrada = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        for campo in CAMPOS_LOG:
+            valor = getattr(record, campo, None)
+            if valor is not None:
+                entrada[campo] = valor
+        return json.dumps(entrada, ensure_ascii=False)
+
+# Hilo que escribe el log en disco (los workers solo encolan registros)
+log_listener = None
 
 # Configure logging
-def setup_logging():
-    """Configure logging to file with timestamp"""
-    # Skip if logging is already configured
+def setup_logging(log_format=None):
+    """
+    Configure logging to file through a background writer thread: the
+    workers only put records in a queue and never block on disk writes.
+    
+    :param log_format: 'text' (default) or 'json' for JSON lines (default: LOG_FORMAT env)
+    :return: Path of the log file, or None if logging was configured elsewhere
+    """
+    from logging.handlers import QueueHandler, QueueListener
+    
+    global log_listener
     root_logger = logging.getLogger()
-    if root_logger.handlers:
+    if log_listener is not None:
+        return log_file
+    # Skip if logging was already configured by someone else
+    if any(handler not in _handlers_por_defecto for handler in root_logger.handlers):
         return None
     
+    log_format = log_format or os.environ.get('LOG_FORMAT', 'text')
     logs_dir = os.environ.get('LOGS_DIR', '.')
     
     # Create logs directory if it doesn't exist
     Path(logs_dir).mkdir(parents=True, exist_ok=True)
     
-    log_filename = os.path.join(logs_dir, 'youtube_downloader.log')
+    log_filename = os.path.join(logs_dir, 'youtube_downloader.jsonl' if log_format == 'json' else 'youtube_downloader.log')
     
-    # Configure logging (mode='a' to append instead of truncate)
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.FileHandler(log_filename, mode='a', encoding='utf-8'),
-        ]
-    )
+    # File handler (mode='a' to append instead of truncate), run by the listener thread
+    file_handler = logging.FileHandler(log_filename, mode='a', encoding='utf-8')
+    if log_format == 'json':
+        file_handler.setFormatter(JsonLinesFormatter())
+    else:
+        file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    
+    log_queue = queue.SimpleQueue()
+    log_listener = QueueListener(log_queue, file_handler)
+    log_listener.start()
+    # Flush pending records on exit
+    atexit.register(log_listener.stop)
+    
+    # Replace the default console handler with the queue
+    for handler in _handlers_por_defecto:
+        root_logger.removeHandler(handler)
+    root_logger.addHandler(QueueHandler(log_queue))
+    root_logger.setLevel(logging.INFO)
     
     # Log session start
     logging.info("="*50)
@@ -97,117 +175,219 @@ def setup_logging():
 # Initialize logging only when module is run directly (not imported)
 log_file = None
 
-# Always ensure basic logging is configured
+# Always ensure basic logging is configured (replaced by setup_logging)
+_handlers_por_defecto = []
 if not logging.getLogger().handlers:
     logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    _handlers_por_defecto = list(logging.getLogger().handlers)
 
 # Thread-safe printing lock
 print_lock = Lock()
 
 def thread_safe_print(*args, **kwargs):
-    """Thread-safe version of safe_print"""
+    """Thread-safe version of safe_print (prints above the progress dashboard)"""
     with print_lock:
+        renderer.clear()
         safe_print(*args, **kwargs)
 
-def log_warning(message):
-    """Log warning messages to file instead of printing"""
-    logging.warning(message)
+def log_warning(message, **campos):
+    """Log warning messages to file instead of printing (campos: see CAMPOS_LOG)"""
+    logging.warning(message, extra=campos or None)
 
-def log_info(message):
-    """Log info messages to file"""
-    logging.info(message)
+def log_info(message, **campos):
+    """Log info messages to file (campos: see CAMPOS_LOG)"""
+    logging.info(message, extra=campos or None)
 
-def log_error(message):
-    """Log error messages to file and print to console"""
-    logging.error(message)
+def log_error(message, **campos):
+    """Log error messages to file and print to console (campos: see CAMPOS_LOG)"""
+    logging.error(message, extra=campos or None)
     thread_safe_print(f"[ERROR] {message}")
 
-class ProgressAnimation:
-    """Animated progress indicator for console"""
+class YtDlpLogger:
+    """Manda los mensajes de yt-dlp al log en lugar de a la consola"""
+    
+    def __init__(self, url_id):
+        self.url_id = url_id
+    
+    def debug(self, message):
+        pass
+    
+    def info(self, message):
+        pass
+    
+    def warning(self, message):
+        log_warning(f"[{self.url_id}] yt-dlp: {message}", job_id=self.url_id)
+    
+    def error(self, message):
+        # El error se registra (y se muestra) al capturar la excepcion
+        pass
+
+class ProgressRenderer:
+    """
+    Single console renderer for every concurrent download.
     
-    def __init__(self, message="Procesando"):
-        self.message = message
-        self.is_running = False
+    Workers only report their state with update()/remove(); one thread draws
+    a multi-line dashboard at a fixed refresh rate. When stdout is not a TTY
+    (Docker logs, redirections) it prints a summary line every few seconds.
+    """
+    
+    FRAMES = ['|', '/', '-', '\\']
+    
+    def __init__(self, stream=None, refresh=0.2, summary_interval=10.0):
+        """
+        :param stream: Output stream (default: sys.stdout)
+        :param refresh: Seconds between dashboard redraws on a TTY
+        :param summary_interval: Seconds between summary lines when not on a TTY
+        """
+        self.stream = stream
+        self.refresh = refresh
+        self.summary_interval = summary_interval
+        self.tasks = {}
         self.thread = None
         self.stop_event = Event()
-        self.frames = ['|', '/', '-', '\\']
         self.current_frame = 0
-        
-    def _animate(self):
-        """Run the animation in a separate thread"""
-        while not self.stop_event.is_set():
+        self.lines_drawn = 0
+        self.last_summary = time.monotonic()
+        self._state_lock = Lock()
+    
+    def _stream(self):
+        return self.stream or sys.stdout
+    
+    def is_tty(self):
+        isatty = getattr(self._stream(), 'isatty', None)
+        return bool(isatty and isatty())
+    
+    def update(self, task_id, message):
+        """Set the current state of a task (starts the renderer thread if needed)"""
+        with self._state_lock:
+            self.tasks[task_id] = message
+            if self.thread is None:
+                if sys.platform.startswith('win'):
+                    os.system('')  # Enable ANSI escape sequences in the Windows console
+                self.stop_event.clear()
+                self.thread = Thread(target=self._run, name='renderer', daemon=True)
+                self.thread.start()
+    
+    def remove(self, task_id):
+        """Forget a finished task"""
+        with self._state_lock:
+            self.tasks.pop(task_id, None)
+    
+    def _run(self):
+        """Redraw loop of the renderer thread"""
+        while not self.stop_event.wait(self.refresh):
             with print_lock:
-                frame = self.frames[self.current_frame]
-                print(f"\r{frame} {self.message}...", end='', flush=True)
-                self.current_frame = (self.current_frame + 1) % len(self.frames)
-            time.sleep(0.2)
-    
-    def start(self):
-        """Start the animation"""
-        if not self.is_running:
-            self.is_running = True
-            self.stop_event.clear()
-            self.thread = Thread(target=self._animate, daemon=True)
-            self.thread.start()
+                if self.is_tty():
+                    self.current_frame = (self.current_frame + 1) % len(self.FRAMES)
+                    self._draw()
+                elif time.monotonic() - self.last_summary >= self.summary_interval:
+                    self.last_summary = time.monotonic()
+                    self._summary()
+    
+    def _draw(self):
+        """Redraw the dashboard (caller holds print_lock)"""
+        self.clear()
+        with self._state_lock:
+            messages = list(self.tasks.values())
+        if not messages:
+            return
+        
+        columns, rows = shutil.get_terminal_size()
+        max_lines = max(rows - 2, 1)
+        if len(messages) > max_lines:
+            hidden = len(messages) - max_lines + 1
+            messages = messages[:max_lines - 1] + [f"... y {hidden} mas"]
+        frame = self.FRAMES[self.current_frame]
+        lines = [f"{frame} {message}"[:columns - 1] for message in messages]
+        try:
+            self._stream().write('\n'.join(lines) + '\n')
+            self._stream().flush()
+        except UnicodeEncodeError:
+            return
+        self.lines_drawn = len(lines)
+    
+    def _summary(self):
+        """Print one line with every active task (caller holds print_lock)"""
+        with self._state_lock:
+            messages = list(self.tasks.values())
+        if messages:
+            safe_print(f"[PROCESS] {len(messages)} activas: " + ' | '.join(messages), flush=True)
+    
+    def clear(self):
+        """Erase the dashboard so other output can be printed (caller holds print_lock)"""
+        if self.lines_drawn:
+            # Cursor up to the first dashboard line and clear to the end of the screen
+            self._stream().write(f"\x1b[{self.lines_drawn}F\x1b[J")
+            self._stream().flush()
+            self.lines_drawn = 0
     
     def stop(self):
-        """Stop the animation"""
-        if self.is_running:
+        """Stop the renderer thread and erase the dashboard"""
+        with self._state_lock:
+            thread, self.thread = self.thread, None
+            self.tasks.clear()
+        if thread:
             self.stop_event.set()
-            self.is_running = False
-            if self.thread:
-                self.thread.join(timeout=1)
-            with print_lock:
-                print("\r" + " " * (len(self.message) + 10) + "\r", end='', flush=True)
+            thread.join(timeout=1)
+        with print_lock:
+            self.clear()
+
+# Renderer shared by every download of the process
+renderer = ProgressRenderer()
+
+def iterar_urls_csv(archivo_csv):
+    """
+    Generador que lee URLs de un archivo CSV fila a fila, sin cargarlo en
+    memoria. La primera fila se toma como encabezado si no es una URL.
     
-    def update_message(self, new_message):
-        """Update the animation message"""
-        self.message = new_message
+    :param archivo_csv: Ruta al archivo CSV
+    :return: Generador de URLs validas (primera columna de cada fila)
+    :raises OSError: Si no se puede abrir el archivo
+    """
+    with open(archivo_csv, 'r', encoding='utf-8', newline='') as file:
+        primera_fila = True
+        for row_num, row in enumerate(csv.reader(file), start=1):
+            if not row or not any(campo.strip() for campo in row):  # Saltar filas vacías
+                continue
+            
+            # Tomar la primera columna como URL
+            url = row[0].strip() if row[0] else None
+            es_encabezado = primera_fila
+            primera_fila = False
+            
+            if url and (url.startswith('http://') or url.startswith('https://')):
+                yield url
+            elif url and not es_encabezado:
+                log_warning(f"Fila {row_num}: URL invalida '{url}' (ignorada)")
+
+def expandir_listas(urls):
+    """
+    Generador que expande listas de reproduccion y canales en las URLs de
+    sus videos a medida que se descubren (extraccion plana, pagina a pagina).
+    Una lista que falla se registra en el log y no detiene el resto.
+    
+    :param urls: Iterable de URLs (videos, listas o canales)
+    :return: Generador de URLs de videos
+    """
+    for url in urls:
+        encontradas = 0
+        try:
+            for url_video in iter_playlist_urls(url, {'logger': YtDlpLogger('LISTA')}):
+                encontradas += 1
+                yield url_video
+        except Exception as e:
+            log_error(f"No se pudo expandir la lista {url}: {e}", phase='error', url=url)
+        log_info(f"Lista {url}: {encontradas} video(s) encontrados", phase='playlist', url=url)
 
 def leer_urls_csv(archivo_csv):
     """
-    Lee URLs desde un archivo CSV.
+    Lee todas las URLs de un archivo CSV (para lotes pequeños, p. ej. la web).
     
     :param archivo_csv: Ruta al archivo CSV
     :return: Lista de URLs válidas
     """
-    urls = []
-    
     try:
-        with open(archivo_csv, 'r', encoding='utf-8', newline='') as file:
-            # Leer todo el contenido y analizar
-            content = file.read().strip()
-            file.seek(0)
-            
-            # Detectar si es probable que tenga encabezados
-            lines = content.split('\n')
-            has_header = False
-            
-            if lines and len(lines) > 1:
-                first_line = lines[0].strip()
-                # Si la primera línea parece ser un encabezado (no una URL)
-                if not (first_line.startswith('http://') or first_line.startswith('https://')):
-                    has_header = True
-            
-            reader = csv.reader(file)
-            
-            if has_header:
-                next(reader)  # Saltar encabezado
-            
-            for row_num, row in enumerate(reader, start=1):
-                if not row:  # Saltar filas vacías
-                    continue
-                    
-                # Tomar la primera columna como URL
-                url = row[0].strip() if row[0] else None
-                
-                if url and (url.startswith('http://') or url.startswith('https://')):
-                    urls.append(url)
-                    safe_print(f"[NOTE] URL {len(urls)}: {url}")
-                    log_info(f"URL {len(urls)} agregada: {url}")
-                elif url:
-                    log_warning(f"Fila {row_num}: URL invalida '{url}' (ignorada)")
-                    
+        urls = list(iterar_urls_csv(archivo_csv))
     except FileNotFoundError:
         safe_print(f"[ERROR] No se pudo encontrar el archivo: {archivo_csv}")
         return []
@@ -215,35 +395,64 @@ def leer_urls_csv(archivo_csv):
         safe_print(f"[ERROR] Error leyendo el archivo CSV: {e}")
         return []
     
+    log_info(f"{len(urls)} URLs leidas de {archivo_csv}")
     safe_print(f"\n[STATS] Se encontraron {len(urls)} URLs validas para procesar.\n")
     return urls
 
-def progress_hook(url_id, animation=None):
-    """Factory function to create thread-specific progress hooks"""
+def progress_hook(url_id, show_progress=True, intervalo_log=None):
+    """
+    Factory function to create thread-specific progress hooks.
+    
+    Progress lines are written to the log at most once every intervalo_log
+    seconds per job (default: PROGRESS_LOG_INTERVAL); the console panel is
+    updated on every callback, which is cheap.
+    """
+    from yt_dlp.utils import remove_terminal_sequences
+    
+    intervalo_log = PROGRESS_LOG_INTERVAL if intervalo_log is None else intervalo_log
+    ultimo_log = [float('-inf')]
+    
     def hook(d):
-        """Hook para mostrar el progreso de descarga de manera segura y thread-safe"""
+        """Hook que informa del progreso al renderer de consola y al log (muestreado)"""
         if d['status'] == 'downloading':
-            percent = d.get('_percent_str', 'N/A')
-            speed = d.get('_speed_str', 'N/A')
-            log_info(f"[{url_id}] Descargando... {percent} a {speed}")
-            if animation:
-                animation.update_message(f"[{url_id}] Descargando {percent}")
+            percent = remove_terminal_sequences(d.get('_percent_str', 'N/A')).strip()
+            speed = remove_terminal_sequences(d.get('_speed_str', 'N/A')).strip()
+            if show_progress:
+                renderer.update(url_id, f"[{url_id}] Descargando {percent} a {speed}")
+            ahora = time.monotonic()
+            if ahora - ultimo_log[0] >= intervalo_log:
+                ultimo_log[0] = ahora
+                log_info(
+                    f"[{url_id}] Descargando... {percent} a {speed}",
+                    job_id=url_id, phase='download',
+                    downloaded_bytes=d.get('downloaded_bytes'),
+                    total_bytes=d.get('total_bytes') or d.get('total_bytes_estimate'),
+                    speed=d.get('speed'), eta=d.get('eta')
+                )
         elif d['status'] == 'finished':
-            log_info(f"[{url_id}] Descarga terminada: {d.get('filename', 'archivo')}")
-            if animation:
-                animation.update_message(f"[{url_id}] Convirtiendo a MP3")
+            log_info(
+                f"[{url_id}] Descarga terminada: {d.get('filename', 'archivo')}",
+                job_id=url_id, phase='downloaded', path=d.get('filename'),
+                downloaded_bytes=d.get('downloaded_bytes') or d.get('total_bytes')
+            )
+            if show_progress:
+                renderer.update(url_id, f"[{url_id}] Descarga terminada, esperando conversion")
         elif d['status'] == 'error':
-            log_error(f"[{url_id}] Error durante la descarga")
+            log_error(f"[{url_id}] Error durante la descarga", job_id=url_id, phase='error')
     return hook
 
 def descargar_audio_mp3(url_youtube, output_dir='.', url_id=None, show_animation=True):
     """
     Descarga el audio de un video de YouTube y lo guarda en formato MP3.
+    
+    Si el mismo video ya se convirtio con los mismos ajustes se reutiliza el
+    MP3 existente, y si se esta descargando en otro hilo se espera a ese
+    resultado en lugar de descargarlo dos veces.
 
     :param url_youtube: La URL del video de YouTube.
     :param output_dir: Directorio donde guardar el archivo (por defecto: directorio actual)
     :param url_id: Identificador para el hilo de descarga (para logging thread-safe)
-    :param show_animation: Mostrar animacion de progreso
+    :param show_animation: Mostrar el progreso en el panel de consola
     :return: Ruta del archivo MP3 creado o None si hay error
     """
     
@@ -251,182 +460,540 @@ def descargar_audio_mp3(url_youtube, output_dir='.', url_id=None, show_animation
     if url_id is None:
         url_id = f"URL-{hash(url_youtube) % 1000:03d}"
     
-    # Crear animacion de progreso
-    animation = None
+    for intento in itertools.count(1):
+        ficha = cortacircuitos.wait()
+        pendiente = etapa_descarga(url_youtube, output_dir, url_id, show_animation)
+        error = pendiente.get('error')
+        cortacircuitos.record(error, token=ficha)
+        if error is None or not politica_reintentos.should_retry(error, intento):
+            break
+        espera = anotar_reintento(url_id, url_youtube, error, intento)
+        with get_tracer().span(url_id, 'backoff', cat='wait'):
+            time.sleep(espera)
+    if 'fuente' not in pendiente:
+        return pendiente['archivo']
+    return etapa_transcodificacion(pendiente)
+
+def anotar_reintento(url_id, url_youtube, error, intento):
+    """
+    Registra un reintento y calcula su espera (backoff exponencial con jitter,
+    para que los trabajos que fallaron juntos no vuelvan a la vez).
+    
+    :return: Segundos a esperar antes del siguiente intento
+    """
+    espera = politica_reintentos.delay(intento)
+    metricas.record_retry(error)
+    log_warning(f"[{url_id}] Error transitorio en el intento {intento}/{politica_reintentos.max_attempts} "
+                f"({error}); reintentando en {espera:.1f} s", job_id=url_id, phase='retry', url=url_youtube)
+    return espera
+
+def etapa_descarga(url_youtube, output_dir, url_id, show_animation=True):
+    """
+    Primera etapa (limitada por la red): consulta la cache de resultados y
+    descarga el audio original sin convertirlo.
+    
+    :return: Diccionario con 'archivo' si el resultado final ya esta resuelto
+             (cache o error, en cuyo caso es None y 'error' guarda la excepcion
+             si la hubo) o con 'fuente' si el audio descargado esta pendiente
+             de transcodificar
+    """
+    inicio = time.perf_counter()
+    # Fin de la espera por un hueco en el executor de descargas (modo asincrono)
+    trazas = get_tracer()
+    trazas.end(url_id, 'queued', cat='wait')
+    cache = get_result_cache()
+    clave = result_key(url_youtube, politica_salida.cache_codec, PREFERRED_QUALITY)
+    estado, valor = cache.acquire(clave)
+    
+    if estado == HIT:
+        log_info(f"[{url_id}] Resultado en cache para: {url_youtube}", job_id=url_id, phase='cache_hit', url=url_youtube)
+        with trazas.span(url_id, 'cache_hit'):
+            return {'archivo': reutilizar_resultado(valor, output_dir, url_id)}
+    
+    if estado == COALESCED:
+        log_info(f"[{url_id}] Descarga identica en curso, esperando su resultado: {url_youtube}",
+                 job_id=url_id, phase='coalesced', url=url_youtube)
+        if show_animation:
+            renderer.update(url_id, f"[{url_id}] Esperando una descarga identica en curso")
+        try:
+            with trazas.span(url_id, 'coalesced', cat='wait'):
+                entrada = valor.result()
+        except Exception as e:
+            log_error(f"[{url_id}] La descarga compartida de {url_youtube} fallo: {e}", job_id=url_id, phase='error', url=url_youtube)
+            return {'archivo': None, 'error': e}
+        finally:
+            renderer.remove(url_id)
+        return {'archivo': reutilizar_resultado(entrada, output_dir, url_id)}
+    
+    fuente = None
+    try:
+        fuente = descargar_fuente(url_youtube, output_dir, url_id, show_animation)
+    finally:
+        if not fuente or 'error' in fuente:
+            # Las descargas que esperaban a esta reciben el error original, para clasificarlo igual
+            error = fuente['error'] if fuente else None
+            cache.fail(clave, error or RuntimeError(f"Descarga fallida: {url_youtube}"))
+            renderer.remove(url_id)
+    
+    if not fuente:
+        return {'archivo': None}
+    if 'error' in fuente:
+        return {'archivo': None, 'error': fuente['error']}
+    return {
+        'fuente': fuente['ruta'], 'acodec': fuente['acodec'], 'duracion': fuente['duracion'],
+        'clave': clave, 'url': url_youtube, 'url_id': url_id, 'mostrar_progreso': show_animation,
+        'inicio': inicio,
+    }
+
+def etapa_transcodificacion(pendiente, ffmpeg_location=None):
+    """
+    Segunda etapa (limitada por la CPU): convierte el audio descargado por
+    etapa_descarga segun la politica de salida y registra el resultado en la cache.
+    
+    :param pendiente: Diccionario devuelto por etapa_descarga con 'fuente'
+    :param ffmpeg_location: Directorio de FFmpeg (por defecto se busca en PATH)
+    :return: Ruta del archivo de audio creado o None si hay error
+    """
+    cache = get_result_cache()
+    url_id = pendiente['url_id']
+    get_tracer().end(url_id, 'transcode_queued', cat='wait')
+    archivo = None
+    if pendiente.get('mostrar_progreso'):
+        renderer.update(url_id, f"[{url_id}] Convirtiendo ({politica_salida.mode})")
+    try:
+        archivo = convertir_audio(
+            pendiente['fuente'], url_id, ffmpeg_location,
+            acodec=pendiente.get('acodec'), duracion=pendiente.get('duracion')
+        )
+    finally:
+        renderer.remove(url_id)
+        if archivo:
+            cache.complete(pendiente['clave'], os.path.abspath(archivo), title=Path(archivo).stem)
+        else:
+            cache.fail(pendiente['clave'], RuntimeError(f"Conversion fallida: {pendiente['url']}"))
+    
+    if archivo:
+        if 'inicio' in pendiente:
+            metricas.phase_seconds.observe(time.perf_counter() - pendiente['inicio'], phase=TOTAL)
+        formato = Path(archivo).suffix.lstrip('.').upper()
+        thread_safe_print(f"[SUCCESS] [{url_id}] '{Path(archivo).stem}' -> {formato} completado")
+        log_info(f"[{url_id}] Descarga completada exitosamente: {archivo}", job_id=url_id, phase='done', url=pendiente['url'], path=archivo)
+    return archivo
+
+def reutilizar_resultado(entrada, output_dir, url_id):
+    """
+    Devuelve un MP3 ya convertido, copiandolo al directorio de salida si esta en otro.
+    
+    :param entrada: Entrada de la cache de resultados
+    :param output_dir: Directorio de salida solicitado
+    :param url_id: Identificador para logging
+    :return: Ruta del archivo MP3 o None si no se pudo copiar
+    """
+    origen = entrada['filepath']
+    destino = os.path.join(os.path.abspath(output_dir), os.path.basename(origen))
+    
+    try:
+        if os.path.abspath(origen) != destino and not os.path.exists(destino):
+            Path(output_dir).mkdir(parents=True, exist_ok=True)
+            shutil.copy2(origen, destino)
+    except OSError as e:
+        log_error(f"[{url_id}] No se pudo reutilizar {origen}: {e}", job_id=url_id, phase='error', path=origen)
+        return None
+    
+    formato = Path(destino).suffix.lstrip('.').upper()
+    thread_safe_print(f"[SUCCESS] [{url_id}] '{Path(destino).stem}' -> {formato} reutilizado (cache)")
+    return destino
+
+def descargar_fuente(url_youtube, output_dir, url_id, show_animation=True):
+    """
+    Descarga el mejor audio disponible tal cual, sin post-procesado.
+    
+    :return: Diccionario con 'ruta', 'acodec' y 'duracion' del audio original, con 'error'
+             si fallo yt-dlp (para decidir si se reintenta) o None si no aparecio el archivo
+    """
+    from yt_dlp.utils import DownloadError
+    
     if show_animation:
-        animation = ProgressAnimation(f"[{url_id}] Iniciando descarga")
-        animation.start()
+        renderer.update(url_id, f"[{url_id}] Iniciando descarga")
     
     # Log inicio de descarga
-    log_info(f"[{url_id}] Iniciando descarga de: {url_youtube}")
+    log_info(f"[{url_id}] Iniciando descarga de: {url_youtube}", job_id=url_id, phase='start', url=url_youtube)
     
     # [SETTINGS] Opciones de yt-dlp
     ydl_opts = {
-        # [MUSIC] Formato del post-procesamiento (extraer audio)
+        # [MUSIC] Mejor audio disponible (la conversion a MP3 es una etapa aparte)
         'format': 'bestaudio/best',  
-        'postprocessors': [{
-            # [PROCESS] Post-procesador para convertir el archivo
-            'key': 'FFmpegExtractAudio',
-            'preferredcodec': 'mp3',
-            'preferredquality': '320', # Calidad de audio (320 kbps es alta)
-        }],
         # [FOLDER] Plantilla del nombre de archivo. %(title)s es el titulo del video.
-        # yt-dlp aniadira automaticamente la extension .mp3
         'outtmpl': os.path.join(output_dir, '%(title)s.%(ext)s'),
         # [INFO] Mostrar progreso
-        'progress_hooks': [progress_hook(url_id, animation)],
+        # El limitador de ancho de banda duerme este hilo si se supera el presupuesto
+        'progress_hooks': [progress_hook(url_id, show_animation), hook_tracer(url_id), get_bandwidth_limiter().job().progress_hook],
         # [WARNING] Desactivar listas de reproduccion si se pega una URL de lista
         'noplaylist': True,
+        # [PROCESS] Continuar los archivos .part que dejo una ejecucion interrumpida
+        'continuedl': True,
         # [QUIET] Silenciar salida de youtube-dl excepto errores
-        'quiet': True  # Silenciar para que solo se vea nuestra animacion
+        'quiet': True,  # Silenciar para que solo se vea nuestro panel de progreso
+        'noprogress': True,  # La barra de yt-dlp competiria con el panel por la consola
+        'logger': YtDlpLogger(url_id)  # Avisos de yt-dlp al log, no a la consola
     }
 
+    trazas = get_tracer()
+    fase = EXTRACT
     try:
         # Crear directorio de salida si no existe
         Path(output_dir).mkdir(parents=True, exist_ok=True)
         
-        if animation:
-            animation.update_message(f"[{url_id}] Obteniendo informacion del video")
+        if show_animation:
+            renderer.update(url_id, f"[{url_id}] Obteniendo informacion del video")
         
-        # [START] Ejecutar la descarga
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            # Obtener metadatos para verificar el nombre del archivo
-            info = ydl.extract_info(url_youtube, download=False)
+        # [START] Ejecutar la descarga (con el YoutubeDL ya configurado de este hilo)
+        with get_ydl_pool().job(ydl_opts) as ydl:
+            # Obtener metadatos una sola vez (o desde la cache)
+            with metricas.time_phase(EXTRACT), trazas.span(url_id, EXTRACT):
+                info, desde_cache = extract_info_cached(ydl, url_youtube)
             title = info.get('title', 'audio')
-            log_info(f"[{url_id}] Titulo del video: {title}")
-            
-            # Limpiar caracteres problematicos del nombre de archivo
-            safe_title = "".join(c for c in title if c.isalnum() or c in (' ', '-', '_')).rstrip()
-            final_filename = os.path.join(output_dir, f"{safe_title}.mp3")
+            log_info(f"[{url_id}] Titulo del video: {title}" + (" (metadatos en cache)" if desde_cache else ""),
+                     job_id=url_id, phase='extract', url=url_youtube)
             
-            if animation:
-                animation.update_message(f"[{url_id}] Descargando audio")
+            if show_animation:
+                renderer.update(url_id, f"[{url_id}] Descargando audio")
             
-            # Ahora forzamos la descarga real
-            ydl.download([url_youtube])
+            # Descarga real reutilizando los metadatos ya extraidos
+            fase = DOWNLOAD
+            with metricas.time_phase(DOWNLOAD), trazas.span(url_id, DOWNLOAD):
+                resultado = download_with_info(ydl, url_youtube, info, desde_cache)
+            fuente = downloaded_filepath(resultado)
 
-        # Detener animacion y mostrar exito
-        if animation:
-            animation.stop()
+        if not fuente or not os.path.exists(fuente):
+            log_error(f"[{url_id}] No se encontro el audio descargado de {url_youtube}", job_id=url_id, phase='error', url=url_youtube)
+            metricas.failures.inc(phase=DOWNLOAD, error_class='FileNotFoundError')
+            return None
         
-        thread_safe_print(f"[SUCCESS] [{url_id}] '{title}' -> MP3 completado")
-        log_info(f"[{url_id}] Descarga completada exitosamente: {final_filename}")
-        return final_filename
+        metricas.downloaded_bytes.inc(os.path.getsize(fuente))
+        log_info(f"[{url_id}] Audio descargado ({resultado.get('acodec') or 'codec desconocido'}), pendiente de conversion: {fuente}",
+                 job_id=url_id, phase='downloaded', url=url_youtube, path=fuente)
+        return {'ruta': fuente, 'acodec': resultado.get('acodec'), 'duracion': resultado.get('duration')}
 
-    except yt_dlp.utils.DownloadError as e:
-        if animation:
-            animation.stop()
+    except DownloadError as e:
         error_msg = f"Error de descarga para {url_youtube}: {str(e)}"
-        log_error(f"[{url_id}] {error_msg}")
-        return None
+        log_error(f"[{url_id}] {error_msg}", job_id=url_id, phase='error', url=url_youtube)
+        metricas.record_failure(fase, e)
+        return {'error': e}
     except Exception as e:
-        if animation:
-            animation.stop()
         error_msg = f"Error inesperado procesando {url_youtube}: {str(e)}"
-        log_error(f"[{url_id}] {error_msg}")
-        return None
+        log_error(f"[{url_id}] {error_msg}", job_id=url_id, phase='error', url=url_youtube)
+        metricas.record_failure(fase, e)
+        return {'error': e}
 
-async def procesar_url_async(url, output_dir, url_id, executor):
+def convertir_audio(ruta_fuente, url_id, ffmpeg_location=None, acodec=None, duracion=None, politica=None):
     """
-    Procesa una URL de forma asincrona usando un ThreadPoolExecutor.
+    Convierte un archivo de audio con el mismo post-procesador que usa yt-dlp
+    y elimina el original. Segun la politica de salida el audio se recodifica
+    a MP3 o, si su codec esta aceptado, solo se remuxa a un contenedor estandar
+    (copia del stream, sin decodificar).
     
-    :param url: URL del video de YouTube
-    :param output_dir: Directorio de salida
-    :param url_id: Identificador unico para el hilo
-    :param executor: ThreadPoolExecutor instance
-    :return: Tuple (url, resultado, exito)
+    :param ruta_fuente: Ruta del audio descargado
+    :param url_id: Identificador para logging
+    :param ffmpeg_location: Directorio de FFmpeg (por defecto se busca en PATH)
+    :param acodec: Codec del audio descargado (si no se indica se consulta con FFmpeg)
+    :param duracion: Duracion en segundos (para estimar la CPU ahorrada)
+    :param politica: OutputPolicy a aplicar (por defecto la politica global)
+    :return: Ruta del archivo final o None si hay error
     """
-    loop = asyncio.get_event_loop()
+    from yt_dlp.postprocessor import FFmpegExtractAudioPP
+    
+    politica = politica or politica_salida
+    # El hook de post-procesado marca en la traza el inicio y fin de FFmpeg
+    opciones = {'quiet': True, 'no_warnings': True, 'postprocessor_hooks': [postprocessor_tracer(url_id)]}
+    if ffmpeg_location:
+        opciones['ffmpeg_location'] = ffmpeg_location
     
     try:
-        # Ejecutar la descarga en un hilo separado con animacion
-        resultado = await loop.run_in_executor(
-            executor, 
-            descargar_audio_mp3, 
-            url, 
-            output_dir, 
-            url_id,
-            True  # show_animation
-        )
-        
-        exito = resultado is not None
-        return (url, resultado, exito, url_id)
-        
+        with get_ydl_pool().job(opciones) as ydl:
+            if not acodec or acodec == 'none':
+                acodec = FFmpegExtractAudioPP(ydl).get_audio_codec(ruta_fuente)
+            destino, recodificar = politica.target_for(acodec)
+            
+            if recodificar:
+                log_info(f"[{url_id}] Convirtiendo {acodec} a {destino.upper()}: {ruta_fuente}", job_id=url_id, phase='transcode', path=ruta_fuente)
+            else:
+                log_info(f"[{url_id}] Conservando {acodec} sin recodificar ({destino}): {ruta_fuente}", job_id=url_id, phase='remux', path=ruta_fuente)
+            
+            postprocesador = FFmpegExtractAudioPP(
+                ydl, preferredcodec=destino, preferredquality=politica.quality
+            )
+            tamano = os.path.getsize(ruta_fuente)
+            inicio = time.perf_counter()
+            with metricas.time_phase(TRANSCODE), get_tracer().span(url_id, TRANSCODE, acodec=acodec, target=destino):
+                a_borrar, info = postprocesador.run({
+                    'filepath': ruta_fuente,
+                    'ext': os.path.splitext(ruta_fuente)[1].lstrip('.'),
+                })
+            politica.record(recodificar, duracion, tamano, time.perf_counter() - inicio)
+            metricas.written_bytes.inc(os.path.getsize(info['filepath']))
+        for ruta in a_borrar:
+            try:
+                os.remove(ruta)
+            except OSError:
+                pass
+        return info['filepath']
     except Exception as e:
-        error_msg = f"Error procesando {url}: {str(e)}"
-        log_error(f"[{url_id}] {error_msg}")
-        return (url, None, False, url_id)
+        log_error(f"[{url_id}] Error convirtiendo {ruta_fuente}: {e}", job_id=url_id, phase='error', path=ruta_fuente)
+        metricas.record_failure(TRANSCODE, e)
+        return None
+
+def formatear_bytes(n):
+    """Tamaño legible (1.5 MB)"""
+    if n < 1024:
+        return f"{n} B"
+    for unidad in ('KB', 'MB', 'GB', 'TB'):
+        n /= 1024
+        if n < 1024 or unidad == 'TB':
+            return f"{n:.1f} {unidad}"
+
+def imprimir_metricas(output_dir, archivo_metricas=None):
+    """
+    Muestra el resumen de metricas de la sesion y, si se indica, lo guarda
+    en formato de texto de Prometheus (p. ej. para el textfile collector de
+    node_exporter).
+    
+    :param output_dir: Directorio de salida (para el espacio libre)
+    :param archivo_metricas: Ruta del archivo de metricas a escribir (opcional)
+    """
+    metricas.gauge(
+        'youtube2mp3_disk_free_bytes', 'Free space in the output directory',
+        callback=lambda: shutil.disk_usage(output_dir).free
+    )
+    resumen = metricas.summary()
+    for fase, datos in resumen['phases'].items():
+        safe_print(f"[STATS] Tiempo {fase}: {datos['count']} x media {datos['mean']} s "
+                   f"(p50 ~{datos['p50']} s, p95 ~{datos['p95']} s)")
+    try:
+        libre = formatear_bytes(shutil.disk_usage(output_dir).free)
+    except OSError:
+        libre = 'desconocido'
+    safe_print(f"[STATS] Datos: {formatear_bytes(resumen['downloaded_bytes'])} descargados, "
+               f"{formatear_bytes(resumen['written_bytes'])} escritos, {libre} libres en {output_dir}")
+    if resumen['failures']:
+        safe_print("[STATS] Errores: " + ', '.join(f"{clave} x{n}" for clave, n in resumen['failures'].items()))
+    log_info(f"Metricas: {json.dumps(resumen)}")
+    
+    if archivo_metricas:
+        # Escritura atomica: quien lea el archivo nunca ve una exportacion a medias
+        temporal = f"{archivo_metricas}.tmp"
+        try:
+            with open(temporal, 'w', encoding='utf-8') as f:
+                f.write(metricas.render())
+            os.replace(temporal, archivo_metricas)
+            safe_print(f"[INFO] Metricas guardadas en: {archivo_metricas}")
+        except OSError as e:
+            log_error(f"No se pudieron guardar las metricas en {archivo_metricas}: {e}")
 
-async def procesar_urls_async(urls, output_dir, max_concurrent=3):
+def guardar_traza(trazador, archivo_traza):
     """
-    Procesa multiples URLs de forma asincrona con un limite de concurrencia.
+    Guarda la traza de la sesion en formato Chrome trace-event (se abre en
+    https://ui.perfetto.dev o chrome://tracing).
     
-    :param urls: Lista de URLs a procesar
+    :param trazador: TraceRecorder con los eventos de la sesion
+    :param archivo_traza: Ruta del archivo JSON a escribir
+    """
+    try:
+        trazador.save(archivo_traza)
+        safe_print(f"[INFO] Traza guardada en: {archivo_traza} (abrir en https://ui.perfetto.dev)")
+    except OSError as e:
+        log_error(f"No se pudo guardar la traza en {archivo_traza}: {e}")
+
+AUTO = 'auto'
+
+def entero_o_auto(valor):
+    """Tipo de argparse: un entero o 'auto'"""
+    if valor.strip().lower() == AUTO:
+        return AUTO
+    try:
+        return int(valor)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"se esperaba un numero o 'auto': {valor!r}")
+
+def registrar_en_diario(diario, url, archivo):
+    """Anota en el diario de checkpoints el resultado final de una URL"""
+    if diario is None:
+        return
+    if archivo:
+        diario.record(url, COMPLETED, filepath=os.path.abspath(archivo))
+    else:
+        diario.record(url, FAILED)
+
+async def procesar_urls_async(urls, output_dir, max_concurrent=3, max_transcodes=None, diario=None, controlador=None):
+    """
+    Procesa multiples URLs de forma asincrona en dos etapas: descargas (red)
+    y conversiones a MP3 (CPU), cada una con su propio limite de concurrencia
+    y unidas por una cola acotada.
+    
+    Las URLs se consumen de forma perezosa a traves de otra cola acotada, asi
+    que las descargas empiezan con la primera fila y la memoria no depende
+    del tamaño del lote.
+    
+    :param urls: Iterable de URLs a procesar (lista o generador, p. ej. iterar_urls_csv)
     :param output_dir: Directorio de salida
     :param max_concurrent: Numero maximo de descargas simultaneas (default: 3)
-    :return: Tuple (exitosos, fallidos, resultados)
+    :param max_transcodes: Numero maximo de conversiones simultaneas (default: numero de CPUs)
+    :param diario: CheckpointJournal donde anotar el estado de cada URL (opcional)
+    :param controlador: ConcurrencyController que ajusta las descargas activas entre su suelo y
+                        su techo (opcional; max_concurrent pasa a ser el techo)
+    :return: Tuple (exitosos, fallidos)
     """
-    total_urls = len(urls)
-    exitosos = 0
-    fallidos = 0
-    resultados = []
+    import asyncio
+    import concurrent.futures
+    
+    max_transcodes = max_transcodes or os.cpu_count() or 1
+    etapa = etapa_descarga
+    if controlador is not None:
+        max_concurrent = controlador.ceiling
+        
+        def etapa(*args):
+            # Los workers por encima del limite actual esperan aqui su turno
+            with controlador.gate:
+                return etapa_descarga(*args)
+        
+        controlador.start()
+    
+    thread_safe_print(f"[START] Procesamiento asincrono: max {max_concurrent} descargas y {max_transcodes} conversiones")
+    log_info(f"Iniciando procesamiento asincrono con hasta {max_concurrent} descargas y {max_transcodes} conversiones simultaneas")
+    
+    loop = asyncio.get_running_loop()
+    # El lector solo va unas pocas URLs por delante de las descargas
+    cola_urls = asyncio.Queue(maxsize=max_concurrent * 2)
+    # Una descarga no libera su worker hasta que su audio entra en la cola de
+    # conversion, asi que si las conversiones van por detras la red espera
+    cola_conversion = asyncio.Queue(maxsize=max_transcodes)
+    contadores = {'exitosos': 0, 'fallidos': 0}
+    # Reintentos esperando su backoff (tareas que vuelven a pasar por las descargas)
+    reintentos = set()
     
-    thread_safe_print(f"[START] Procesamiento asincrono: {total_urls} URL(s), max {max_concurrent} hilos")
-    log_info(f"Iniciando procesamiento asincrono de {total_urls} URLs con hasta {max_concurrent} hilos simultaneos")
+    def anotar_resultado(url, archivo, url_id):
+        registrar_en_diario(diario, url, archivo)
+        get_tracer().finish_job(url_id, ok=bool(archivo))
+        if archivo:
+            contadores['exitosos'] += 1
+            # Solo mostrar el resultado final, los detalles van al log
+            log_info(f"{url_id} - Exito: {url}", job_id=url_id, phase='done', url=url)
+        else:
+            # Los errores ya se loggearon en la funcion individual
+            contadores['fallidos'] += 1
     
-    # Crear un ThreadPoolExecutor con el numero maximo de hilos
-    with concurrent.futures.ThreadPoolExecutor(max_workers=max_concurrent) as executor:
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='lectura') as executor_lectura, \
+         concurrent.futures.ThreadPoolExecutor(max_workers=max_concurrent, thread_name_prefix='descarga') as executor_descargas, \
+         concurrent.futures.ThreadPoolExecutor(max_workers=max_transcodes, thread_name_prefix='conversion') as executor_conversiones:
         
-        # Crear tareas asincronas para cada URL
-        tasks = []
-        for i, url in enumerate(urls, 1):
-            url_id = f"T{i:02d}"
-            log_info(f"Creando tarea {url_id} para: {url}")
-            task = procesar_url_async(url, output_dir, url_id, executor)
-            tasks.append(task)
+        async def leer():
+            # Las URLs se piden en un hilo aparte: expandir una lista pagina
+            # contra la red y no debe bloquear el bucle mientras avanzan las descargas
+            iterador = iter(urls)
+            try:
+                for indice in itertools.count():
+                    url = await loop.run_in_executor(executor_lectura, next, iterador, None)
+                    if url is None:
+                        break
+                    url_id = f"T{indice + 1:02d}"
+                    # El trabajo y su espera por un hueco de descarga empiezan al leer la fila
+                    trazas = get_tracer()
+                    trazas.name_job(url_id, f"{url_id} {url}")
+                    trazas.start(url_id, 'job')
+                    trazas.start(url_id, 'queued')
+                    await cola_urls.put((url_id, url))
+            finally:
+                # Una marca de fin por worker de descarga
+                for _ in range(max_concurrent):
+                    await cola_urls.put(None)
         
-        thread_safe_print(f"[PROCESS] Ejecutando {len(tasks)} tareas en paralelo...")
+        async def descargar():
+            while True:
+                elemento = await cola_urls.get()
+                if elemento is None:
+                    return
+                url_id, url = elemento
+                if diario:
+                    diario.record(url, DOWNLOADING)
+                await procesar_descarga(url_id, url, 1)
         
-        try:
-            # Ejecutar todas las tareas de forma concurrente
-            completed_tasks = await asyncio.gather(*tasks, return_exceptions=True)
-            
-            # Procesar resultados
-            for i, result in enumerate(completed_tasks, 1):
-                if isinstance(result, Exception):
-                    fallidos += 1
-                    error_msg = f"Tarea {i} fallo con excepcion: {result}"
-                    log_error(error_msg)
-                    resultados.append((urls[i-1], None, False, f"T{i:02d}"))
-                else:
-                    url, archivo, exito, url_id = result
-                    if exito:
-                        exitosos += 1
-                        # Solo mostrar el resultado final, los detalles van al log
-                        log_info(f"{url_id} - Exito: {url}")
-                    else:
-                        fallidos += 1
-                        # Los errores ya se loggearon en la funcion individual
-                        pass
-                    resultados.append(result)
+        async def procesar_descarga(url_id, url, intento):
+            # Con el cortacircuitos abierto no empieza ninguna descarga nueva
+            # (la ficha identifica la descarga de prueba del cortacircuitos semiabierto)
+            while True:
+                espera, ficha = cortacircuitos.admit()
+                if espera <= 0:
+                    break
+                await asyncio.sleep(espera)
+            try:
+                pendiente = await loop.run_in_executor(
+                    executor_descargas, etapa, url, output_dir, url_id, True
+                )
+            except Exception as e:
+                log_error(f"[{url_id}] Error procesando {url}: {e}", job_id=url_id, phase='error', url=url)
+                pendiente = {'archivo': None, 'error': e}
             
-        except KeyboardInterrupt:
+            error = pendiente.get('error')
+            cortacircuitos.record(error, token=ficha)
+            if error is not None and politica_reintentos.should_retry(error, intento):
+                espera = anotar_reintento(url_id, url, error, intento)
+                tarea = asyncio.create_task(reintentar(url_id, url, intento + 1, espera))
+                reintentos.add(tarea)
+                tarea.add_done_callback(reintentos.discard)
+            elif 'fuente' in pendiente:
+                if diario:
+                    diario.record(url, TRANSCODING)
+                get_tracer().start(url_id, 'transcode_queued')
+                await cola_conversion.put(pendiente)
+            else:
+                anotar_resultado(url, pendiente['archivo'], url_id)
+        
+        async def reintentar(url_id, url, intento, espera):
+            # El backoff no ocupa un worker de descarga: el resto del lote sigue avanzando
+            trazas = get_tracer()
+            trazas.start(url_id, 'backoff')
+            await asyncio.sleep(espera)
+            trazas.end(url_id, 'backoff', cat='wait')
+            trazas.start(url_id, 'queued')
+            await procesar_descarga(url_id, url, intento)
+        
+        async def convertir():
+            while True:
+                pendiente = await cola_conversion.get()
+                try:
+                    archivo = await loop.run_in_executor(executor_conversiones, etapa_transcodificacion, pendiente)
+                except Exception as e:
+                    log_error(f"[{pendiente['url_id']}] Error convirtiendo {pendiente['url']}: {e}",
+                              job_id=pendiente['url_id'], phase='error', url=pendiente['url'])
+                    archivo = None
+                anotar_resultado(pendiente['url'], archivo, pendiente['url_id'])
+                cola_conversion.task_done()
+        
+        thread_safe_print(f"[PROCESS] Ejecutando tareas en paralelo...")
+        
+        conversores = [asyncio.create_task(convertir()) for _ in range(max_transcodes)]
+        try:
+            await asyncio.gather(leer(), *(descargar() for _ in range(max_concurrent)))
+            # Un reintento puede programar otro, asi que se espera hasta que no quede ninguno
+            while reintentos:
+                await asyncio.gather(*reintentos)
+            await cola_conversion.join()
+        except (KeyboardInterrupt, asyncio.CancelledError):
             thread_safe_print(f"\n[PAUSE] Procesamiento interrumpido por el usuario.")
             log_info("Procesamiento interrumpido por el usuario")
-            # Cancelar tareas pendientes
-            for task in tasks:
-                if not task.done():
-                    task.cancel()
             raise
+        finally:
+            for tarea in [*conversores, *reintentos]:
+                tarea.cancel()
+            if controlador is not None:
+                controlador.stop()
     
-    return exitosos, fallidos, resultados
+    return contadores['exitosos'], contadores['fallidos']
 
 def main():
     """Función principal con manejo de argumentos mejorado"""
-    # Initialize logging for CLI usage
-    global log_file
-    log_file = setup_logging()
-    
+    # Consola en UTF-8 (Windows) antes de que argparse imprima la ayuda
+    setup_console_encoding()
     parser = argparse.ArgumentParser(
         description='Descarga audio de YouTube y lo convierte a MP3',
         formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -436,6 +1003,8 @@ Ejemplos:
   python descargar_audio.py -o /ruta/destino "https://www.youtube.com/watch?v=VIDEO_ID"
   python descargar_audio.py --csv-file urls.csv
   python descargar_audio.py --csv-file urls.csv -o /ruta/destino
+  python descargar_audio.py --csv-file urls.csv -o /ruta/destino --resume
+  python descargar_audio.py --playlist "https://www.youtube.com/@CANAL"
   python descargar_audio.py  # Te pedirá la URL interactivamente
         """
     )
@@ -454,11 +1023,99 @@ Ejemplos:
         '--csv-file',
         help='Archivo CSV con URLs a procesar (una URL por fila)'
     )
+    parser.add_argument(
+        '--playlist',
+        action='store_true',
+        help='Tratar la URL (o las del CSV) como listas de reproduccion o canales: sus videos se '
+             'descubren pagina a pagina y se descargan mientras se sigue recorriendo la lista'
+    )
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        help=f'Reanudar un lote CSV interrumpido: omite las URLs ya completadas segun el '
+             f'diario {JOURNAL_NAME} del directorio de salida y continua las descargas a medias'
+    )
     parser.add_argument(
         '--max-concurrent',
-        type=int,
+        type=entero_o_auto,
         default=3,
-        help='Numero maximo de descargas simultaneas (por defecto: 3)'
+        help='Numero maximo de descargas simultaneas (por defecto: 3), o "auto" para ajustarlo '
+             'durante el lote segun el rendimiento, los errores y las respuestas HTTP 429/403'
+    )
+    parser.add_argument(
+        '--concurrency-floor',
+        type=int,
+        default=DEFAULT_FLOOR,
+        help=f'Minimo de descargas simultaneas con --max-concurrent auto (por defecto: {DEFAULT_FLOOR})'
+    )
+    parser.add_argument(
+        '--concurrency-ceiling',
+        type=int,
+        default=DEFAULT_CEILING,
+        help=f'Maximo de descargas simultaneas con --max-concurrent auto (por defecto: {DEFAULT_CEILING})'
+    )
+    parser.add_argument(
+        '--max-transcodes',
+        type=int,
+        default=os.cpu_count() or 1,
+        help='Numero maximo de conversiones a MP3 simultaneas (por defecto: numero de CPUs)'
+    )
+    parser.add_argument(
+        '--output-policy',
+        choices=POLICIES,
+        default=MP3,
+        help='mp3: convertir siempre a MP3 (por defecto); passthrough: conservar sin '
+             'recodificar el audio cuyo codec este en --accept-codecs y convertir el resto'
+    )
+    parser.add_argument(
+        '--accept-codecs',
+        default=','.join(DEFAULT_ACCEPTED_CODECS),
+        help=f"Codecs que se conservan con --output-policy passthrough (por defecto: {','.join(DEFAULT_ACCEPTED_CODECS)})"
+    )
+    parser.add_argument(
+        '--limit-rate',
+        default=os.environ.get('BANDWIDTH_LIMIT'),
+        help='Ancho de banda maximo entre todas las descargas, en bytes/s (p. ej. 500K o 4.2M; '
+             'por defecto: BANDWIDTH_LIMIT o sin limite)'
+    )
+    parser.add_argument(
+        '--job-limit-rate',
+        default=os.environ.get('JOB_BANDWIDTH_LIMIT'),
+        help='Ancho de banda maximo de cada descarga, dentro del limite total (por defecto: '
+             'JOB_BANDWIDTH_LIMIT o sin limite)'
+    )
+    parser.add_argument(
+        '--retries',
+        type=int,
+        default=int(os.environ.get('DOWNLOAD_RETRIES', DEFAULT_MAX_ATTEMPTS - 1)),
+        help='Reintentos de cada URL ante errores transitorios (HTTP 429/5xx, cortes de red); los '
+             'errores permanentes (video privado o eliminado, 404) no se reintentan '
+             f'(por defecto: DOWNLOAD_RETRIES o {DEFAULT_MAX_ATTEMPTS - 1})'
+    )
+    parser.add_argument(
+        '--retry-delay',
+        type=float,
+        default=float(os.environ.get('RETRY_BASE_DELAY', DEFAULT_BASE_DELAY)),
+        help='Espera base en segundos antes del primer reintento; se duplica en cada intento y se '
+             f'reparte al azar para no reintentar todo el lote a la vez (por defecto: {DEFAULT_BASE_DELAY:g})'
+    )
+    parser.add_argument(
+        '--log-format',
+        choices=LOG_FORMATS,
+        default=os.environ.get('LOG_FORMAT', 'text'),
+        help='Formato del log: text (por defecto) o json (una linea JSON por evento con '
+             'job_id, fase y bytes, en youtube_downloader.jsonl)'
+    )
+    parser.add_argument(
+        '--metrics-file',
+        help='Guardar al terminar las metricas de la sesion (tiempos por fase, bytes, errores) '
+             'en formato de texto de Prometheus en este archivo'
+    )
+    parser.add_argument(
+        '--trace',
+        metavar='ARCHIVO.json',
+        help='Grabar una traza de la ejecucion (por trabajo: espera en cola, extraccion, descarga, '
+             'conversion y eventos de yt-dlp) en formato Chrome trace-event, para abrir en Perfetto'
     )
     parser.add_argument(
         '--version',
@@ -468,29 +1125,87 @@ Ejemplos:
     
     args = parser.parse_args()
     
+    # Initialize logging for CLI usage
+    global log_file
+    log_file = setup_logging(args.log_format)
+    
     urls_a_procesar = []
+    diario = None
+    omitidas = 0
     
     # Mostrar informacion del archivo de log
     thread_safe_print(f"[INFO] Log de la sesion: {log_file}")
     
-    # Validar max_concurrent
-    if args.max_concurrent < 1:
+    # Validar max_concurrent (en modo auto, los limites del controlador)
+    controlador = None
+    if args.max_concurrent == AUTO:
+        if args.concurrency_floor < 1 or args.concurrency_ceiling < args.concurrency_floor:
+            safe_print("[ERROR] --concurrency-floor debe ser al menos 1 y no mayor que --concurrency-ceiling.")
+            return 1
+        controlador = ConcurrencyController(
+            AdaptiveLimit(min(max(3, args.concurrency_floor), args.concurrency_ceiling)),
+            functools.partial(job_sample, metricas, get_bandwidth_limiter()),
+            floor=args.concurrency_floor, ceiling=args.concurrency_ceiling, interval=DEFAULT_INTERVAL,
+            log=lambda mensaje: log_info(f"Control de concurrencia: {mensaje}")
+        )
+        args.max_concurrent = args.concurrency_ceiling
+    elif args.max_concurrent < 1:
         safe_print("[ERROR] El numero maximo de descargas concurrentes debe ser al menos 1.")
         return 1
     elif args.max_concurrent > 10:
         log_warning("Se recomienda no usar mas de 10 descargas simultaneas para evitar problemas.")
     
+    if args.max_transcodes < 1:
+        safe_print("[ERROR] El numero maximo de conversiones concurrentes debe ser al menos 1.")
+        return 1
+    
+    if args.retries < 0 or args.retry_delay < 0:
+        safe_print("[ERROR] --retries y --retry-delay no pueden ser negativos.")
+        return 1
+    global politica_reintentos
+    politica_reintentos = RetryPolicy(args.retries + 1, args.retry_delay)
+    
+    global politica_salida
+    codecs_aceptados = parse_codecs(args.accept_codecs)
+    if args.output_policy != MP3 and not codecs_aceptados:
+        safe_print("[ERROR] --accept-codecs debe indicar al menos un codec.")
+        return 1
+    politica_salida = OutputPolicy(args.output_policy, codecs_aceptados, PREFERRED_QUALITY)
+    
+    try:
+        get_bandwidth_limiter().set_limits(parse_rate(args.limit_rate), parse_rate(args.job_limit_rate))
+    except ValueError as e:
+        safe_print(f"[ERROR] {e}")
+        return 1
+    
+    # Traza opcional: sin --trace el trazador no hace nada
+    trazador = enable_tracing() if args.trace else get_tracer()
+    
     # Modo CSV: procesar multiples URLs desde archivo
     if args.csv_file:
         safe_print(f"[FOLDER] Procesando URLs desde archivo CSV: {args.csv_file}\n")
-        urls_a_procesar = leer_urls_csv(args.csv_file)
+        # El CSV se lee fila a fila mientras avanzan las descargas
+        urls_csv = iterar_urls_csv(args.csv_file)
+        try:
+            primera_url = next(urls_csv, None)
+        except FileNotFoundError:
+            safe_print(f"[ERROR] No se pudo encontrar el archivo: {args.csv_file}")
+            return 1
+        except Exception as e:
+            safe_print(f"[ERROR] Error leyendo el archivo CSV: {e}")
+            return 1
         
-        if not urls_a_procesar:
+        if primera_url is None:
             safe_print("[ERROR] No se encontraron URLs validas en el archivo CSV.")
             return 1
+        urls_a_procesar = itertools.chain([primera_url], urls_csv)
     
-    # Modo individual: una sola URL
+    # Modo individual: una sola URL (o lista con --playlist)
     else:
+        if args.resume and not args.playlist:
+            safe_print("[ERROR] --resume solo se puede usar con --csv-file o --playlist.")
+            return 1
+        
         url = args.url
         if not url:
             try:
@@ -510,23 +1225,45 @@ Ejemplos:
             
         urls_a_procesar = [url]
     
-    # Procesar todas las URLs de forma asincrona
-    total_urls = len(urls_a_procesar)
+    if args.playlist:
+        safe_print(f"[PROCESS] Expandiendo listas de reproduccion y canales a medida que avanzan las descargas")
+        urls_a_procesar = expandir_listas(urls_a_procesar)
+    
+    # Diario de checkpoints del lote (se reinicia salvo con --resume)
+    if args.csv_file or args.playlist:
+        diario = CheckpointJournal.for_output_dir(args.output_dir, resume=args.resume)
+        if args.resume:
+            completadas = diario.counts().get(COMPLETED, 0)
+            safe_print(f"[PROCESS] Reanudando lote: {completadas} URL(s) completadas en el diario")
+            log_info(f"Reanudando lote desde {diario.path}: {completadas} completadas")
+            urls_a_procesar = diario.pending(urls_a_procesar)
     
-    # Decide si usar procesamiento asincrono o sincronico
-    usar_async = total_urls > 1 and args.max_concurrent > 1
+    # Decide si usar procesamiento asincrono o sincronico (los lotes CSV y las
+    # listas se procesan en asincrono sin conocer su tamaño de antemano)
+    usar_async = bool(args.csv_file or args.playlist) and (args.max_concurrent > 1 or controlador is not None)
     
     if usar_async:
-        thread_safe_print(f"[INFO] Modo asincrono con hasta {args.max_concurrent} hilos")
+        if controlador is not None:
+            thread_safe_print(f"[INFO] Modo asincrono con {controlador.floor}-{controlador.ceiling} descargas adaptativas "
+                              f"(empezando en {controlador.gate.limit}) y {args.max_transcodes} conversiones")
+        else:
+            thread_safe_print(f"[INFO] Modo asincrono con hasta {args.max_concurrent} descargas y {args.max_transcodes} conversiones")
         try:
             # Ejecutar el procesamiento asincrono
-            exitosos, fallidos, resultados = asyncio.run(
-                procesar_urls_async(urls_a_procesar, args.output_dir, args.max_concurrent)
+            import asyncio
+            exitosos, fallidos = asyncio.run(
+                procesar_urls_async(urls_a_procesar, args.output_dir, args.max_concurrent, args.max_transcodes, diario, controlador)
             )
         except KeyboardInterrupt:
-            safe_print(f"\n[PAUSE] Procesamiento interrumpido por el usuario.")
+            renderer.stop()
+            thread_safe_print(f"\n[PAUSE] Procesamiento interrumpido por el usuario.")
+            if diario:
+                thread_safe_print(f"[INFO] Para continuar: repite el comando con --resume")
+            if args.trace:
+                guardar_traza(trazador, args.trace)
             return 1
         except Exception as e:
+            renderer.stop()
             error_msg = f"Error durante el procesamiento asincrono: {e}"
             log_error(error_msg)
             return 1
@@ -537,43 +1274,83 @@ Ejemplos:
         fallidos = 0
         
         for i, url in enumerate(urls_a_procesar, 1):
-            safe_print(f"\n{'='*60}")
-            safe_print(f"[AUDIO] Procesando {i}/{total_urls}: {url}")
-            safe_print(f"{'='*60}")
+            thread_safe_print(f"\n{'='*60}")
+            thread_safe_print(f"[AUDIO] Procesando {i}: {url}")
+            thread_safe_print(f"{'='*60}")
             
             try:
                 url_id = f"S{i:02d}"
+                if diario:
+                    diario.record(url, DOWNLOADING)
+                trazador.name_job(url_id, f"{url_id} {url}")
+                trazador.start(url_id, 'job')
                 resultado = descargar_audio_mp3(url, args.output_dir, url_id)
+                trazador.finish_job(url_id, ok=bool(resultado))
+                registrar_en_diario(diario, url, resultado)
                 
                 if resultado:
                     exitosos += 1
-                    safe_print(f"[SUCCESS] {i}/{total_urls} - Exito: {url}")
+                    thread_safe_print(f"[SUCCESS] {i} - Exito: {url}")
                 else:
                     fallidos += 1
-                    safe_print(f"[FAIL] {i}/{total_urls} - Fallo: {url}")
+                    thread_safe_print(f"[FAIL] {i} - Fallo: {url}")
                     
             except KeyboardInterrupt:
-                safe_print(f"\n\n[PAUSE] Procesamiento interrumpido por el usuario.")
-                safe_print(f"[STATS] Resumen hasta el momento:")
-                safe_print(f"   [SUCCESS] Exitosos: {exitosos}")
-                safe_print(f"   [FAIL] Fallidos: {fallidos}")
-                safe_print(f"   [PAUSE] Restantes: {total_urls - i}")
+                renderer.stop()
+                thread_safe_print(f"\n\n[PAUSE] Procesamiento interrumpido por el usuario.")
+                thread_safe_print(f"[STATS] Resumen hasta el momento:")
+                thread_safe_print(f"   [SUCCESS] Exitosos: {exitosos}")
+                thread_safe_print(f"   [FAIL] Fallidos: {fallidos}")
+                if diario:
+                    thread_safe_print(f"[INFO] Para continuar: repite el comando con --resume")
+                if args.trace:
+                    guardar_traza(trazador, args.trace)
                 return 1
             except Exception as e:
                 fallidos += 1
-                safe_print(f"[ERROR] {i}/{total_urls} - Error inesperado con {url}: {e}")
+                registrar_en_diario(diario, url, None)
+                thread_safe_print(f"[ERROR] {i} - Error inesperado con {url}: {e}")
+    
+    # Quitar el panel de progreso antes del resumen
+    renderer.stop()
+    
+    total_urls = exitosos + fallidos
+    if diario:
+        omitidas = diario.skipped
+        diario.close()
     
     # Resumen final
     safe_print(f"\n\n{'='*60}")
     safe_print(f"[STATS] RESUMEN FINAL")
     safe_print(f"{'='*60}")
     safe_print(f"[NOTE] URLs procesadas: {total_urls}")
+    if omitidas:
+        safe_print(f"[PROCESS] Ya completadas en una ejecucion anterior: {omitidas}")
     safe_print(f"[SUCCESS] Exitosos: {exitosos}")
     safe_print(f"[FAIL] Fallidos: {fallidos}")
+    cache_stats = get_result_cache().stats()
+    safe_print(f"[STATS] Cache: {cache_stats['hits']} reutilizados, {cache_stats['coalesced']} compartidos, {cache_stats['misses']} descargados")
+    salida_stats = politica_salida.stats()
+    safe_print(f"[STATS] Salida ({salida_stats['policy']}): {salida_stats['transcoded']} recodificados, "
+               f"{salida_stats['kept']} sin recodificar, ~{salida_stats['cpu_seconds_saved']} s de CPU ahorrados")
+    if controlador is not None and usar_async:
+        concurrencia = controlador.stats()
+        safe_print(f"[STATS] Concurrencia adaptativa: terminada en {concurrencia['limit']} descargas "
+                   f"({concurrencia['decisions']['increase']} subidas, {concurrencia['decisions']['decrease']} bajadas)")
+    reintentos = metricas.summary()['retries']
+    if reintentos or cortacircuitos.opened:
+        safe_print(f"[STATS] Reintentos: {reintentos}, cortacircuitos abierto {cortacircuitos.opened} vez/veces")
+    ancho_banda = get_bandwidth_limiter().stats()
+    if ancho_banda['limit'] or ancho_banda['per_job_limit']:
+        safe_print(f"[STATS] Ancho de banda: {formatear_bytes(ancho_banda['bytes'])} descargados, "
+                   f"{ancho_banda['throttled_seconds']} s de espera por el limite")
+    imprimir_metricas(args.output_dir, args.metrics_file)
+    if args.trace:
+        guardar_traza(trazador, args.trace)
     safe_print(f"[INFO] Log detallado: {log_file}")
     
     # Log del resumen final
-    log_info(f"Resumen final - URLs: {total_urls}, Exitosos: {exitosos}, Fallidos: {fallidos}")
+    log_info(f"Resumen final - URLs: {total_urls}, Exitosos: {exitosos}, Fallidos: {fallidos}, Cache: {cache_stats}, Salida: {salida_stats}")
     
     if fallidos == 0:
         safe_print(f"\n[CELEBRATE] Todos los archivos se descargaron exitosamente!")
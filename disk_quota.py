@@ -0,0 +1,224 @@
+"""
+Size quota, TTL and free-space floor for the finished files of the web
+server. Files are ranked by their last access time, which is set
+explicitly whenever a file is served, so the least recently served ones
+go first; files not served for longer than the TTL go regardless of the
+quota. The modification time is left alone (it is part of the ETag).
+"""
+import os
+import re
+import shutil
+import threading
+import time
+
+_SIZE_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+
+class InsufficientStorageError(OSError):
+    """Raised when a job cannot start because the disk is below the free-space floor"""
+
+
+def parse_size(value):
+    """
+    Parse a size in bytes: a number or a string such as '500M' or '20G'.
+    Empty, zero or None mean no limit.
+
+    :return: Bytes, or None for no limit
+    :raises ValueError: If the value cannot be parsed
+    """
+    if value is None or not str(value).strip():
+        return None
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([KMGT]?)(?:i?B)?\s*', str(value), re.IGNORECASE)
+    if not match:
+        raise ValueError(f"Invalid size: {value!r} (expected bytes, e.g. 500M or 20G)")
+    return int(float(match.group(1)) * _SIZE_UNITS[match.group(2).upper()]) or None
+
+
+def select_evictions(files, now, max_bytes=None, ttl=None, bytes_to_free=0):
+    """
+    Choose the files to delete: every file not accessed for ttl seconds,
+    then the least recently accessed ones until the rest fits in max_bytes
+    and at least bytes_to_free bytes have been released.
+
+    :param files: List of (path, size, last access time)
+    :return: The chosen entries of files, least recently accessed first
+    """
+    ranked = sorted(files, key=lambda entry: entry[2])
+    total = sum(entry[1] for entry in ranked)
+    evicted = []
+    freed = 0
+    for entry in ranked:
+        expired = ttl is not None and now - entry[2] > ttl
+        over_quota = max_bytes is not None and total - freed > max_bytes
+        if not (expired or over_quota or freed < bytes_to_free):
+            # Ranked by access time: no later file is expired either
+            break
+        evicted.append(entry)
+        freed += entry[1]
+    return evicted
+
+
+class DiskQuota:
+    """
+    Keeps the finished files under a size quota and a TTL, and the disk above
+    a free-space floor, by deleting the least recently served files.
+    """
+
+    def __init__(self, root, list_files, on_evict=None, max_bytes=None, ttl=None, min_free_bytes=None,
+                 clock=time.time):
+        """
+        :param root: Directory the files live in (its disk is the one checked for free space)
+        :param list_files: Callable returning the paths that may be evicted (finished files only)
+        :param on_evict: Callable(path) run after a file has been deleted
+        :param max_bytes: Total size allowed for those files (None: no quota)
+        :param ttl: Seconds a file is kept after its last access (None: forever)
+        :param min_free_bytes: Free space required before a new job starts (None: no floor)
+        :param clock: Wall clock in seconds, comparable to file access times (replaceable in tests)
+        """
+        self.root = root
+        self.list_files = list_files
+        self.on_evict = on_evict
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.min_free_bytes = min_free_bytes
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self.evicted_files = 0
+        self.evicted_bytes = 0
+        self.last_sweep = None
+        # Size of the evictable files as of the last sweep plus the files added since (None: unknown)
+        self.known_bytes = None
+
+    @property
+    def enabled(self):
+        return any(limit is not None for limit in (self.max_bytes, self.ttl, self.min_free_bytes))
+
+    def touch(self, path):
+        """Record that a file was just served"""
+        try:
+            stat = os.stat(path)
+            os.utime(path, ns=(int(self.clock() * 1e9), stat.st_mtime_ns))
+        except OSError:
+            pass
+
+    def free_bytes(self):
+        return shutil.disk_usage(self.root).free
+
+    def usage(self):
+        """(path, size, last access time) of every file that may be evicted"""
+        files = []
+        for path in set(self.list_files()):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((path, stat.st_size, stat.st_atime))
+        return files
+
+    def sweep(self):
+        """
+        Delete the files over the quota, past the TTL or needed to get back
+        above the free-space floor.
+
+        :return: List of (path, size) deleted
+        """
+        with self._lock:
+            bytes_to_free = 0
+            if self.min_free_bytes is not None:
+                bytes_to_free = max(0, self.min_free_bytes - self.free_bytes())
+            files = self.usage()
+            chosen = select_evictions(files, self.clock(), self.max_bytes, self.ttl, bytes_to_free)
+            evicted = []
+            for path, size, _ in chosen:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    # Open elsewhere (Windows) or not ours to delete: try again next sweep
+                    print(f"[WARNING] Could not evict {path}: {e}")
+                    continue
+                evicted.append((path, size))
+            self.evicted_files += len(evicted)
+            self.evicted_bytes += sum(size for _, size in evicted)
+            self.known_bytes = sum(entry[1] for entry in files) - sum(size for _, size in evicted)
+            self.last_sweep = self.clock()
+        for path, _ in evicted:
+            if self.on_evict is not None:
+                try:
+                    self.on_evict(path)
+                except Exception as e:
+                    print(f"[ERROR] Eviction callback failed for {path}: {e}")
+        return evicted
+
+    def check_free_space(self):
+        """
+        Make sure a new job can start: below the free-space floor, evict
+        first and fail only if that was not enough.
+
+        :raises InsufficientStorageError: If the disk stays below the floor
+        """
+        if self.min_free_bytes is None or self.free_bytes() >= self.min_free_bytes:
+            return
+        self.sweep()
+        free = self.free_bytes()
+        if free < self.min_free_bytes:
+            raise InsufficientStorageError(
+                f"Not enough free disk space: {free} bytes free in {self.root}, {self.min_free_bytes} required"
+            )
+
+    def add_file(self, path):
+        """
+        Account for a newly finished file and wake the sweeper up only if it
+        pushed the total over the quota or the disk under the floor; the TTL
+        is left to the periodic sweep. Cheap enough to call on every completion.
+        """
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        with self._lock:
+            if self.known_bytes is not None:
+                self.known_bytes += size
+            over_quota = self.max_bytes is not None and (self.known_bytes is None or self.known_bytes > self.max_bytes)
+        if over_quota or (self.min_free_bytes is not None and self.free_bytes() < self.min_free_bytes):
+            self.request_sweep()
+
+    def request_sweep(self):
+        """Wake the background sweeper up (e.g. after a file was added)"""
+        self._wake.set()
+
+    def start(self, interval):
+        """Sweep every interval seconds, and on request_sweep(), in a daemon thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, args=(interval,), name='disk-quota', daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self, interval):
+        while True:
+            self._wake.wait(interval)
+            self._wake.clear()
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"[ERROR] Disk quota sweep failed: {e}")
+
+    def stats(self):
+        with self._lock:
+            stats = {
+                'max_bytes': self.max_bytes,
+                'ttl_seconds': self.ttl,
+                'min_free_bytes': self.min_free_bytes,
+                'evicted_files': self.evicted_files,
+                'evicted_bytes': self.evicted_bytes,
+                'known_bytes': self.known_bytes,
+                'last_sweep': self.last_sweep,
+            }
+        try:
+            stats['free_bytes'] = self.free_bytes()
+        except OSError:
+            stats['free_bytes'] = None
+        return stats
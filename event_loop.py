@@ -0,0 +1,89 @@
+"""
+Serving modes of the web server. 'threading' gives every connection an OS
+thread (Werkzeug development server); 'eventlet' serves HTTP and Socket.IO
+from one green-thread event loop, so idle connections cost a greenlet
+instead of a thread.
+
+The standard library is not monkey-patched in either mode: the download
+and transcode workers stay native threads and are the executor of the
+blocking yt-dlp and FFmpeg work. Code running on the loop goes through an
+Offloader: short blocking calls (a file read, a key computation) run in
+eventlet's native thread pool, long calls run on an executor of their own,
+and waits for other threads (futures, buffers) are polled with green
+sleeps, so no client can hold a pool thread for a whole download. Workers
+reach the clients through the progress broadcaster, which emits from the loop.
+"""
+
+THREADING = 'threading'
+EVENTLET = 'eventlet'
+ASYNC_MODES = (THREADING, EVENTLET)
+
+# Seconds between polls of a future or buffer filled by a native thread
+POLL_INTERVAL = 0.05
+
+
+class Offloader:
+    """Runs blocking calls of request handlers off the event loop (a no-op in threading mode)"""
+
+    def __init__(self, mode=THREADING):
+        """
+        :param mode: THREADING or EVENTLET
+        :raises ValueError: If the mode is unknown
+        """
+        if mode not in ASYNC_MODES:
+            raise ValueError(f"Async mode must be one of {', '.join(ASYNC_MODES)}, not {mode!r}")
+        self.mode = mode
+        self._tpool = None
+        # Cooperative sleep of the loop (None in threading mode)
+        self.sleep = None
+        if mode == EVENTLET:
+            import eventlet
+            from eventlet import tpool
+            self._tpool = tpool
+            self.sleep = eventlet.sleep
+
+    def call(self, function, *args, **kwargs):
+        """
+        function(*args, **kwargs), run in a native thread while the loop keeps
+        serving. Only for short calls: the thread pool is shared and small.
+        """
+        if self._tpool is None:
+            return function(*args, **kwargs)
+        return self._tpool.execute(function, *args, **kwargs)
+
+    def wait(self, future):
+        """Result of a concurrent.futures.Future, polled without holding a thread"""
+        if self.sleep is not None:
+            while not future.done():
+                self.sleep(POLL_INTERVAL)
+        return future.result()
+
+    def run(self, executor, function, *args):
+        """function(*args) on a dedicated executor, for long calls that must not take the shared pool"""
+        if self.sleep is None:
+            return function(*args)
+        return self.wait(executor.submit(function, *args))
+
+    def iterate(self, iterable):
+        """
+        Response body whose items are produced in a native thread, for
+        bodies whose items come quickly (file reads). In threading mode the
+        iterable is returned as is (a wsgi.file_wrapper keeps its sendfile path).
+        """
+        if self._tpool is None:
+            return iterable
+        return self._iterate(iter(iterable))
+
+    def _iterate(self, iterator):
+        done = object()
+        try:
+            while True:
+                item = self._tpool.execute(next, iterator, done)
+                if item is done:
+                    return
+                yield item
+        finally:
+            # Client gone or body finished: release the source (files, pipes)
+            close = getattr(iterator, 'close', None)
+            if close is not None:
+                close()
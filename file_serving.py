@@ -0,0 +1,178 @@
+"""
+HTTP validators and byte ranges for finished files: strong ETags,
+Last-Modified, 304/412/416 answers and single byte ranges, plus the headers
+that hand the transfer to a front proxy (X-Accel-Redirect for nginx,
+X-Sendfile for Apache and lighttpd) instead of copying the file in Python
+"""
+import email.utils
+import os
+from urllib.parse import quote
+
+# How the body of a file response is transferred (FILE_SENDING)
+DIRECT = 'direct'          # The WSGI server sends it (os.sendfile via wsgi.file_wrapper when it has one)
+X_ACCEL = 'x-accel'        # nginx: X-Accel-Redirect to an internal location
+X_SENDFILE = 'x-sendfile'  # Apache mod_xsendfile, lighttpd: X-Sendfile with the absolute path
+SENDING_MODES = (DIRECT, X_ACCEL, X_SENDFILE)
+
+# Bytes per read when a range is sent from Python
+CHUNK_SIZE = 256 * 1024
+
+
+def file_etag(stat):
+    """Strong ETag of a finished file: size and modification time (files are never rewritten in place)"""
+    return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+
+def _parse_http_date(value):
+    """Seconds since the epoch of an HTTP date, or None if it cannot be parsed"""
+    try:
+        return email.utils.parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return None
+
+
+def _etag_list(value):
+    """ETags of an If-Match/If-None-Match header ('*' is returned as is)"""
+    return [tag.strip() for tag in value.split(',') if tag.strip()]
+
+
+def _weak_match(tags, etag):
+    opaque = etag[2:] if etag.startswith('W/') else etag
+    return any(tag == '*' or (tag[2:] if tag.startswith('W/') else tag) == opaque for tag in tags)
+
+
+def parse_range(header, size):
+    """
+    The byte range requested by a Range header, as (start, length).
+
+    Only single ranges are honoured; multiple ranges and malformed headers
+    are ignored, which lets the whole file be served (RFC 9110, 14.2).
+
+    :return: (start, length), None to serve the whole file, or False if
+             the range cannot be satisfied (416)
+    """
+    if not header:
+        return None
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in spec:
+        return None
+    first, dash, last = spec.strip().partition('-')
+    if not dash or not (first or last) or (first and not first.isdigit()) or (last and not last.isdigit()):
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        suffix = int(last)
+        if suffix == 0 or size == 0:
+            return False
+        start = max(size - suffix, 0)
+        return start, size - start
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        return False
+    return start, end - start + 1
+
+
+def evaluate_request(headers, stat, method='GET', max_age=0):
+    """
+    Answer the conditional and range headers of a request for a file.
+
+    :param headers: Request headers (anything with a case-insensitive get())
+    :param stat: os.stat() of the file
+    :param method: Request method (ranges only apply to GET)
+    :param max_age: Seconds shared caches may reuse the file without revalidating
+    :return: Tuple (status, response headers, (start, length) of the body or None)
+    """
+    size = stat.st_size
+    etag = file_etag(stat)
+    last_modified = int(stat.st_mtime)
+    response_headers = {
+        'ETag': etag,
+        'Last-Modified': email.utils.formatdate(last_modified, usegmt=True),
+        'Accept-Ranges': 'bytes',
+        'Cache-Control': f'public, max-age={max_age}' if max_age else 'public, no-cache',
+    }
+
+    # Preconditions (RFC 9110, 13.2.2): If-Match, If-Unmodified-Since, If-None-Match, If-Modified-Since
+    if_match = headers.get('If-Match')
+    if if_match:
+        tags = _etag_list(if_match)
+        if '*' not in tags and etag not in tags:
+            return 412, response_headers, None
+    elif headers.get('If-Unmodified-Since'):
+        since = _parse_http_date(headers.get('If-Unmodified-Since'))
+        if since is not None and last_modified > since:
+            return 412, response_headers, None
+
+    if_none_match = headers.get('If-None-Match')
+    if if_none_match:
+        if _weak_match(_etag_list(if_none_match), etag):
+            return 304, response_headers, None
+    elif headers.get('If-Modified-Since') and method in ('GET', 'HEAD'):
+        since = _parse_http_date(headers.get('If-Modified-Since'))
+        if since is not None and last_modified <= since:
+            return 304, response_headers, None
+
+    byte_range = parse_range(headers.get('Range'), size) if method == 'GET' else None
+    if_range = headers.get('If-Range')
+    if byte_range is not None and if_range:
+        # The range only applies to the representation the client already has
+        if if_range.startswith('"'):
+            still_valid = if_range == etag
+        else:
+            still_valid = _parse_http_date(if_range) == last_modified
+        if not still_valid:
+            byte_range = None
+
+    if byte_range is False:
+        response_headers['Content-Range'] = f'bytes */{size}'
+        return 416, response_headers, None
+    if byte_range is not None:
+        start, length = byte_range
+        response_headers['Content-Range'] = f'bytes {start}-{start + length - 1}/{size}'
+        response_headers['Content-Length'] = str(length)
+        return 206, response_headers, byte_range
+    response_headers['Content-Length'] = str(size)
+    return 200, response_headers, (0, size)
+
+
+def proxy_headers(mode, filepath, root, accel_prefix='/protected-downloads/'):
+    """
+    Headers that make the front proxy send the file itself.
+
+    :param mode: X_ACCEL or X_SENDFILE
+    :param root: Directory the X-Accel-Redirect location maps to
+    :param accel_prefix: URI prefix of that internal nginx location
+    :return: Dict of headers, or None if the file cannot be handed over
+             (outside root for X_ACCEL, or DIRECT mode)
+    """
+    if mode == X_SENDFILE:
+        return {'X-Sendfile': os.path.abspath(filepath)}
+    if mode == X_ACCEL:
+        try:
+            relative = os.path.relpath(os.path.abspath(filepath), os.path.abspath(root))
+        except ValueError:
+            # Another drive (Windows)
+            return None
+        if relative.startswith(os.pardir):
+            return None
+        path = '/'.join(quote(part) for part in relative.split(os.sep))
+        return {'X-Accel-Redirect': accel_prefix.rstrip('/') + '/' + path}
+    return None
+
+
+def iter_file_range(file, start, length, chunk_size=CHUNK_SIZE):
+    """Yield length bytes of an open file from start, then close it"""
+    try:
+        file.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = file.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        file.close()
@@ -0,0 +1,174 @@
+"""
+Bounded job queue with a fixed-size worker pool for the web server
+"""
+import queue
+import threading
+
+
+class QueueFullError(Exception):
+    """Raised when a job cannot be accepted because the queue is full"""
+
+    def __init__(self, free_slots=0):
+        super().__init__(f"Job queue is full ({free_slots} free slots)")
+        self.free_slots = free_slots
+
+
+class JobQueue:
+    """FIFO job queue drained by a fixed number of worker threads"""
+
+    def __init__(self, handler, num_workers=3, max_size=200, name='worker', gate=None):
+        """
+        :param handler: Callable run by the workers for every job (receives the job args)
+        :param num_workers: Number of worker threads draining the queue
+        :param max_size: Maximum number of jobs waiting in the queue
+        :param name: Prefix for the worker thread names
+        :param gate: Optional AdaptiveLimit; only that many workers take jobs at a time
+        """
+        if num_workers < 1:
+            raise ValueError("num_workers must be at least 1")
+        if max_size < 1:
+            raise ValueError("max_size must be at least 1")
+
+        self.handler = handler
+        self.num_workers = num_workers
+        self.max_size = max_size
+        self.name = name
+        self.gate = gate
+
+        self._queue = queue.Queue(maxsize=max_size)
+        self._submit_lock = threading.Lock()
+        self._state_lock = threading.Lock()
+        self._workers = []
+        self._active = 0
+        # Jobs taken off the queue by a worker that is waiting for a gate slot
+        self._waiting = 0
+        self._started = False
+
+    def start(self):
+        """Start the worker threads (idempotent)"""
+        with self._state_lock:
+            if self._started:
+                return
+            self._started = True
+            for i in range(self.num_workers):
+                thread = threading.Thread(target=self._run, name=f"{self.name}-{i + 1}", daemon=True)
+                thread.start()
+                self._workers.append(thread)
+
+    def _run(self):
+        """Worker loop: take jobs from the queue until a stop sentinel arrives"""
+        while True:
+            job = self._queue.get()
+            if job is None:
+                self._queue.task_done()
+                return
+
+            # Only a job holds a gate slot: idle workers must not look like a
+            # saturated pool. Until it gets one, the job still counts as queued
+            if self.gate is not None:
+                with self._state_lock:
+                    self._waiting += 1
+                self.gate.acquire()
+            with self._state_lock:
+                if self.gate is not None:
+                    self._waiting -= 1
+                self._active += 1
+            try:
+                self.handler(*job)
+            except Exception as e:
+                # The handler is responsible for its own error reporting;
+                # never let one job kill the worker thread
+                print(f"[ERROR] Unhandled error in {threading.current_thread().name}: {e}")
+            finally:
+                with self._state_lock:
+                    self._active -= 1
+                self._release_gate()
+                self._queue.task_done()
+
+    def _release_gate(self):
+        if self.gate is not None:
+            self.gate.release()
+
+    def limit(self):
+        """Number of workers allowed to take jobs (the pool size without a gate)"""
+        return self.gate.limit if self.gate is not None else self.num_workers
+
+    def submit(self, *args):
+        """
+        Enqueue a single job without blocking.
+
+        :raises QueueFullError: If the queue has no free slots
+        """
+        self.submit_many([args])
+
+    def put(self, *args, timeout=None):
+        """
+        Enqueue a single job, blocking while the queue is full.
+
+        Used between pipeline stages so a fast stage waits for a slow one.
+        Do not mix with submit_many() on the same queue: put() does not take
+        the submit lock that makes batch submissions atomic.
+
+        :raises QueueFullError: If the timeout expires before a slot frees up
+        """
+        self.start()
+        try:
+            self._queue.put(tuple(args), timeout=timeout)
+        except queue.Full:
+            raise QueueFullError(0)
+
+    def submit_many(self, jobs):
+        """
+        Enqueue several jobs atomically: either all of them are accepted or none.
+
+        :param jobs: List of argument tuples, one per job
+        :raises QueueFullError: If there are not enough free slots for every job
+        """
+        self.start()
+        with self._submit_lock:
+            # Only submitters add items and they hold this lock, so the free
+            # space can only grow between the check and the puts
+            free = self.free_slots()
+            if len(jobs) > free:
+                raise QueueFullError(free)
+            for job in jobs:
+                self._queue.put_nowait(tuple(job))
+
+    def free_slots(self):
+        """Number of jobs that can still be queued"""
+        return max(self.max_size - self.depth(), 0)
+
+    def depth(self):
+        """Number of jobs waiting to start, in the queue or in a worker waiting for the gate"""
+        with self._state_lock:
+            waiting = self._waiting
+        return self._queue.qsize() + waiting
+
+    def active(self):
+        """Number of jobs currently being processed"""
+        with self._state_lock:
+            return self._active
+
+    def stats(self):
+        """Snapshot of the queue state"""
+        return {
+            'workers': self.num_workers,
+            'limit': self.limit(),
+            'active': self.active(),
+            'queued': self.depth(),
+            'max_queue_size': self.max_size,
+        }
+
+    def stop(self, wait=True):
+        """Ask every worker to exit once the jobs ahead of the sentinel are done"""
+        with self._state_lock:
+            if not self._started:
+                return
+            workers = list(self._workers)
+            self._workers = []
+            self._started = False
+        for _ in workers:
+            self._queue.put(None)
+        if wait:
+            for thread in workers:
+                thread.join()
@@ -0,0 +1,232 @@
+"""
+Durable SQLite store for the web server download jobs
+"""
+import base64
+import json
+import sqlite3
+import threading
+
+# Columns stored natively (indexable); any other field goes to the JSON 'extra' column
+COLUMNS = (
+    'id', 'url', 'status', 'output_dir', 'title', 'filename', 'filepath', 'error',
+    'created_at', 'started_at', 'completed_at', 'failed_at', 'batch_id',
+)
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+class InvalidCursorError(ValueError):
+    """Raised when a pagination cursor cannot be decoded"""
+
+
+def encode_cursor(created_at, job_id):
+    return base64.urlsafe_b64encode(f"{created_at}|{job_id}".encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        created_at, job_id = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8').split('|', 1)
+    except (ValueError, UnicodeError) as e:
+        raise InvalidCursorError(f"Invalid cursor: {cursor}") from e
+    return created_at, job_id
+
+
+class JobStore:
+    """Job records in SQLite (WAL mode), one connection per thread"""
+
+    def __init__(self, db_path):
+        """
+        :param db_path: Path of the SQLite database file
+        """
+        self.db_path = str(db_path)
+        self._local = threading.local()
+        self._init_schema()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self):
+        conn = self._connection()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, extra TEXT NOT NULL DEFAULT '{}')"
+        )
+        # Add any column missing from databases created by older versions
+        existing = {row['name'] for row in conn.execute('PRAGMA table_info(jobs)')}
+        for column in COLUMNS:
+            if column not in existing:
+                conn.execute(f'ALTER TABLE jobs ADD COLUMN {column} TEXT')
+        if 'batch_id' not in existing:
+            # Older versions kept the batch in 'extra'
+            for row in conn.execute('SELECT id, extra FROM jobs').fetchall():
+                batch_id = json.loads(row['extra'] or '{}').get('batch_id')
+                if batch_id:
+                    conn.execute('UPDATE jobs SET batch_id = ? WHERE id = ?', (batch_id, row['id']))
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_created_at ON jobs (created_at, id)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_batch ON jobs (batch_id, created_at)')
+
+    @staticmethod
+    def _split(fields):
+        """Split a record into native column values and extra fields"""
+        native = {k: v for k, v in fields.items() if k in COLUMNS}
+        extra = {k: v for k, v in fields.items() if k not in COLUMNS}
+        return native, extra
+
+    @staticmethod
+    def _to_dict(row):
+        record = json.loads(row['extra'] or '{}')
+        record.update({k: row[k] for k in COLUMNS if row[k] is not None})
+        return record
+
+    def create_many(self, records):
+        """Insert several job records in a single transaction"""
+        conn = self._connection()
+        with conn:
+            conn.execute('BEGIN')
+            for record in records:
+                native, extra = self._split(record)
+                columns = list(native) + ['extra']
+                conn.execute(
+                    f"INSERT INTO jobs ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                    list(native.values()) + [json.dumps(extra)]
+                )
+
+    def create(self, record):
+        self.create_many([record])
+
+    def update(self, job_id, **fields):
+        """Update some fields of a job (unknown fields are merged into 'extra')"""
+        native, extra = self._split(fields)
+        conn = self._connection()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            if extra:
+                row = conn.execute('SELECT extra FROM jobs WHERE id = ?', (job_id,)).fetchone()
+                if row is None:
+                    return
+                merged = json.loads(row['extra'] or '{}')
+                merged.update(extra)
+                native['extra'] = json.dumps(merged)
+            if native:
+                assignments = ', '.join(f'{k} = ?' for k in native)
+                conn.execute(f'UPDATE jobs SET {assignments} WHERE id = ?', list(native.values()) + [job_id])
+
+    def get(self, job_id):
+        """Return a job record as a dict, or None"""
+        row = self._connection().execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return self._to_dict(row) if row else None
+
+    def get_many(self, job_ids):
+        """Return the records of several jobs, in the given order (missing ones skipped)"""
+        if not job_ids:
+            return []
+        rows = self._connection().execute(
+            f"SELECT * FROM jobs WHERE id IN ({', '.join('?' * len(job_ids))})", list(job_ids)
+        ).fetchall()
+        by_id = {row['id']: self._to_dict(row) for row in rows}
+        return [by_id[job_id] for job_id in job_ids if job_id in by_id]
+
+    def delete_many(self, job_ids):
+        conn = self._connection()
+        with conn:
+            conn.execute('BEGIN')
+            conn.executemany('DELETE FROM jobs WHERE id = ?', [(job_id,) for job_id in job_ids])
+
+    def list(self, statuses=None, limit=DEFAULT_PAGE_SIZE, cursor=None):
+        """
+        Page through jobs, newest first.
+
+        :param statuses: Optional list of statuses to filter on
+        :param limit: Page size (capped at MAX_PAGE_SIZE)
+        :param cursor: Opaque cursor returned by the previous page
+        :return: Tuple (records, next_cursor); next_cursor is None on the last page
+        """
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        clauses = []
+        params = []
+        if statuses:
+            clauses.append(f"status IN ({', '.join('?' * len(statuses))})")
+            params.extend(statuses)
+        if cursor:
+            created_at, job_id = decode_cursor(cursor)
+            clauses.append('(created_at < ? OR (created_at = ? AND id < ?))')
+            params.extend([created_at, created_at, job_id])
+
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        rows = self._connection().execute(
+            f'SELECT * FROM jobs {where} ORDER BY created_at DESC, id DESC LIMIT ?',
+            params + [limit + 1]
+        ).fetchall()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1]['created_at'], rows[-1]['id'])
+        return [self._to_dict(row) for row in rows], next_cursor
+
+    def iter_by_status(self, statuses, batch_size=MAX_PAGE_SIZE):
+        """Iterate over every job in the given statuses, oldest first"""
+        last = ('', '')
+        while True:
+            rows = self._connection().execute(
+                f"SELECT * FROM jobs WHERE status IN ({', '.join('?' * len(statuses))}) "
+                "AND (created_at > ? OR (created_at = ? AND id > ?)) "
+                "ORDER BY created_at, id LIMIT ?",
+                list(statuses) + [last[0], last[0], last[1], batch_size]
+            ).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield self._to_dict(row)
+            last = (rows[-1]['created_at'], rows[-1]['id'])
+
+    def iter_by_batch(self, batch_id, statuses=None, batch_size=MAX_PAGE_SIZE):
+        """Iterate over the jobs of a batch (optionally only some statuses), oldest first"""
+        status_clause = f"AND status IN ({', '.join('?' * len(statuses))}) " if statuses else ''
+        last = ('', '')
+        while True:
+            rows = self._connection().execute(
+                f"SELECT * FROM jobs WHERE batch_id = ? {status_clause}"
+                "AND (created_at > ? OR (created_at = ? AND id > ?)) "
+                "ORDER BY created_at, id LIMIT ?",
+                [batch_id] + list(statuses or []) + [last[0], last[0], last[1], batch_size]
+            ).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield self._to_dict(row)
+            last = (rows[-1]['created_at'], rows[-1]['id'])
+
+    def completed_filepaths(self):
+        """Distinct files of the completed jobs (several jobs can share one through the result cache)"""
+        rows = self._connection().execute(
+            "SELECT DISTINCT filepath FROM jobs WHERE status = 'completed' AND filepath IS NOT NULL"
+        ).fetchall()
+        return [row['filepath'] for row in rows]
+
+    def expire_filepath(self, filepath, expired_at):
+        """
+        Mark the completed jobs of a deleted file as expired.
+
+        :return: Ids of the jobs that were marked
+        """
+        rows = self._connection().execute(
+            "SELECT id FROM jobs WHERE status = 'completed' AND filepath = ?", (filepath,)
+        ).fetchall()
+        job_ids = [row['id'] for row in rows]
+        for job_id in job_ids:
+            self.update(job_id, status='expired', expired_at=expired_at)
+        return job_ids
+
+    def count_by_status(self):
+        rows = self._connection().execute('SELECT status, COUNT(*) AS n FROM jobs GROUP BY status').fetchall()
+        return {row['status']: row['n'] for row in rows}
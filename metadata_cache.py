@@ -0,0 +1,212 @@
+"""
+On-disk cache of yt-dlp metadata (info dicts) keyed by extractor and video ID
+"""
+import copy
+import functools
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+# Defaults can be overridden with environment variables
+CACHE_DIR = os.environ.get('CACHE_DIR', os.path.join(os.getcwd(), '.cache'))
+# Stream URLs inside the info dict expire after a few hours, keep entries well below that
+METADATA_CACHE_TTL = int(os.environ.get('METADATA_CACHE_TTL', '1800'))
+METADATA_CACHE_MAX_ENTRIES = int(os.environ.get('METADATA_CACHE_MAX_ENTRIES', '1000'))
+
+
+@functools.lru_cache(maxsize=4096)
+def video_key_from_url(url):
+    """
+    Resolve a URL to an 'Extractor:video_id' key without touching the network.
+
+    :return: The key, or None if no specific extractor recognises the URL
+    """
+    from yt_dlp.extractor import gen_extractor_classes
+
+    for ie in gen_extractor_classes():
+        if ie.ie_key() == 'Generic' or not ie.suitable(url):
+            continue
+        video_id = ie.get_temp_id(url)
+        if video_id:
+            return f"{ie.ie_key()}:{video_id}"
+        return None
+    return None
+
+
+def video_key_from_info(info):
+    """Build the 'Extractor:video_id' key from an extracted info dict"""
+    extractor = info.get('extractor_key') or info.get('ie_key') or info.get('extractor')
+    video_id = info.get('id')
+    if not extractor or not video_id:
+        return None
+    return f"{extractor}:{video_id}"
+
+
+def cache_key_for_url(url):
+    """Cache key for a URL: the video key when it can be resolved, a URL hash otherwise"""
+    return video_key_from_url(url) or f"url:{hashlib.sha1(url.encode('utf-8')).hexdigest()}"
+
+
+class MetadataCache:
+    """TTL-bounded, size-capped JSON cache of sanitized info dicts"""
+
+    def __init__(self, cache_dir, ttl=METADATA_CACHE_TTL, max_entries=METADATA_CACHE_MAX_ENTRIES):
+        """
+        :param cache_dir: Directory where the entries are stored (one JSON file per key)
+        :param ttl: Seconds an entry stays valid (0 disables the cache)
+        :param max_entries: Maximum number of entries kept on disk
+        """
+        self.cache_dir = Path(cache_dir)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self):
+        return self.ttl > 0 and self.max_entries > 0
+
+    def _path(self, key):
+        return self.cache_dir / f"{hashlib.sha1(key.encode('utf-8')).hexdigest()}.json"
+
+    def get(self, key):
+        """Return the cached info dict for a key, or None if missing or expired"""
+        if not self.enabled or not key:
+            return None
+
+        path = self._path(key)
+        with self._lock:
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    entry = json.load(f)
+            except (OSError, ValueError):
+                self.misses += 1
+                return None
+
+            if time.time() - entry.get('cached_at', 0) > self.ttl:
+                self._remove(path)
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            return entry.get('info')
+
+    def set(self, info, *keys):
+        """Store an info dict under one or more keys"""
+        if not self.enabled or info is None:
+            return
+
+        entry = json.dumps({'cached_at': time.time(), 'info': info}, ensure_ascii=False)
+        with self._lock:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            for key in dict.fromkeys(k for k in keys if k):
+                path = self._path(key)
+                tmp_path = path.with_suffix(f'.{threading.get_ident()}.tmp')
+                try:
+                    with open(tmp_path, 'w', encoding='utf-8') as f:
+                        f.write(entry)
+                    os.replace(tmp_path, path)
+                except OSError:
+                    self._remove(tmp_path)
+            self._prune()
+
+    def invalidate(self, *keys):
+        """Drop the entries for the given keys"""
+        with self._lock:
+            for key in keys:
+                if key:
+                    self._remove(self._path(key))
+
+    def _prune(self):
+        """Delete the oldest entries above max_entries (caller holds the lock)"""
+        try:
+            entries = [(p.stat().st_mtime, p) for p in self.cache_dir.glob('*.json')]
+        except OSError:
+            return
+        excess = len(entries) - self.max_entries
+        if excess <= 0:
+            return
+        entries.sort()
+        for _, path in entries[:excess]:
+            self._remove(path)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_metadata_cache():
+    """Process-wide metadata cache stored under CACHE_DIR/metadata"""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = MetadataCache(os.path.join(CACHE_DIR, 'metadata'))
+        return _default_cache
+
+
+def extract_info_cached(ydl, url, cache=None):
+    """
+    Extract the info dict for a URL once, reusing a cached copy when available.
+
+    :param ydl: yt_dlp.YoutubeDL instance
+    :param url: Video URL
+    :param cache: MetadataCache (defaults to the process-wide cache)
+    :return: Tuple (info, from_cache)
+    """
+    cache = cache if cache is not None else get_metadata_cache()
+    url_key = cache_key_for_url(url)
+
+    info = cache.get(url_key)
+    if info is not None:
+        return info, True
+
+    info = ydl.sanitize_info(ydl.extract_info(url, download=False), remove_private_keys=True)
+    cache.set(info, url_key, video_key_from_info(info))
+    return info, False
+
+
+def download_with_info(ydl, url, info, from_cache=False, cache=None):
+    """
+    Download using an already extracted info dict, without extracting again.
+
+    If a cached info dict fails (e.g. its stream URLs expired), the entry is
+    dropped and the URL is extracted and downloaded once more.
+
+    :return: The processed info dict returned by yt-dlp
+    """
+    import yt_dlp
+
+    try:
+        return ydl.process_ie_result(copy.deepcopy(info), download=True)
+    except yt_dlp.utils.DownloadError:
+        if not from_cache:
+            raise
+
+    cache = cache if cache is not None else get_metadata_cache()
+    cache.invalidate(cache_key_for_url(url), video_key_from_info(info))
+    info, _ = extract_info_cached(ydl, url, cache)
+    return ydl.process_ie_result(copy.deepcopy(info), download=True)
+
+
+def downloaded_filepath(result):
+    """Final path (after post-processing) of the file produced by download_with_info"""
+    if not result:
+        return None
+    for download in result.get('requested_downloads') or []:
+        if download.get('filepath'):
+            return download['filepath']
+    return result.get('filepath')
@@ -0,0 +1,332 @@
+"""
+In-process job metrics (phase latency histograms, byte and failure counters,
+queue and worker gauges) exported in the Prometheus text format
+"""
+import math
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Job phases with a latency histogram
+EXTRACT = 'extract'
+DOWNLOAD = 'download'
+TRANSCODE = 'transcode'
+TOTAL = 'total'
+PHASES = (EXTRACT, DOWNLOAD, TRANSCODE, TOTAL)
+
+# Seconds; from a metadata cache hit to a long video on a slow link
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+
+def format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if value == -math.inf:
+        return '-Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{escape_label(value)}"' for name, value in pairs) + '}'
+
+
+def error_class(error):
+    """
+    Name of the class of an error, looking through the DownloadError wrapper
+    of yt-dlp to the original exception (HTTPError, ExtractorError, ...)
+    """
+    if not isinstance(error, BaseException):
+        return 'Error'
+    exc_info = getattr(error, 'exc_info', None)
+    if exc_info and isinstance(exc_info[1], BaseException):
+        error = exc_info[1]
+    return type(error).__name__
+
+
+def http_status(error):
+    """
+    HTTP status code behind an error (looking through DownloadError), or
+    None if it is not an HTTP error
+    """
+    if not isinstance(error, BaseException):
+        return None
+    exc_info = getattr(error, 'exc_info', None)
+    if exc_info and isinstance(exc_info[1], BaseException):
+        error = exc_info[1]
+    for attribute in ('status', 'code'):
+        status = getattr(error, attribute, None)
+        if isinstance(status, int) and 100 <= status <= 599:
+            return status
+    match = re.search(r'HTTP Error (\d{3})', str(error))
+    return int(match.group(1)) if match else None
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} expects labels {self.label_names}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        lines.extend(self._samples())
+        return '\n'.join(lines)
+
+
+class Counter(_Metric):
+    """Monotonic total, optionally per label values"""
+    kind = 'counter'
+
+    def __init__(self, name, documentation, label_names=()):
+        super().__init__(name, documentation, label_names)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        if amount < 0:
+            raise ValueError("Counters can only increase")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def values(self):
+        """Current totals keyed by label values"""
+        with self._lock:
+            return dict(self._values)
+
+    def _samples(self):
+        for key, value in sorted(self.values().items()):
+            yield f'{self.name}{format_labels(self.label_names, key)} {format_value(value)}'
+
+
+class Gauge(_Metric):
+    """
+    Value that goes up and down. Either set explicitly or read on every
+    export from a callback returning a number, or a dict of numbers keyed
+    by the value of the (single) label.
+    """
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, label_names=(), callback=None):
+        super().__init__(name, documentation, label_names)
+        self.callback = callback
+        self._values = {}
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def values(self):
+        if self.callback is None:
+            with self._lock:
+                return dict(self._values)
+        try:
+            value = self.callback()
+        except Exception:
+            # A gauge that cannot be read (e.g. a missing directory) is left out
+            return {}
+        if isinstance(value, dict):
+            return {(str(label),): v for label, v in value.items()}
+        return {(): value}
+
+    def _samples(self):
+        for key, value in sorted(self.values().items()):
+            yield f'{self.name}{format_labels(self.label_names, key)} {format_value(value)}'
+
+
+class Histogram(_Metric):
+    """Cumulative bucket counts, sum and count of observations per label values"""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._series = {}  # label values -> [bucket counts, sum, count]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the seconds spent in the with block (also when it raises)"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def series(self):
+        """(cumulative bucket counts, sum, count) keyed by label values"""
+        with self._lock:
+            snapshot = {key: (list(s[0]), s[1], s[2]) for key, s in self._series.items()}
+        result = {}
+        for key, (counts, total, count) in snapshot.items():
+            cumulative = []
+            running = 0
+            for n in counts:
+                running += n
+                cumulative.append(running)
+            result[key] = (cumulative, total, count)
+        return result
+
+    def quantile(self, q, **labels):
+        """
+        Estimate a quantile by linear interpolation inside its bucket, as
+        Prometheus' histogram_quantile() does; None without observations.
+        """
+        series = self.series().get(self._key(labels))
+        if not series or not series[2]:
+            return None
+        cumulative, _, count = series
+        rank = q * count
+        lower = 0.0
+        previous = 0
+        for bound, running in zip(self.buckets, cumulative):
+            if running >= rank:
+                if bound == math.inf:
+                    return lower
+                in_bucket = running - previous
+                return lower + (bound - lower) * ((rank - previous) / in_bucket if in_bucket else 0)
+            lower, previous = bound, running
+        return lower
+
+    def _samples(self):
+        for key, (cumulative, total, count) in sorted(self.series().items()):
+            for bound, running in zip(self.buckets, cumulative):
+                labels = format_labels(self.label_names, key, [('le', format_value(bound))])
+                yield f'{self.name}_bucket{labels} {running}'
+            labels = format_labels(self.label_names, key)
+            yield f'{self.name}_sum{labels} {format_value(total)}'
+            yield f'{self.name}_count{labels} {count}'
+
+
+class MetricsRegistry:
+    """Ordered set of metrics rendered together"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            # Registering a name again replaces it (e.g. a gauge bound to a new queue)
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, label_names=()):
+        return self._register(Counter(name, documentation, label_names))
+
+    def gauge(self, name, documentation, label_names=(), callback=None):
+        return self._register(Gauge(name, documentation, label_names, callback))
+
+    def histogram(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, label_names, buckets))
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+
+class JobMetrics(MetricsRegistry):
+    """The metrics shared by the web server and the CLI"""
+
+    def __init__(self):
+        super().__init__()
+        self.phase_seconds = self.histogram(
+            'youtube2mp3_phase_seconds',
+            'Seconds spent per job phase (extract, download, transcode, and total from queued to completed)',
+            ('phase',)
+        )
+        self.downloaded_bytes = self.counter(
+            'youtube2mp3_downloaded_bytes_total', 'Bytes of source audio downloaded'
+        )
+        self.written_bytes = self.counter(
+            'youtube2mp3_written_bytes_total', 'Bytes of converted audio written'
+        )
+        self.failures = self.counter(
+            'youtube2mp3_failures_total', 'Failed job phases by error class', ('phase', 'error_class')
+        )
+        self.http_errors = self.counter(
+            'youtube2mp3_http_errors_total', 'Failed job phases caused by an HTTP error, by status', ('status',)
+        )
+        self.retries = self.counter(
+            'youtube2mp3_retries_total', 'Jobs sent back for another attempt after a retryable error, by error class',
+            ('error_class',)
+        )
+
+    def time_phase(self, phase):
+        return self.phase_seconds.time(phase=phase)
+
+    def record_failure(self, phase, error):
+        self.failures.inc(phase=phase, error_class=error_class(error))
+        status = http_status(error)
+        if status is not None:
+            self.http_errors.inc(status=status)
+
+    def record_retry(self, error):
+        self.retries.inc(error_class=error_class(error))
+
+    def summary(self):
+        """Plain dict with the same data, for the CLI and logs"""
+        phases = {}
+        for (phase,), (_, total, count) in self.phase_seconds.series().items():
+            phases[phase] = {
+                'count': count,
+                'mean': round(total / count, 3) if count else None,
+                'p50': round(self.phase_seconds.quantile(0.5, phase=phase), 3),
+                'p95': round(self.phase_seconds.quantile(0.95, phase=phase), 3),
+            }
+        return {
+            'phases': {phase: phases[phase] for phase in PHASES if phase in phases},
+            'downloaded_bytes': self.downloaded_bytes.values().get((), 0),
+            'written_bytes': self.written_bytes.values().get((), 0),
+            'failures': {
+                f'{phase}/{error}': count for (phase, error), count in sorted(self.failures.values().items())
+            },
+            'retries': sum(self.retries.values().values()),
+        }
+
+
+_default_metrics = None
+_default_metrics_lock = threading.Lock()
+
+
+def get_metrics():
+    """Process-wide job metrics"""
+    global _default_metrics
+    with _default_metrics_lock:
+        if _default_metrics is None:
+            _default_metrics = JobMetrics()
+        return _default_metrics
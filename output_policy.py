@@ -0,0 +1,157 @@
+"""
+Output policy: decide per file whether the downloaded audio can be kept
+(remuxed into a standard container) or has to be transcoded
+"""
+import threading
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Policies
+MP3 = 'mp3'                  # Always transcode to MP3 (historic behaviour)
+PASSTHROUGH = 'passthrough'  # Keep accepted codecs, transcode the rest to MP3
+POLICIES = (MP3, PASSTHROUGH)
+
+DEFAULT_ACCEPTED_CODECS = ('aac', 'opus', 'mp3')
+
+# Target names understood by yt-dlp's FFmpegExtractAudioPP, per source codec;
+# when the target matches the source codec the stream is copied, not re-encoded
+PASSTHROUGH_TARGETS = {
+    'aac': 'm4a',
+    'opus': 'opus',
+    'mp3': 'mp3',
+    'vorbis': 'vorbis',
+    'flac': 'flac',
+    'alac': 'alac',
+}
+
+# Fallback cost of an MP3 encode when no transcode was measured in the batch,
+# per audio second and per source byte (assuming a typical 128 kbit/s source)
+DEFAULT_CPU_PER_AUDIO_SECOND = 0.02
+DEFAULT_CPU_PER_BYTE = DEFAULT_CPU_PER_AUDIO_SECOND * 8 / 128000
+
+
+def normalize_codec(codec):
+    """Map yt-dlp/FFmpeg codec names ('mp4a.40.2', 'opus', ...) to short names"""
+    if not codec or codec == 'none':
+        return None
+    codec = codec.lower()
+    if codec.startswith('mp4a') or codec == 'aac':
+        return 'aac'
+    if codec.startswith('mp3') or codec == 'mp3float':
+        return 'mp3'
+    return codec.split('.')[0]
+
+
+def parse_codecs(value):
+    """Parse a comma-separated codec list ('aac,opus')"""
+    return tuple(c for c in (normalize_codec(part.strip()) for part in value.split(',')) if c)
+
+
+def children_cpu_seconds():
+    """CPU time used by finished child processes (FFmpeg), or None if unavailable"""
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+class OutputPolicy:
+    """Chooses the conversion target per file and accounts for the CPU saved"""
+
+    def __init__(self, mode=MP3, accepted_codecs=DEFAULT_ACCEPTED_CODECS, quality='320'):
+        """
+        :param mode: MP3 or PASSTHROUGH
+        :param accepted_codecs: Codecs kept as-is in PASSTHROUGH mode
+        :param quality: MP3 quality used when transcoding
+        """
+        if mode not in POLICIES:
+            raise ValueError(f"Unknown output policy: {mode} (expected one of {', '.join(POLICIES)})")
+        self.mode = mode
+        self.accepted_codecs = tuple(sorted(set(accepted_codecs)))
+        self.quality = quality
+
+        self._lock = threading.Lock()
+        self._cpu_start = children_cpu_seconds()
+        self.transcoded = 0
+        self.transcode_wall_seconds = 0.0
+        self.kept = 0
+        # Audio processed per outcome, measured as [seconds, bytes]; the
+        # estimate falls back to bytes when some file had no known duration
+        self._transcoded_amount = [0.0, 0]
+        self._kept_amount = [0.0, 0]
+        self._missing_duration = False
+
+    @property
+    def cache_codec(self):
+        """Codec part of the result cache key: differs for every distinct output"""
+        if self.mode == MP3:
+            return MP3
+        return f"keep-{'+'.join(self.accepted_codecs)}"
+
+    def target_for(self, source_codec):
+        """
+        Conversion target for FFmpegExtractAudioPP.
+
+        :param source_codec: Codec of the downloaded audio (any yt-dlp/FFmpeg name)
+        :return: Tuple (target, transcode) where transcode is False if the stream is copied
+        """
+        codec = normalize_codec(source_codec)
+        if self.mode == PASSTHROUGH and codec in self.accepted_codecs and codec in PASSTHROUGH_TARGETS:
+            return PASSTHROUGH_TARGETS[codec], False
+        return MP3, codec != 'mp3'
+
+    def record(self, transcoded, duration, size, wall_seconds=0.0):
+        """
+        Account for one processed file.
+
+        :param transcoded: True if the audio was re-encoded, False if it was copied
+        :param duration: Audio duration in seconds (None if unknown)
+        :param size: Size in bytes of the source file
+        :param wall_seconds: Time the conversion took
+        """
+        with self._lock:
+            if duration is None:
+                self._missing_duration = True
+            amount = self._transcoded_amount if transcoded else self._kept_amount
+            amount[0] += duration or 0
+            amount[1] += size or 0
+            if transcoded:
+                self.transcoded += 1
+                self.transcode_wall_seconds += wall_seconds
+            else:
+                self.kept += 1
+
+    def cpu_seconds_saved(self):
+        """
+        Estimate of the encode CPU time avoided by the copied files: their
+        audio times the cost measured on the files that were transcoded
+        (child CPU time when available, else wall time).
+        """
+        with self._lock:
+            unit = 1 if self._missing_duration else 0
+            transcoded = self._transcoded_amount[unit]
+            kept = self._kept_amount[unit]
+            if not transcoded:
+                # Nothing measured yet: assume a typical MP3 encode cost
+                return kept * (DEFAULT_CPU_PER_BYTE if unit else DEFAULT_CPU_PER_AUDIO_SECOND)
+            cpu_now = children_cpu_seconds()
+            if cpu_now is not None and self._cpu_start is not None and cpu_now > self._cpu_start:
+                spent = cpu_now - self._cpu_start
+            else:
+                spent = self.transcode_wall_seconds
+            return kept * spent / transcoded
+
+    def stats(self):
+        """Summary with the estimated CPU seconds saved by not re-encoding"""
+        saved = self.cpu_seconds_saved()
+        with self._lock:
+            return {
+                'policy': self.mode,
+                'accepted_codecs': list(self.accepted_codecs),
+                'transcoded': self.transcoded,
+                'kept': self.kept,
+                'cpu_seconds_saved': round(saved, 2),
+            }
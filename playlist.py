@@ -0,0 +1,84 @@
+"""
+Lazy expansion of playlists and channels into video URLs: entries are
+enumerated with flat extraction and yielded page by page, so downloads of
+the first videos can start while the rest of the list is still being paged
+"""
+import itertools
+
+# Flat extraction: list the entries without resolving each video
+FLAT_OPTIONS = {
+    'extract_flat': 'in_playlist',
+    'lazy_playlist': True,
+    'quiet': True,
+    'no_warnings': True,
+}
+
+# Extractors whose flat entries are lists themselves (e.g. the Videos and
+# Shorts tabs of a channel) and have to be expanded once more
+NESTED_LIST_EXTRACTORS = ('YoutubeTab', 'YoutubePlaylist')
+
+# Entries fetched per call when the extractor returns a paged list
+PAGE_SIZE = 50
+
+
+def _is_list(entry):
+    return entry.get('_type') in ('playlist', 'multi_video') or (
+        entry.get('_type') == 'url' and entry.get('ie_key') in NESTED_LIST_EXTRACTORS
+    )
+
+
+def _iter_entries(entries):
+    """Iterate the entries of a flat result without materializing them"""
+    if entries is None:
+        return
+    if hasattr(entries, 'getslice'):
+        # yt-dlp PagedList: one page of the remote list at a time
+        for start in itertools.count(0, PAGE_SIZE):
+            page = entries.getslice(start, start + PAGE_SIZE)
+            yield from page
+            if len(page) < PAGE_SIZE:
+                return
+    else:
+        yield from entries
+
+
+def _entry_url(entry):
+    return entry.get('url') or entry.get('webpage_url')
+
+
+def iter_playlist_urls(url, ydl_opts=None, ydl=None, max_depth=2):
+    """
+    Yield the video URLs of a playlist or channel as they are discovered.
+
+    A URL that is a single video yields just that URL. Only the current
+    page of entries is held in memory, whatever the size of the list.
+
+    :param url: Playlist, channel or video URL
+    :param ydl_opts: Extra yt-dlp options merged over FLAT_OPTIONS
+    :param ydl: YoutubeDL instance to reuse (its options should include FLAT_OPTIONS)
+    :param max_depth: How many levels of nested lists (channel tabs) are expanded
+    """
+    if ydl is None:
+        import yt_dlp
+
+        with yt_dlp.YoutubeDL(dict(FLAT_OPTIONS, **(ydl_opts or {}))) as ydl:
+            yield from iter_playlist_urls(url, ydl=ydl, max_depth=max_depth)
+        return
+
+    info = ydl.extract_info(url, download=False, process=False)
+    if not _is_list(info):
+        yield info.get('webpage_url') or url
+        return
+    if info.get('_type') == 'url':
+        # The URL only redirects to the real list
+        yield from iter_playlist_urls(_entry_url(info), ydl=ydl, max_depth=max_depth)
+        return
+
+    for entry in _iter_entries(info.get('entries')):
+        if not entry or not _entry_url(entry):
+            continue
+        if _is_list(entry):
+            if max_depth > 0:
+                yield from iter_playlist_urls(_entry_url(entry), ydl=ydl, max_depth=max_depth - 1)
+            continue
+        yield _entry_url(entry)
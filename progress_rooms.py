@@ -0,0 +1,140 @@
+"""
+Room-scoped, batched progress delivery over Socket.IO
+"""
+import collections
+import threading
+
+# Event carrying {'updates': {download_id: {changed fields}}}
+PROGRESS_EVENT = 'progress_batch'
+
+# Events queued by emit() and not sent yet; the oldest are dropped past this
+MAX_QUEUED_EVENTS = 10000
+
+
+def job_room(download_id):
+    return f"job:{download_id}"
+
+
+def batch_room(batch_id):
+    return f"batch:{batch_id}"
+
+
+class ProgressBroadcaster:
+    """
+    Collects progress updates from the workers and, once per tick, sends a
+    single frame per room containing only the fields that changed since the
+    previous tick. Clients only receive the rooms they subscribed to.
+
+    Everything is sent by the flusher task, so worker threads never emit
+    themselves (required when the server runs on an event loop).
+    """
+
+    def __init__(self, socketio, interval=0.5, namespace='/', autostart=True):
+        """
+        :param socketio: Flask-SocketIO instance used to emit the frames
+        :param interval: Seconds between frames
+        :param namespace: Socket.IO namespace of the frames
+        :param autostart: Start the flusher on the first update; with an
+                          event loop call start() from the loop instead
+        """
+        self.socketio = socketio
+        self.interval = interval
+        self.namespace = namespace
+        self.autostart = autostart
+
+        self._lock = threading.Lock()
+        self._state = {}      # download_id -> last known fields
+        self._dirty = {}      # download_id -> fields changed since the last frame
+        self._rooms = {}      # download_id -> rooms the job is published to
+        self._finished = set()
+        self._events = collections.deque(maxlen=MAX_QUEUED_EVENTS)
+        self._started = False
+
+        self.updates = 0
+        self.frames = 0
+
+    def start(self):
+        """Start the flusher task (idempotent)"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        self.socketio.start_background_task(self._run)
+
+    def _ensure_started(self):
+        if self.autostart:
+            self.start()
+
+    def _run(self):
+        while True:
+            self.socketio.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception as e:
+                # Never let one bad frame stop progress delivery
+                print(f"[ERROR] Progress flush failed: {e}")
+
+    def update(self, download_id, rooms, **fields):
+        """Record new values for a job; only the ones that changed are sent"""
+        with self._lock:
+            self.updates += 1
+            self._rooms[download_id] = tuple(rooms)
+            self._finished.discard(download_id)
+            state = self._state.setdefault(download_id, {})
+            changed = {key: value for key, value in fields.items() if state.get(key) != value}
+            if changed:
+                state.update(changed)
+                self._dirty.setdefault(download_id, {}).update(changed)
+        self._ensure_started()
+
+    def emit(self, event, data, rooms):
+        """Send an event to some rooms with the next frame, after the progress it follows"""
+        with self._lock:
+            self._events.append((event, data, tuple(rooms)))
+        self._ensure_started()
+
+    def finish(self, download_id):
+        """Forget a job once its last changes have been sent"""
+        with self._lock:
+            self._finished.add(download_id)
+
+    def snapshot(self, download_ids):
+        """Current known fields of some jobs (for clients that just subscribed)"""
+        with self._lock:
+            return {
+                download_id: dict(self._state[download_id])
+                for download_id in download_ids if download_id in self._state
+            }
+
+    def flush(self):
+        """Send one frame per room with the changes accumulated since the last call"""
+        with self._lock:
+            dirty, self._dirty = self._dirty, {}
+            frames = {}
+            for download_id, changed in dirty.items():
+                for room in self._rooms.get(download_id, ()):
+                    frames.setdefault(room, {})[download_id] = changed
+            for download_id in self._finished:
+                self._state.pop(download_id, None)
+                self._rooms.pop(download_id, None)
+            self._finished.clear()
+            events = list(self._events)
+            self._events.clear()
+
+        for room, updates in frames.items():
+            self.socketio.emit(PROGRESS_EVENT, {'updates': updates}, to=room, namespace=self.namespace)
+        for event, data, rooms in events:
+            self.socketio.emit(event, data, to=list(rooms), namespace=self.namespace)
+        with self._lock:
+            self.frames += len(frames)
+        return len(frames)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'updates_received': self.updates,
+                'frames_sent': self.frames,
+                'tracked_jobs': len(self._state),
+                'queued_events': len(self._events),
+                'interval': self.interval,
+            }
@@ -0,0 +1,188 @@
+"""
+Content-addressed index of finished audio files with in-flight request coalescing
+
+sqlite3 and concurrent.futures are imported when a cache is first used, so
+importing this module (the CLI does on every start) stays cheap.
+"""
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+from metadata_cache import CACHE_DIR, cache_key_for_url
+
+# Possible outcomes of ResultCache.acquire()
+HIT = 'hit'
+MISS = 'miss'
+COALESCED = 'coalesced'
+
+
+def result_key(url, codec='mp3', quality='320'):
+    """Key of a finished file: canonical video key plus the encode settings"""
+    return f"{cache_key_for_url(url)}|{codec}|{quality}"
+
+
+class ResultCache:
+    """
+    Maps result keys to finished files on disk.
+
+    The index is a SQLite database (WAL mode) written one key at a time, so
+    the CLI and the web server can share CACHE_DIR without overwriting each
+    other's entries.
+
+    Requests for a key that is being produced right now share a single
+    concurrent.futures.Future instead of starting a second pipeline.
+    """
+
+    def __init__(self, db_path, legacy_index_path=None):
+        """
+        :param db_path: SQLite file where the index is persisted
+        :param legacy_index_path: JSON index of older versions, imported once and removed
+        """
+        self.db_path = str(db_path)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._init_schema()
+        if legacy_index_path:
+            self._import_legacy(Path(legacy_index_path))
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            import sqlite3
+            Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self):
+        conn = self._connection()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "key TEXT PRIMARY KEY, filepath TEXT NOT NULL, entry TEXT NOT NULL)"
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_results_filepath ON results (filepath)')
+
+    def _import_legacy(self, path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return
+        conn = self._connection()
+        with conn:
+            conn.execute('BEGIN')
+            for key, entry in index.items():
+                if isinstance(entry, dict) and entry.get('filepath'):
+                    conn.execute(
+                        'INSERT OR IGNORE INTO results (key, filepath, entry) VALUES (?, ?, ?)',
+                        (key, entry['filepath'], json.dumps(entry, ensure_ascii=False))
+                    )
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _lookup(self, key):
+        """Return the index entry for a key if its file still exists"""
+        row = self._connection().execute('SELECT entry FROM results WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        entry = json.loads(row['entry'])
+        if not os.path.exists(entry.get('filepath', '')):
+            self.invalidate(key)
+            return None
+        return entry
+
+    def get(self, key):
+        """Return the entry for a finished file without counting statistics"""
+        with self._lock:
+            return self._lookup(key)
+
+    def acquire(self, key):
+        """
+        Look a key up and register interest in it.
+
+        :return: Tuple (status, value):
+            (HIT, entry) if the file already exists,
+            (COALESCED, future) if another request is producing it,
+            (MISS, future) if the caller must produce it and then call complete() or fail()
+        """
+        import concurrent.futures
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is not None:
+                self.hits += 1
+                return HIT, entry
+
+            future = self._inflight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return COALESCED, future
+
+            self.misses += 1
+            future = concurrent.futures.Future()
+            future.set_running_or_notify_cancel()
+            self._inflight[key] = future
+            return MISS, future
+
+    def complete(self, key, filepath, **metadata):
+        """Record the finished file for a key and wake up every coalesced request"""
+        entry = dict(metadata, filepath=filepath, created_at=time.time())
+        self._connection().execute(
+            'INSERT OR REPLACE INTO results (key, filepath, entry) VALUES (?, ?, ?)',
+            (key, filepath, json.dumps(entry, ensure_ascii=False))
+        )
+        with self._lock:
+            future = self._inflight.pop(key, None)
+        if future is not None:
+            future.set_result(entry)
+        return entry
+
+    def fail(self, key, error):
+        """Propagate a failure to every coalesced request and forget the in-flight job"""
+        with self._lock:
+            future = self._inflight.pop(key, None)
+        if future is not None:
+            future.set_exception(error if isinstance(error, BaseException) else RuntimeError(str(error)))
+
+    def invalidate(self, key):
+        self._connection().execute('DELETE FROM results WHERE key = ?', (key,))
+
+    def invalidate_filepath(self, filepath):
+        """Forget every key whose finished file is filepath (e.g. after it was evicted)"""
+        self._connection().execute('DELETE FROM results WHERE filepath = ?', (filepath,))
+
+    def stats(self):
+        with self._lock:
+            stats = {
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'in_flight': len(self._inflight),
+            }
+        stats['entries'] = self._connection().execute('SELECT COUNT(*) FROM results').fetchone()[0]
+        return stats
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    """Process-wide result cache indexed in CACHE_DIR/results.db"""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = ResultCache(
+                os.path.join(CACHE_DIR, 'results.db'), legacy_index_path=os.path.join(CACHE_DIR, 'results.json')
+            )
+        return _default_cache
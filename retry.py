@@ -0,0 +1,243 @@
+"""
+Retries for failed downloads: error classification, exponential backoff
+with full jitter, a circuit breaker that pauses new starts while upstream
+is failing, and a single-thread scheduler for delayed resubmissions
+"""
+import collections
+import heapq
+import itertools
+import random
+import re
+import socket
+import threading
+import time
+
+from metrics import http_status
+
+RETRYABLE = 'retryable'
+PERMANENT = 'permanent'
+
+# Upstream answers that go away on their own
+RETRYABLE_STATUSES = {403, 408, 425, 429, 500, 502, 503, 504}
+
+# Messages of errors that retrying cannot fix
+PERMANENT_PATTERNS = re.compile(
+    r'video unavailable|private video|has been removed|copyright|not available in your country|'
+    r'members-only|sign in to confirm your age|unsupported url|is not a valid url|'
+    r'requested format is not available|no video formats found',
+    re.IGNORECASE
+)
+# Messages of transient network failures
+RETRYABLE_PATTERNS = re.compile(
+    r'timed out|timeout|connection (?:reset|refused|aborted)|temporary failure|'
+    r'remote end closed|incompleteread|eof occurred|network is unreachable|unable to download (?:webpage|video data)',
+    re.IGNORECASE
+)
+
+# Defaults
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_BASE_DELAY = 2.0
+DEFAULT_MAX_DELAY = 60.0
+
+
+def classify_error(error):
+    """
+    RETRYABLE for transient network and upstream errors (timeouts, HTTP
+    429/5xx...), PERMANENT for anything retrying cannot fix (removed or
+    private videos, HTTP 404, unsupported URLs, local errors).
+    """
+    status = http_status(error)
+    if status is not None:
+        return RETRYABLE if status in RETRYABLE_STATUSES else PERMANENT
+    original = error
+    exc_info = getattr(error, 'exc_info', None)
+    if exc_info and isinstance(exc_info[1], BaseException):
+        original = exc_info[1]
+    message = str(error)
+    if PERMANENT_PATTERNS.search(message):
+        return PERMANENT
+    if isinstance(original, (TimeoutError, ConnectionError, socket.timeout, socket.gaierror)):
+        return RETRYABLE
+    if type(original).__name__ in ('TransportError', 'IncompleteRead', 'ContentTooShortError'):
+        return RETRYABLE
+    return RETRYABLE if RETRYABLE_PATTERNS.search(message) else PERMANENT
+
+
+class RetryPolicy:
+    """How many times and after how long a failed job is retried"""
+
+    def __init__(self, max_attempts=DEFAULT_MAX_ATTEMPTS, base_delay=DEFAULT_BASE_DELAY, max_delay=DEFAULT_MAX_DELAY):
+        """
+        :param max_attempts: Attempts per job, the first one included (1 disables retries)
+        :param base_delay: Upper bound of the first backoff, in seconds
+        :param max_delay: Upper bound of any backoff, in seconds
+        """
+        if max_attempts < 1:
+            raise ValueError("max_attempts must be at least 1")
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def should_retry(self, error, attempt):
+        """Whether a job that failed with error on its attempt-th try goes back to the queue"""
+        return attempt < self.max_attempts and classify_error(error) == RETRYABLE
+
+    def delay(self, attempt):
+        """
+        Backoff before the next attempt: full jitter over an exponentially
+        growing window, so jobs that failed together do not retry together
+        """
+        window = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return random.uniform(0, window)
+
+
+# Circuit states
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    """
+    Stops new job starts while upstream is failing: opens when too many of
+    the recent outcomes were retryable errors, lets a single trial job
+    through after a cooldown, and closes again when that trial succeeds.
+    Only the trial, identified by the token it was admitted with, decides
+    the half-open state: jobs started earlier that finish meanwhile just
+    add their outcome to the window.
+    """
+
+    def __init__(self, window=20, min_calls=5, threshold=0.5, cooldown=30.0, clock=time.monotonic):
+        """
+        :param window: Number of recent outcomes considered
+        :param min_calls: Outcomes needed before the breaker can open
+        :param threshold: Share of failures in the window that opens it
+        :param cooldown: Seconds without new starts once open
+        :param clock: Monotonic clock in seconds (replaceable in tests)
+        """
+        self.threshold = threshold
+        self.min_calls = min_calls
+        self.cooldown = cooldown
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._outcomes = collections.deque(maxlen=window)
+        self._state = CLOSED
+        self._opened_at = 0.0
+        # Token of the half-open trial job (None: no trial running)
+        self._trial = None
+        self.opened = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state
+
+    def admit(self):
+        """
+        Ask to start a new job. When the cooldown is over the first caller is
+        let through as the trial and gets its token.
+
+        :return: Tuple (delay, token): seconds to wait before asking again
+                 (0: start now) and the token to pass to record() (None
+                 unless the job is the half-open trial)
+        """
+        with self._lock:
+            if self._state == CLOSED:
+                return 0.0, None
+            now = self.clock()
+            if self._state == OPEN:
+                remaining = self._opened_at + self.cooldown - now
+                if remaining > 0:
+                    return remaining, None
+                self._state = HALF_OPEN
+                self._trial = None
+            if self._trial is not None:
+                return min(1.0, self.cooldown), None
+            self._trial = object()
+            return 0.0, self._trial
+
+    def wait(self):
+        """
+        Block until a new job may start.
+
+        :return: Token to pass to record() with the job's outcome
+        """
+        while True:
+            delay, token = self.admit()
+            if delay <= 0:
+                return token
+            time.sleep(delay)
+
+    def record(self, error=None, token=None):
+        """
+        Record the outcome of a job; only retryable errors count as upstream failures.
+
+        :param token: Token the job was admitted with (see wait()); only the
+                      half-open trial's outcome closes or reopens the circuit
+        """
+        failed = error is not None and classify_error(error) == RETRYABLE
+        with self._lock:
+            if self._state == HALF_OPEN and token is not None and token is self._trial:
+                self._trial = None
+                self._outcomes.clear()
+                if failed:
+                    self._open()
+                else:
+                    self._state = CLOSED
+                return
+            self._outcomes.append(failed)
+            if self._state == CLOSED and len(self._outcomes) >= self.min_calls:
+                if sum(self._outcomes) / len(self._outcomes) >= self.threshold:
+                    self._open()
+
+    def _open(self):
+        self._state = OPEN
+        self._opened_at = self.clock()
+        self._trial = None
+        self.opened += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'state': self._state,
+                'opened': self.opened,
+                'recent_failures': sum(self._outcomes),
+                'recent_outcomes': len(self._outcomes),
+            }
+
+
+class RetryScheduler:
+    """Runs callbacks after a delay on one background thread (no thread per retry)"""
+
+    def __init__(self, name='retry-scheduler'):
+        self.name = name
+        self._condition = threading.Condition()
+        self._heap = []
+        self._counter = itertools.count()
+        self._thread = None
+
+    def schedule(self, delay, callback, *args):
+        """Run callback(*args) in about delay seconds"""
+        with self._condition:
+            heapq.heappush(self._heap, (time.monotonic() + delay, next(self._counter), callback, args))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def pending(self):
+        with self._condition:
+            return len(self._heap)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._heap or self._heap[0][0] > time.monotonic():
+                    timeout = self._heap[0][0] - time.monotonic() if self._heap else None
+                    self._condition.wait(timeout)
+                _, _, callback, args = heapq.heappop(self._heap)
+            try:
+                callback(*args)
+            except Exception as e:
+                # A failing callback must not stop the other retries
+                print(f"[ERROR] Scheduled retry failed: {e}")
@@ -1,6 +1,10 @@
 // Global state
 let socket = null;
 let activeDownloads = new Map();
+let subscribedBatches = new Set();
+
+// Statuses that no progress frame can change anymore
+const FINAL_STATUSES = ['completed', 'failed', 'expired'];
 
 // Initialize on page load
 document.addEventListener('DOMContentLoaded', () => {
@@ -31,6 +35,8 @@ function initializeWebSocket() {
     socket.on('connect', () => {
         console.log('WebSocket connected');
         updateConnectionStatus(true);
+        // Rooms are per connection: join them again after a reconnect
+        resubscribe();
     });
 
     socket.on('disconnect', () => {
@@ -42,8 +48,11 @@ function initializeWebSocket() {
         console.log('Server message:', data.message);
     });
 
-    socket.on('download_progress', (data) => {
-        updateDownloadProgress(data);
+    // One frame per tick with only the fields that changed, for our jobs only
+    socket.on('progress_batch', (frame) => {
+        Object.entries(frame.updates || {}).forEach(([downloadId, changes]) => {
+            applyProgressUpdate(downloadId, changes);
+        });
     });
 
     socket.on('download_complete', (data) => {
@@ -53,6 +62,26 @@ function initializeWebSocket() {
     socket.on('download_error', (data) => {
         markDownloadFailed(data);
     });
+
+    socket.on('download_expired', (data) => {
+        markDownloadExpired(data);
+    });
+}
+
+// Subscribe to the progress of some downloads and/or batches
+function subscribe({ downloadIds = [], batchIds = [] }) {
+    batchIds.forEach(batchId => subscribedBatches.add(batchId));
+    if (socket && socket.connected && (downloadIds.length || batchIds.length)) {
+        socket.emit('subscribe', { download_ids: downloadIds, batch_ids: batchIds });
+    }
+}
+
+// Join again the rooms of every unfinished download and known batch
+function resubscribe() {
+    const downloadIds = [...activeDownloads.values()]
+        .filter(download => !FINAL_STATUSES.includes(download.status))
+        .map(download => download.id);
+    subscribe({ downloadIds, batchIds: [...subscribedBatches] });
 }
 
 // Update connection status indicator
@@ -129,9 +158,12 @@ async function startSingleDownload(url) {
             addDownloadToUI({
                 id: data.download_id,
                 url: url,
-                status: 'pending',
-                title: 'Cargando...'
+                status: data.status || 'queued',
+                title: data.title || 'Cargando...'
             });
+            if (!FINAL_STATUSES.includes(data.status)) {
+                subscribe({ downloadIds: [data.download_id] });
+            }
         } else {
             alert(`Error: ${data.error}`);
         }
@@ -155,8 +187,10 @@ async function uploadCSV(file) {
         const data = await response.json();
         
         if (response.ok) {
-            alert(`Se iniciaron ${data.count} descargas`);
-            // Load downloads will be updated via WebSocket
+            alert(`Se pusieron en cola ${data.count} descargas`);
+            subscribe({ batchIds: [data.batch_id] });
+            addBatchZipLink(data.batch_id, data.count);
+            await loadExistingDownloads();
         } else {
             alert(`Error: ${data.error}`);
         }
@@ -180,7 +214,10 @@ async function startBatchDownload(urls) {
         const data = await response.json();
         
         if (response.ok) {
-            alert(`Se iniciaron ${data.count} descargas`);
+            alert(`Se pusieron en cola ${data.count} descargas`);
+            subscribe({ batchIds: [data.batch_id] });
+            addBatchZipLink(data.batch_id, data.count);
+            await loadExistingDownloads();
         } else {
             alert(`Error: ${data.error}`);
         }
@@ -190,16 +227,29 @@ async function startBatchDownload(urls) {
     }
 }
 
-// Load existing downloads from server
+// Link to the ZIP of every completed file of a batch
+function addBatchZipLink(batchId, count) {
+    const container = document.getElementById('batch-archives');
+    const link = document.createElement('a');
+    link.href = `/api/batch/${batchId}/zip`;
+    link.className = 'btn-download';
+    link.textContent = `📦 Descargar lote en ZIP (${count})`;
+    link.setAttribute('download', '');
+    container.appendChild(link);
+}
+
+// Load the most recent downloads from server (first page, newest first)
 async function loadExistingDownloads() {
     try {
-        const response = await fetch('/api/downloads');
+        const response = await fetch('/api/downloads?limit=50');
         const data = await response.json();
         
         if (data.downloads && data.downloads.length > 0) {
-            data.downloads.forEach(download => {
+            // Show them oldest first, like new downloads appended later
+            data.downloads.slice().reverse().forEach(download => {
                 addDownloadToUI(download);
             });
+            resubscribe();
         }
     } catch (error) {
         console.error('Error loading downloads:', error);
@@ -276,13 +326,35 @@ function createDownloadHTML(download) {
 function getStatusText(status) {
     const statusMap = {
         'pending': '⏳ Pendiente',
+        'queued': '⏳ En cola',
+        'retry_scheduled': '🔁 Reintento programado',
         'downloading': '⬇️ Descargando',
+        'transcode_queued': '⏳ Esperando conversión',
+        'transcoding': '🔄 Convirtiendo',
         'completed': '✅ Completado',
-        'failed': '❌ Error'
+        'failed': '❌ Error',
+        'expired': '⌛ Expirado'
     };
     return statusMap[status] || status;
 }
 
+// Merge a progress frame entry into a download and refresh its item
+function applyProgressUpdate(downloadId, changes) {
+    const download = activeDownloads.get(downloadId);
+    if (!download) return;
+    // A late frame must not move a finished download back
+    if (FINAL_STATUSES.includes(download.status)) return;
+
+    Object.assign(download, changes);
+    if (download.status === 'completed') {
+        markDownloadComplete({ download_id: downloadId, title: download.title, filename: download.filename });
+    } else if (download.status === 'failed') {
+        markDownloadFailed({ download_id: downloadId, error: download.error || 'Error' });
+    } else {
+        updateDownloadProgress({ download_id: downloadId, ...download });
+    }
+}
+
 // Update download progress
 function updateDownloadProgress(data) {
     const download = activeDownloads.get(data.download_id);
@@ -293,7 +365,10 @@ function updateDownloadProgress(data) {
     const element = document.getElementById(`download-${data.download_id}`);
     if (!element) return;
 
-    // Update status badge
+    // Update title and status badge
+    if (data.title) {
+        element.querySelector('.download-title').textContent = data.title;
+    }
     const statusBadge = element.querySelector('.download-status');
     statusBadge.textContent = getStatusText(data.status);
     statusBadge.className = `download-status status-${data.status}`;
@@ -334,7 +409,7 @@ function markDownloadComplete(data) {
     if (!download) return;
 
     download.status = 'completed';
-    download.title = data.title;
+    download.title = data.title || download.title;
     download.filename = data.filename;
     download.id = data.download_id; // Ensure id is set
 
@@ -358,8 +433,22 @@ function markDownloadFailed(data) {
         statusBadge.textContent = getStatusText('failed');
         statusBadge.className = 'download-status status-failed';
 
-        // Add error message
+        // Add error message (once, the error can arrive by event and by frame)
+        if (element.querySelector('.download-error')) return;
         const errorHTML = `<div class="download-error" style="color: #ef4444; margin-top: 10px;">Error: ${data.error}</div>`;
         element.querySelector('.download-url').insertAdjacentHTML('afterend', errorHTML);
     }
 }
+
+// Mark a completed download whose file was evicted from the server
+function markDownloadExpired(data) {
+    const download = activeDownloads.get(data.download_id);
+    if (!download) return;
+
+    download.status = 'expired';
+
+    const element = document.getElementById(`download-${data.download_id}`);
+    if (element) {
+        element.innerHTML = createDownloadHTML(download);
+    }
+}
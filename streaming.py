@@ -0,0 +1,199 @@
+"""
+Streaming transcode: pipe a source audio stream through FFmpeg and send the
+MP3 bytes to the HTTP client while the same bytes are written to disk
+"""
+import os
+import queue
+import subprocess
+import threading
+
+CHUNK_SIZE = 64 * 1024
+# Chunks buffered for a slow client before the encoder waits for it
+CLIENT_BUFFER_CHUNKS = 64
+
+_EOF = object()
+
+
+class StreamingError(Exception):
+    """Raised when a stream cannot be started or finishes with an error"""
+
+
+def select_stream_format(info):
+    """
+    Pick the best format that can be read as a plain HTTP byte stream.
+
+    Audio-only formats are preferred; otherwise the smallest-bitrate format
+    with audio is used (FFmpeg drops the video track).
+
+    :param info: Info dict returned by yt-dlp
+    :return: Format dict
+    :raises StreamingError: If no format can be streamed
+    """
+    formats = info.get('formats') or [info]
+    candidates = [
+        f for f in formats
+        if f.get('url') and f.get('protocol', 'https') in ('http', 'https') and f.get('acodec') != 'none'
+    ]
+    if not candidates:
+        raise StreamingError('No format can be streamed over plain HTTP')
+
+    audio_only = [f for f in candidates if f.get('vcodec') == 'none']
+    if audio_only:
+        return max(audio_only, key=lambda f: (f.get('abr') or f.get('tbr') or 0))
+    return min(candidates, key=lambda f: (f.get('tbr') or float('inf')))
+
+
+class StreamingTranscode:
+    """
+    Runs the source -> FFmpeg -> (client, file) pipeline on two threads.
+
+    The output file is written as '<path>.part' and renamed when FFmpeg
+    exits cleanly. A client that disconnects does not stop the pipeline,
+    so the file on disk is always complete.
+    """
+
+    def __init__(self, ffmpeg_path, source, output_path, bitrate='320k', on_done=None, throttle=None):
+        """
+        :param ffmpeg_path: Path of the ffmpeg executable
+        :param source: File-like object with a read(n) method returning the source bytes
+        :param output_path: Final path of the MP3 file
+        :param bitrate: MP3 bitrate passed to FFmpeg
+        :param on_done: Callback(output_path, error) run when the pipeline finishes
+        :param throttle: Callable(nbytes) run after every source read, may sleep to limit bandwidth
+        """
+        self.ffmpeg_path = ffmpeg_path
+        self.source = source
+        self.output_path = output_path
+        self.part_path = f"{output_path}.part"
+        self.bitrate = bitrate
+        self.on_done = on_done
+        self.throttle = throttle
+
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.error = None
+
+        self._process = None
+        self._chunks = queue.Queue(maxsize=CLIENT_BUFFER_CHUNKS)
+        self._client_gone = threading.Event()
+        self._done = threading.Event()
+
+    def start(self):
+        """Start FFmpeg and the feeder/pump threads"""
+        os.makedirs(os.path.dirname(self.output_path) or '.', exist_ok=True)
+        self._process = subprocess.Popen(
+            [
+                self.ffmpeg_path, '-hide_banner', '-loglevel', 'error',
+                '-i', 'pipe:0', '-vn',
+                '-c:a', 'libmp3lame', '-b:a', self.bitrate,
+                '-f', 'mp3', 'pipe:1',
+            ],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        threading.Thread(target=self._feed, name='stream-feeder', daemon=True).start()
+        threading.Thread(target=self._pump, name='stream-pump', daemon=True).start()
+        return self
+
+    def _feed(self):
+        """Copy the source bytes into FFmpeg's stdin"""
+        try:
+            while True:
+                chunk = self.source.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                self.bytes_in += len(chunk)
+                if self.throttle:
+                    self.throttle(len(chunk))
+                self._process.stdin.write(chunk)
+        except (BrokenPipeError, ValueError):
+            # FFmpeg exited early; the pump reports its error
+            pass
+        except Exception as e:
+            self.error = StreamingError(f"Source read failed: {e}")
+            self._process.kill()
+        finally:
+            try:
+                self._process.stdin.close()
+            except OSError:
+                pass
+            close = getattr(self.source, 'close', None)
+            if close:
+                close()
+
+    def _offer(self, item):
+        """Hand a chunk to the client unless it disconnected"""
+        while not self._client_gone.is_set():
+            try:
+                self._chunks.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def _pump(self):
+        """Copy FFmpeg's stdout to the .part file and to the client"""
+        try:
+            with open(self.part_path, 'wb') as f:
+                while True:
+                    chunk = self._process.stdout.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+                    self.bytes_out += len(chunk)
+                    self._offer(chunk)
+
+            return_code = self._process.wait()
+            if self.error is None and return_code != 0:
+                stderr = self._process.stderr.read().decode('utf-8', 'replace').strip()
+                self.error = StreamingError(f"FFmpeg exited with code {return_code}: {stderr}")
+            if self.error is None:
+                os.replace(self.part_path, self.output_path)
+        except Exception as e:
+            self.error = self.error or e
+        finally:
+            if self.error is not None:
+                try:
+                    os.remove(self.part_path)
+                except OSError:
+                    pass
+            self._done.set()
+            self._offer(_EOF)
+            if self.on_done:
+                self.on_done(self.output_path if self.error is None else None, self.error)
+
+    def iter_chunks(self, sleep=None, poll_interval=0.05):
+        """
+        Generator of MP3 chunks for the HTTP response.
+
+        :param sleep: Cooperative sleep of an event loop; the buffer is then
+                      polled instead of blocking the loop (or a thread) on it
+        :param poll_interval: Seconds between polls of an empty buffer
+        """
+        try:
+            while True:
+                if sleep is None:
+                    chunk = self._chunks.get()
+                else:
+                    try:
+                        chunk = self._chunks.get_nowait()
+                    except queue.Empty:
+                        sleep(poll_interval)
+                        continue
+                if chunk is _EOF:
+                    break
+                yield chunk
+        finally:
+            # Client finished or disconnected: the pump keeps writing the file
+            self._client_gone.set()
+
+    def detach(self):
+        """Stop feeding the client; the file keeps being written"""
+        self._client_gone.set()
+
+    def wait(self, timeout=None):
+        """Wait for the pipeline to finish; return the output path or raise its error"""
+        self._done.wait(timeout)
+        if self.error is not None:
+            raise self.error
+        return self.output_path
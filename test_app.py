@@ -51,7 +51,9 @@ def test_routes():
             '/api/downloads',
             '/api/download/<download_id>',
             '/api/download/<download_id>/file',
-            '/api/health'
+            '/api/health',
+            '/api/cache/stats',
+            '/api/stream'
         ]
         
         registered_routes = [rule.rule for rule in app.url_map.iter_rules()]
@@ -122,6 +124,1427 @@ def test_health_endpoint():
         print(f"  ✗ Error testing health endpoint: {e}")
         return False
 
+def test_job_queue():
+    """Test that the worker pool runs jobs and rejects them when full"""
+    print("\nTesting job queue...")
+    try:
+        import threading
+        from job_queue import JobQueue, QueueFullError
+        
+        release = threading.Event()
+        done = []
+        
+        def handler(job_id):
+            release.wait(timeout=5)
+            done.append(job_id)
+        
+        job_queue = JobQueue(handler, num_workers=1, max_size=2)
+        job_queue.submit('a')
+        
+        # Wait until the single worker picked up the first job
+        for _ in range(100):
+            if job_queue.active() == 1:
+                break
+            threading.Event().wait(0.01)
+        
+        job_queue.submit_many([('b',), ('c',)])
+        try:
+            job_queue.submit('d')
+            print("  ✗ Full queue accepted a job")
+            return False
+        except QueueFullError:
+            print("  ✓ Full queue rejects new jobs")
+        
+        release.set()
+        job_queue.stop()
+        
+        if done == ['a', 'b', 'c']:
+            print(f"  ✓ Jobs processed in order: {done}")
+            return True
+        print(f"  ✗ Unexpected processed jobs: {done}")
+        return False
+    except Exception as e:
+        print(f"  ✗ Error testing job queue: {e}")
+        return False
+
+def test_metadata_cache():
+    """Test the on-disk metadata cache keys, TTL and size cap"""
+    print("\nTesting metadata cache...")
+    try:
+        import tempfile
+        from metadata_cache import MetadataCache, video_key_from_url
+        
+        key = video_key_from_url('https://youtu.be/dQw4w9WgXcQ')
+        if key != 'Youtube:dQw4w9WgXcQ':
+            print(f"  ✗ Unexpected video key: {key}")
+            return False
+        print(f"  ✓ Video key resolved offline: {key}")
+        
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = MetadataCache(cache_dir, ttl=60, max_entries=2)
+            for i in range(3):
+                cache.set({'id': str(i), 'title': f'Video {i}'}, f'Test:{i}')
+            
+            if cache.get('Test:2') != {'id': '2', 'title': 'Video 2'}:
+                print("  ✗ Cached entry not returned")
+                return False
+            print("  ✓ Cached entry returned")
+            
+            if len(list(cache.cache_dir.glob('*.json'))) > 2:
+                print("  ✗ Size cap not enforced")
+                return False
+            print("  ✓ Size cap enforced")
+            
+            cache.ttl = -1
+            if cache.get('Test:2') is not None:
+                print("  ✗ Disabled cache returned an entry")
+                return False
+            print("  ✓ Expired/disabled entries ignored")
+        
+        return True
+    except Exception as e:
+        print(f"  ✗ Error testing metadata cache: {e}")
+        return False
+
+def test_result_cache():
+    """Test result cache hits and in-flight coalescing"""
+    print("\nTesting result cache...")
+    try:
+        import json
+        import tempfile
+        from result_cache import ResultCache, HIT, MISS, COALESCED
+        
+        with tempfile.TemporaryDirectory() as cache_dir:
+            mp3_path = os.path.join(cache_dir, 'song.mp3')
+            with open(mp3_path, 'wb') as f:
+                f.write(b'ID3')
+            
+            db_path = os.path.join(cache_dir, 'results.db')
+            cache = ResultCache(db_path)
+            status, leader = cache.acquire('Youtube:abc|mp3|320')
+            coalesced_status, follower = cache.acquire('Youtube:abc|mp3|320')
+            if (status, coalesced_status) != (MISS, COALESCED) or leader is not follower:
+                print(f"  ✗ Identical request not coalesced: {status}, {coalesced_status}")
+                return False
+            print("  ✓ Identical in-flight request coalesced")
+            
+            cache.complete('Youtube:abc|mp3|320', mp3_path, title='Song')
+            if follower.result(timeout=1)['filepath'] != mp3_path:
+                print("  ✗ Coalesced request did not receive the result")
+                return False
+            print("  ✓ Coalesced request received the result")
+            
+            # A new instance reads the persisted index
+            other = ResultCache(db_path)
+            status, entry = other.acquire('Youtube:abc|mp3|320')
+            if status != HIT or entry['title'] != 'Song':
+                print(f"  ✗ Expected a cache hit, got: {status}")
+                return False
+            print("  ✓ Finished file served from the persisted index")
+            
+            # Two processes sharing CACHE_DIR keep each other's entries
+            other_path = os.path.join(cache_dir, 'other.mp3')
+            with open(other_path, 'wb') as f:
+                f.write(b'ID3')
+            other.acquire('Youtube:def|mp3|320')
+            other.complete('Youtube:def|mp3|320', other_path, title='Other')
+            cache.acquire('Youtube:ghi|mp3|320')
+            cache.complete('Youtube:ghi|mp3|320', other_path, title='Other')
+            if cache.stats()['entries'] != 3:
+                print(f"  ✗ Entries of another instance lost: {cache.stats()}")
+                return False
+            print("  ✓ Entries written by another instance are kept")
+            
+            cache.invalidate_filepath(other_path)
+            if other.get('Youtube:def|mp3|320') is not None or cache.stats()['entries'] != 1:
+                print("  ✗ Evicted file still indexed")
+                return False
+            print("  ✓ Evicted file dropped from the index")
+            
+            # Index of older versions imported once
+            legacy_path = os.path.join(cache_dir, 'results.json')
+            with open(legacy_path, 'w', encoding='utf-8') as f:
+                json.dump({'Youtube:old|mp3|320': {'filepath': mp3_path, 'title': 'Old'}}, f)
+            migrated = ResultCache(os.path.join(cache_dir, 'migrated.db'), legacy_index_path=legacy_path)
+            if migrated.get('Youtube:old|mp3|320') is None or os.path.exists(legacy_path):
+                print("  ✗ Legacy index not imported")
+                return False
+            print("  ✓ Legacy JSON index imported")
+            print(f"  ✓ Stats: {cache.stats()}")
+        
+        return True
+    except Exception as e:
+        print(f"  ✗ Error testing result cache: {e}")
+        return False
+
+def test_job_store():
+    """Test the SQLite job store persistence, filters and cursor pagination"""
+    print("\nTesting job store...")
+    try:
+        import tempfile
+        from job_store import JobStore
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_path = os.path.join(tmp_dir, 'jobs.db')
+            store = JobStore(db_path)
+            store.create_many([{
+                'id': f'job-{i}',
+                'url': f'https://example.com/{i}',
+                'status': 'completed' if i % 2 else 'queued',
+                'created_at': f'2025-01-01T00:00:{i:02d}',
+                'cached': True
+            } for i in range(5)])
+            store.update('job-0', status='failed', error='boom')
+            
+            # Reopen the database as after a restart
+            store = JobStore(db_path)
+            seen = []
+            cursor = None
+            while True:
+                page, cursor = store.list(limit=2, cursor=cursor)
+                seen.extend(job['id'] for job in page)
+                if cursor is None:
+                    break
+            if seen != ['job-4', 'job-3', 'job-2', 'job-1', 'job-0']:
+                print(f"  ✗ Unexpected pagination order: {seen}")
+                return False
+            print("  ✓ Cursor pagination returns every job, newest first")
+            
+            completed, _ = store.list(['completed'])
+            if [job['id'] for job in completed] != ['job-3', 'job-1']:
+                print("  ✗ Status filter not applied")
+                return False
+            print("  ✓ Status filter applied")
+            
+            job = store.get('job-0')
+            if job['status'] != 'failed' or job['error'] != 'boom' or job['cached'] is not True:
+                print(f"  ✗ Unexpected record after restart: {job}")
+                return False
+            print("  ✓ Records survive a restart")
+        
+        return True
+    except Exception as e:
+        print(f"  ✗ Error testing job store: {e}")
+        return False
+
+def test_stream_format_selection():
+    """Test that streaming picks the best plain-HTTP audio format"""
+    print("\nTesting stream format selection...")
+    try:
+        from streaming import select_stream_format, StreamingError
+        
+        info = {'formats': [
+            {'format_id': 'hls', 'url': 'https://x/a.m3u8', 'protocol': 'm3u8_native', 'acodec': 'opus', 'vcodec': 'none', 'abr': 256},
+            {'format_id': 'low', 'url': 'https://x/low', 'protocol': 'https', 'acodec': 'opus', 'vcodec': 'none', 'abr': 64},
+            {'format_id': 'high', 'url': 'https://x/high', 'protocol': 'https', 'acodec': 'mp4a.40.2', 'vcodec': 'none', 'abr': 128},
+            {'format_id': 'video', 'url': 'https://x/video', 'protocol': 'https', 'acodec': 'none', 'vcodec': 'avc1'},
+        ]}
+        selected = select_stream_format(info)['format_id']
+        if selected != 'high':
+            print(f"  ✗ Unexpected format selected: {selected}")
+            return False
+        print(f"  ✓ Best HTTP audio-only format selected: {selected}")
+        
+        try:
+            select_stream_format({'formats': [info['formats'][0]]})
+            print("  ✗ HLS-only video accepted for streaming")
+            return False
+        except StreamingError:
+            print("  ✓ Non-streamable formats rejected")
+        
+        return True
+    except Exception as e:
+        print(f"  ✗ Error testing stream format selection: {e}")
+        return False
+
+def test_output_policy():
+    """Test that the output policy only re-encodes when it has to"""
+    print("\nTesting output policy...")
+    try:
+        from output_policy import OutputPolicy, MP3, PASSTHROUGH, parse_codecs
+        
+        always = OutputPolicy(MP3)
+        if always.target_for('opus') != ('mp3', True) or always.target_for('mp3') != ('mp3', False):
+            print("  ✗ MP3 policy does not always produce MP3")
+            return False
+        print("  ✓ MP3 policy transcodes everything except MP3 sources")
+        
+        keep = OutputPolicy(PASSTHROUGH, parse_codecs('aac, opus'))
+        if keep.target_for('mp4a.40.2') != ('m4a', False) or keep.target_for('opus') != ('opus', False):
+            print("  ✗ Accepted codecs are not kept")
+            return False
+        if keep.target_for('vorbis') != ('mp3', True):
+            print("  ✗ Codec outside the accepted list is not transcoded")
+            return False
+        print("  ✓ Passthrough keeps accepted codecs and transcodes the rest")
+        
+        if always.cache_codec == keep.cache_codec:
+            print("  ✗ Policies share result cache keys")
+            return False
+        print("  ✓ Each policy has its own result cache key")
+        
+        keep.record(True, 100, 1000000, wall_seconds=2.0)
+        keep.record(False, 300, 3000000)
+        stats = keep.stats()
+        if stats['transcoded'] != 1 or stats['kept'] != 1 or stats['cpu_seconds_saved'] <= 0:
+            print(f"  ✗ Unexpected stats: {stats}")
+            return False
+        print(f"  ✓ CPU seconds saved reported: {stats['cpu_seconds_saved']}")
+        
+        return True
+    except Exception as e:
+        print(f"  ✗ Error testing output policy: {e}")
+        return False
+
+def test_checkpoint_journal():
+    """Test that the CLI checkpoint journal survives a restart"""
+    print("\nTesting checkpoint journal...")
+    try:
+        import tempfile
+        from checkpoint import CheckpointJournal, COMPLETED, FAILED, DOWNLOADING
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            done_file = os.path.join(tmp, 'done.mp3')
+            open(done_file, 'wb').close()
+            
+            journal = CheckpointJournal.for_output_dir(tmp)
+            journal.record('https://a', COMPLETED, filepath=done_file)
+            journal.record('https://b', FAILED)
+            journal.record('https://c', DOWNLOADING)
+            journal.record('https://d', COMPLETED, filepath=os.path.join(tmp, 'deleted.mp3'))
+            journal.close()
+            # Simulate a crash in the middle of a write
+            with open(journal.path, 'a', encoding='utf-8') as f:
+                f.write('{"url": "https://e", "sta')
+            
+            resumed = CheckpointJournal.for_output_dir(tmp, resume=True)
+            done = [url for url in ('https://a', 'https://b', 'https://c', 'https://d', 'https://e') if resumed.is_done(url)]
+            resumed.close()
+            if done != ['https://a']:
+                print(f"  ✗ Unexpected finished URLs after resume: {done}")
+                return False
+            print("  ✓ Only completed URLs with their file on disk are skipped")
+            
+            big = CheckpointJournal(os.path.join(tmp, 'big.jsonl'))
+            for i in range(1000):
+                url = f'https://v/{i}'
+                big.record(url, DOWNLOADING)
+                big.record(url, COMPLETED if i % 2 else FAILED, filepath=done_file)
+            big.record('https://v/last', DOWNLOADING)
+            big.close()
+            if big.counts() != {COMPLETED: 500, FAILED: 500, DOWNLOADING: 1} or len(big._active) != 1:
+                print(f"  ✗ The journal should only keep the URLs in progress: {big.counts()}")
+                return False
+            print("  ✓ Finished URLs go to the file only, memory stays bounded")
+            
+            fresh = CheckpointJournal.for_output_dir(tmp)
+            fresh.close()
+            if fresh.is_done('https://a'):
+                print("  ✗ A new run kept the previous journal")
+                return False
+            print("  ✓ Runs without resume start a new journal")
+        
+        return True
+    except Exception as e:
+        print(f"  ✗ Error testing checkpoint journal: {e}")
+        return False
+
+def test_two_stage_pipeline():
+    """Test that downloads and transcodes run as separately bounded stages"""
+    print("\nTesting two-stage pipeline...")
+    try:
+        import asyncio
+        import threading
+        import time
+        import descargar_audio
+        from checkpoint import DOWNLOADING, TRANSCODING, COMPLETED
+        
+        max_concurrent, max_transcodes = 3, 2
+        lock = threading.Lock()
+        running = {'download': 0, 'transcode': 0}
+        peak = {'download': 0, 'transcode': 0}
+        counters = {'downloads_started': 0, 'transcodes_started': 0, 'max_ahead': 0}
+        
+        def enter(stage):
+            with lock:
+                running[stage] += 1
+                peak[stage] = max(peak[stage], running[stage])
+        
+        def leave(stage):
+            with lock:
+                running[stage] -= 1
+        
+        def fake_download(url, output_dir, url_id, show_animation=True):
+            # Downloaded but not converted yet: bounded by the transcode queue plus the blocked downloads
+            with lock:
+                counters['downloads_started'] += 1
+                ahead = counters['downloads_started'] - counters['transcodes_started']
+                counters['max_ahead'] = max(counters['max_ahead'], ahead)
+            enter('download')
+            time.sleep(0.005)
+            leave('download')
+            return {'fuente': url, 'url': url, 'url_id': url_id}
+        
+        def fake_transcode(pending, ffmpeg_location=None):
+            with lock:
+                counters['transcodes_started'] += 1
+            enter('transcode')
+            time.sleep(0.02)
+            leave('transcode')
+            return f"{pending['url']}.mp3"
+        
+        class Journal:
+            def __init__(self):
+                self.states = {}
+            def record(self, url, state, **fields):
+                with lock:
+                    self.states.setdefault(url, []).append(state)
+        
+        journal = Journal()
+        urls = [f'https://example.com/{i}' for i in range(20)]
+        originals = descargar_audio.etapa_descarga, descargar_audio.etapa_transcodificacion
+        descargar_audio.etapa_descarga, descargar_audio.etapa_transcodificacion = fake_download, fake_transcode
+        try:
+            ok, failed = asyncio.run(descargar_audio.procesar_urls_async(
+                iter(urls), '.', max_concurrent=max_concurrent, max_transcodes=max_transcodes, diario=journal
+            ))
+        finally:
+            descargar_audio.etapa_descarga, descargar_audio.etapa_transcodificacion = originals
+        
+        if (ok, failed) != (20, 0) or any(journal.states.get(url) != [DOWNLOADING, TRANSCODING, COMPLETED] for url in urls):
+            print(f"  ✗ Unexpected results or states: {(ok, failed)} {journal.states.get(urls[0])}")
+            return False
+        print("  ✓ Every URL goes downloading -> transcode queued -> completed")
+        
+        if peak['download'] > max_concurrent or peak['transcode'] > max_transcodes:
+            print(f"  ✗ Stage limits exceeded: {peak}")
+            return False
+        # Queued for transcoding, held by blocked downloads, or taken by a converter not started yet
+        bound = max_transcodes + max_concurrent + max_transcodes
+        if counters['max_ahead'] > bound:
+            print(f"  ✗ Downloads ran {counters['max_ahead']} files ahead of the transcodes")
+            return False
+        print(f"  ✓ Separate limits ({peak['download']}/{max_concurrent} downloads, "
+              f"{peak['transcode']}/{max_transcodes} transcodes) and a bounded queue between them")
+        
+        return True
+    except Exception as e:
+        print(f"  ✗ Error testing two-stage pipeline: {e}")
+        return False
+
+def test_csv_streaming():
+    """Test that CSV URLs are read lazily, row by row"""
+    print("\nTesting streaming CSV reader...")
+    try:
+        import tempfile
+        import types
+        from descargar_audio import iterar_urls_csv, leer_urls_csv
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            csv_path = os.path.join(tmp, 'urls.csv')
+            with open(csv_path, 'w', encoding='utf-8') as f:
+                f.write('URL\n\nhttps://a\nnot-a-url\nhttps://b,extra\n')
+            
+            urls = iterar_urls_csv(csv_path)
+            if not isinstance(urls, types.GeneratorType):
+                print("  ✗ iterar_urls_csv is not a generator")
+                return False
+            if next(urls) != 'https://a':
+                print("  ✗ First URL not yielded first")
+                return False
+            if list(urls) != ['https://b']:
+                print("  ✗ Header, blank or invalid rows not skipped")
+                return False
+            print("  ✓ URLs yielded lazily, skipping header, blank and invalid rows")
+            
+            if leer_urls_csv(csv_path) != ['https://a', 'https://b']:
+                print("  ✗ leer_urls_csv returned unexpected URLs")
+                return False
+            print("  ✓ leer_urls_csv still returns the full list")
+        
+        return True
+    except Exception as e:
+        print(f"  ✗ Error testing streaming CSV reader: {e}")
+        return False
+
+def test_progress_broadcaster():
+    """Test that progress is batched per room and only carries changed fields"""
+    print("\nTesting progress broadcaster...")
+    try:
+        from progress_rooms import ProgressBroadcaster, PROGRESS_EVENT, job_room, batch_room
+        
+        class FakeSocketIO:
+            def __init__(self):
+                self.sent = []
+            def emit(self, event, data, to=None, namespace=None):
+                self.sent.append((event, to, data))
+            def start_background_task(self, target):
+                pass  # Frames are flushed by hand below
+        
+        socket = FakeSocketIO()
+        progress = ProgressBroadcaster(socket)
+        rooms_a = [job_room('a'), batch_room('b1')]
+        for percent in ('10%', '20%', '30%'):
+            progress.update('a', rooms_a, status='downloading', percent=percent)
+        progress.update('c', [job_room('c')], status='downloading', percent='5%')
+        progress.flush()
+        
+        frames = {to: data['updates'] for event, to, data in socket.sent if event == PROGRESS_EVENT}
+        if len(socket.sent) != 3 or frames[batch_room('b1')] != {'a': {'status': 'downloading', 'percent': '30%'}}:
+            print(f"  ✗ Unexpected frames: {socket.sent}")
+            return False
+        print("  ✓ Several updates coalesced into one frame per room")
+        
+        socket.sent.clear()
+        progress.update('a', rooms_a, status='downloading', percent='40%')
+        progress.update('c', [job_room('c')], status='downloading', percent='5%')
+        progress.flush()
+        if [(to, data['updates']) for _, to, data in socket.sent] != [
+            (job_room('a'), {'a': {'percent': '40%'}}),
+            (batch_room('b1'), {'a': {'percent': '40%'}}),
+        ]:
+            print(f"  ✗ Frames carry unchanged fields: {socket.sent}")
+            return False
+        print("  ✓ Only changed fields are sent, rooms without changes get nothing")
+        
+        return True
+    except Exception as e:
+        print(f"  ✗ Error testing progress broadcaster: {e}")
+        return False
+
+def test_progress_renderer():
+    """Test the single console renderer used by the CLI"""
+    print("\nTesting console progress renderer...")
+    try:
+        import io
+        from descargar_audio import ProgressRenderer
+        
+        class FakeTTY(io.StringIO):
+            def isatty(self):
+                return True
+        
+        tty = FakeTTY()
+        renderer = ProgressRenderer(stream=tty, refresh=3600)
+        renderer.update('T01', '[T01] Descargando 10%')
+        renderer.update('T02', '[T02] Convirtiendo')
+        renderer._draw()
+        renderer.update('T01', '[T01] Descargando 50%')
+        renderer._draw()
+        output = tty.getvalue()
+        if renderer.lines_drawn != 2 or '\x1b[2F\x1b[J' not in output or 'Descargando 50%' not in output:
+            print(f"  ✗ Unexpected dashboard output: {output!r}")
+            return False
+        print("  ✓ One dashboard line per task, redrawn in place")
+        renderer.stop()
+        if renderer.lines_drawn != 0 or renderer.thread is not None:
+            print("  ✗ Dashboard not cleared on stop")
+            return False
+        print("  ✓ Dashboard cleared and thread stopped")
+        
+        if ProgressRenderer(stream=io.StringIO()).is_tty():
+            print("  ✗ Non-TTY stream detected as a terminal")
+            return False
+        print("  ✓ Non-TTY output falls back to summary lines")
+        
+        return True
+    except Exception as e:
+        print(f"  ✗ Error testing console progress renderer: {e}")
+        return False
+
+def test_structured_logging():
+    """Test sampled progress logging and the JSON lines format"""
+    print("\nTesting structured logging...")
+    try:
+        import json
+        import logging
+        from descargar_audio import progress_hook, JsonLinesFormatter
+        
+        class Collector(logging.Handler):
+            def __init__(self):
+                super().__init__()
+                self.records = []
+            def emit(self, record):
+                self.records.append(record)
+        
+        collector = Collector()
+        root = logging.getLogger()
+        root.addHandler(collector)
+        try:
+            hook = progress_hook('J01', show_progress=False, intervalo_log=3600)
+            for downloaded in range(0, 100000, 1000):
+                hook({'status': 'downloading', '_percent_str': '1%', '_speed_str': '1MiB/s',
+                      'downloaded_bytes': downloaded, 'total_bytes': 100000})
+            hook({'status': 'finished', 'filename': 'a.webm', 'total_bytes': 100000})
+        finally:
+            root.removeHandler(collector)
+        
+        phases = [getattr(record, 'phase', None) for record in collector.records]
+        if phases != ['download', 'downloaded']:
+            print(f"  ✗ Progress lines not rate-limited: {phases}")
+            return False
+        print("  ✓ 100 progress callbacks produced a single progress log line")
+        
+        line = json.loads(JsonLinesFormatter().format(collector.records[0]))
+        if line.get('job_id') != 'J01' or line.get('phase') != 'download' or line.get('total_bytes') != 100000:
+            print(f"  ✗ Unexpected JSON line: {line}")
+            return False
+        print("  ✓ JSON lines carry job ID, phase and byte counts")
+        
+        return True
+    except Exception as e:
+        print(f"  ✗ Error testing structured logging: {e}")
+        return False
+
+def test_metrics():
+    """Test the Prometheus text export and the quantile estimate"""
+    print("\nTesting metrics...")
+    try:
+        from metrics import JobMetrics, error_class
+        from yt_dlp.utils import DownloadError, ExtractorError
+        
+        metrics = JobMetrics()
+        for seconds in (0.2, 0.4, 0.6, 0.8, 3):
+            metrics.phase_seconds.observe(seconds, phase='download')
+        metrics.downloaded_bytes.inc(1500)
+        wrapped = DownloadError('ERROR: boom', exc_info=(ExtractorError, ExtractorError('boom'), None))
+        metrics.record_failure('extract', wrapped)
+        metrics.gauge('youtube2mp3_queue_depth', 'Jobs waiting', ('stage',), lambda: {'download': 4})
+        
+        text = metrics.render()
+        expected = [
+            'youtube2mp3_phase_seconds_bucket{phase="download",le="0.5"} 2',
+            'youtube2mp3_phase_seconds_bucket{phase="download",le="+Inf"} 5',
+            'youtube2mp3_phase_seconds_count{phase="download"} 5',
+            'youtube2mp3_downloaded_bytes_total 1500',
+            'youtube2mp3_failures_total{phase="extract",error_class="ExtractorError"} 1',
+            'youtube2mp3_queue_depth{stage="download"} 4',
+        ]
+        missing = [line for line in expected if line not in text.splitlines()]
+        if missing:
+            print(f"  ✗ Missing lines in the export: {missing}")
+            return False
+        print("  ✓ Histograms, counters and gauges exported in the Prometheus text format")
+        
+        p50 = metrics.phase_seconds.quantile(0.5, phase='download')
+        if not 0.5 <= p50 <= 1:
+            print(f"  ✗ Unexpected p50 estimate: {p50}")
+            return False
+        if error_class(ValueError()) != 'ValueError' or error_class('text') != 'Error':
+            print("  ✗ Unexpected error class names")
+            return False
+        print(f"  ✓ Quantiles are estimated from the buckets (p50 ~{p50:.2f}s)")
+        
+        return True
+    except Exception as e:
+        print(f"  ✗ Error testing metrics: {e}")
+        return False
+
+def test_tracing():
+    """Test the Chrome trace-event export of per-job spans"""
+    print("\nTesting tracing...")
+    try:
+        import threading
+        from tracing import TraceRecorder, NullTracer
+        
+        tracer = TraceRecorder()
+        tracer.name_job('J01', 'J01 https://example.com/watch?v=a')
+        tracer.start('J01', 'job')
+        tracer.start('J01', 'queued')
+        # A wait that starts on one thread and ends on another
+        worker = threading.Thread(target=tracer.end, args=('J01', 'queued'), kwargs={'cat': 'wait'})
+        worker.start()
+        worker.join()
+        with tracer.span('J01', 'download'):
+            tracer.instant('J01', 'yt-dlp finished')
+        tracer.finish_job('J01', ok=True)
+        with tracer.span('J02', 'extract'):
+            pass
+        
+        trace = tracer.trace('J01')
+        names = [e['name'] for e in trace['traceEvents'] if e['ph'] in ('X', 'i')]
+        if sorted(names) != ['download', 'job', 'queued', 'yt-dlp finished']:
+            print(f"  ✗ Unexpected events in the job trace: {names}")
+            return False
+        tracks = [e for e in trace['traceEvents'] if e['name'] == 'thread_name']
+        if len(tracks) != 1 or tracks[0]['args']['name'] != 'J01 https://example.com/watch?v=a':
+            print(f"  ✗ Unexpected track names: {tracks}")
+            return False
+        print("  ✓ Spans, waits and hook instants recorded on the job's own track")
+        
+        if tracer.trace('missing') is not None or len(tracer.trace()['traceEvents']) <= len(trace['traceEvents']):
+            print("  ✗ Unexpected whole-run or unknown-job trace")
+            return False
+        if NullTracer().trace('J01') is not None:
+            print("  ✗ The null tracer should not record anything")
+            return False
+        print("  ✓ Whole-run traces include every job, disabled tracing records nothing")
+        
+        # A capped buffer forgets the tracks of finished jobs it no longer holds
+        capped = TraceRecorder(max_events=4)
+        capped.name_job('running', 'running job')
+        capped.start('running', 'job')
+        for number in range(100):
+            capped.name_job(number, f"job {number}")
+            with capped.span(number, 'download'):
+                pass
+            capped.finish_job(number)
+        if len(capped._tracks) > 5 or len(capped._labels) > 5 or 'running' not in capped._labels:
+            print(f"  ✗ Tracks not pruned: {len(capped._tracks)} tracks, {len(capped._labels)} labels")
+            return False
+        print("  ✓ Tracks of finished jobs pruned with their last event")
+        
+        return True
+    except Exception as e:
+        print(f"  ✗ Error testing tracing: {e}")
+        return False
+
+def test_benchmark_harness():
+    """Test the local media server and the result helpers of the benchmark"""
+    print("\nTesting benchmark harness...")
+    try:
+        import tempfile
+        import urllib.request
+        from benchmark import MediaServer, percentile, compare_to_baseline
+        
+        with tempfile.TemporaryDirectory() as media_dir:
+            with open(os.path.join(media_dir, 'aac-1mb.m4a'), 'wb') as f:
+                f.write(b'\0' * 1024)
+            with MediaServer(media_dir) as server:
+                with urllib.request.urlopen(f"{server.base_url}/r001j002_aac-1mb.m4a") as response:
+                    body = response.read()
+                    content_type = response.headers.get('Content-Type')
+        if len(body) != 1024 or content_type != 'audio/mp4':
+            print(f"  ✗ Unexpected response: {len(body)} bytes, {content_type}")
+            return False
+        print("  ✓ Every job URL maps to the generated media with an audio content type")
+        
+        if percentile([5, 1, 4, 2, 3], 0.5) != 3 or percentile([5, 1, 4, 2, 3], 0.95) != 5 or percentile([], 0.5) is not None:
+            print("  ✗ Unexpected percentiles")
+            return False
+        baseline = {'results': [
+            {'mode': 'async', 'media': 'aac-1mb.m4a', 'max_concurrent': 3, 'jobs_per_minute': 100},
+            {'mode': 'sync', 'media': 'aac-1mb.m4a', 'max_concurrent': 1, 'jobs_per_minute': 40},
+        ]}
+        results = [
+            {'mode': 'async', 'media': 'aac-1mb.m4a', 'max_concurrent': 3, 'jobs_per_minute': 70},
+            {'mode': 'sync', 'media': 'aac-1mb.m4a', 'max_concurrent': 1, 'jobs_per_minute': 38},
+        ]
+        regressions = compare_to_baseline(results, baseline, tolerance=0.2)
+        if [(r['mode'], before) for r, before in regressions] != [('async', 100)]:
+            print(f"  ✗ Unexpected regressions: {regressions}")
+            return False
+        print("  ✓ Throughput drops beyond the tolerance are reported as regressions")
+        
+        return True
+    except Exception as e:
+        print(f"  ✗ Error testing benchmark harness: {e}")
+        return False
+
+def test_playlist_expansion():
+    """Test that playlists and channel tabs are expanded lazily"""
+    print("\nTesting playlist expansion...")
+    try:
+        from playlist import iter_playlist_urls
+        
+        pulled = []
+        
+        def channel_videos():
+            for i in range(1, 5001):
+                pulled.append(i)
+                yield {'_type': 'url', 'ie_key': 'Youtube', 'url': f'https://www.youtube.com/watch?v=v{i}'}
+        
+        class FakePagedList:
+            def getslice(self, start, end):
+                return [{'_type': 'url', 'ie_key': 'Youtube', 'url': f'https://www.youtube.com/watch?v=s{i}'}
+                        for i in range(start, min(end, 60))]
+        
+        results = {
+            'https://www.youtube.com/@channel': {'_type': 'playlist', 'entries': iter([
+                {'_type': 'url', 'ie_key': 'YoutubeTab', 'url': 'https://www.youtube.com/@channel/videos'},
+                {'_type': 'url', 'ie_key': 'YoutubeTab', 'url': 'https://www.youtube.com/@channel/shorts'},
+            ])},
+            'https://www.youtube.com/@channel/videos': {'_type': 'playlist', 'entries': channel_videos()},
+            'https://www.youtube.com/@channel/shorts': {'_type': 'playlist', 'entries': FakePagedList()},
+            'https://www.youtube.com/watch?v=single': {'id': 'single', 'webpage_url': 'https://www.youtube.com/watch?v=single'},
+        }
+        
+        class FakeYDL:
+            def extract_info(self, url, download=True, process=True):
+                return results[url]
+        
+        urls = iter_playlist_urls('https://www.youtube.com/@channel', ydl=FakeYDL())
+        first = [next(urls) for _ in range(3)]
+        if first != [f'https://www.youtube.com/watch?v=v{i}' for i in (1, 2, 3)] or len(pulled) != 3:
+            print(f"  ✗ Entries were not pulled lazily: {first}, {len(pulled)} pulled")
+            return False
+        print("  ✓ The first videos are available before the rest of the channel is paged")
+        
+        rest = list(urls)
+        if len(rest) != 4997 + 60 or rest[-1] != 'https://www.youtube.com/watch?v=s59':
+            print(f"  ✗ Unexpected expansion: {len(rest)} URLs")
+            return False
+        single = list(iter_playlist_urls('https://www.youtube.com/watch?v=single', ydl=FakeYDL()))
+        if single != ['https://www.youtube.com/watch?v=single']:
+            print(f"  ✗ A single video should yield itself: {single}")
+            return False
+        print("  ✓ Channel tabs and paged lists are expanded, single videos pass through")
+        
+        return True
+    except Exception as e:
+        print(f"  ✗ Error testing playlist expansion: {e}")
+        return False
+
+def test_bandwidth_limiter():
+    """Test the shared token bucket and the per-job cap"""
+    print("\nTesting bandwidth limiter...")
+    try:
+        import threading
+        import time
+        from bandwidth import BandwidthLimiter, parse_rate
+        
+        if parse_rate('500K') != 500 * 1024 or parse_rate('4.2M') != 4.2 * 1024 ** 2 or parse_rate('') is not None:
+            print("  ✗ Unexpected parsed rates")
+            return False
+        
+        # Four jobs share 1 MB/s: 200 KB in total takes ~0.2 s however many jobs run
+        limiter = BandwidthLimiter(rate=1_000_000)
+        
+        def job():
+            throttle = limiter.job()
+            for downloaded in range(10_000, 60_000, 10_000):
+                throttle.progress_hook({'status': 'downloading', 'downloaded_bytes': downloaded, 'filename': 'a.webm'})
+        
+        start = time.monotonic()
+        threads = [threading.Thread(target=job) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - start
+        if not 0.15 <= elapsed <= 0.6 or limiter.stats()['bytes'] != 200_000:
+            print(f"  ✗ Shared budget not enforced: {elapsed:.2f}s, {limiter.stats()}")
+            return False
+        print(f"  ✓ Concurrent jobs share the total rate ({elapsed:.2f}s for 200 KB at 1 MB/s)")
+        
+        # The per-job cap applies on top of the total and can change at runtime
+        limiter.set_limits(rate=None, per_job_rate=500_000)
+        throttle = limiter.job()
+        start = time.monotonic()
+        throttle.consume(100_000)
+        if time.monotonic() - start < 0.15:
+            print("  ✗ Per-job cap not enforced")
+            return False
+        limiter.set_limits(rate=None, per_job_rate=None)
+        start = time.monotonic()
+        throttle.consume(1_000_000)
+        if time.monotonic() - start > 0.1:
+            print("  ✗ Removing the limits did not take effect")
+            return False
+        print("  ✓ Per-job cap enforced and adjustable while the job runs")
+        
+        return True
+    except Exception as e:
+        print(f"  ✗ Error testing bandwidth limiter: {e}")
+        return False
+
+def test_concurrency_controller():
+    """Test the AIMD decisions of the adaptive concurrency controller"""
+    print("\nTesting concurrency controller...")
+    try:
+        from concurrency import AdaptiveLimit, ConcurrencyController, INCREASE, DECREASE, HOLD
+        from metrics import JobMetrics, http_status
+        
+        counters = {'bytes': 0, 'attempts': 0, 'failures': 0, 'throttled': 0}
+        clock = [0.0]
+        gate = AdaptiveLimit(2)
+        controller = ConcurrencyController(
+            gate, lambda: dict(counters), floor=1, ceiling=4, log=lambda message: None, clock=lambda: clock[0]
+        )
+        
+        # One window of 10 seconds
+        def window(nbytes, attempts=4, failures=0, throttled=0):
+            clock[0] += 10
+            counters['bytes'] += nbytes
+            counters['attempts'] += attempts
+            counters['failures'] += failures
+            counters['throttled'] += throttled
+            return controller.step()[:2]
+        
+        # Saturated pool: one more worker per window while throughput holds
+        gate.acquire(); gate.acquire()
+        if window(10_000_000) != (INCREASE, 3):
+            print("  ✗ A saturated pool should grow by one")
+            return False
+        gate.acquire()
+        if window(2_000_000)[0] != DECREASE or gate.limit != 2:
+            print(f"  ✗ A throughput drop after an increase should undo it (limit {gate.limit})")
+            return False
+        gate.release(); gate.release()
+        if window(2_000_000) != (HOLD, 2):
+            print("  ✗ Unexpected decision while stable")
+            return False
+        print("  ✓ Additive increase while throughput holds, undone when it drops")
+        
+        gate.set_limit(4)
+        if window(2_000_000, throttled=1) != (DECREASE, 2) or window(2_000_000, failures=3) != (DECREASE, 1):
+            print("  ✗ Throttling and errors should halve the limit")
+            return False
+        if window(2_000_000, throttled=5) != (HOLD, 1):
+            print("  ✗ The limit should not go below the floor")
+            return False
+        print("  ✓ Multiplicative decrease on HTTP 429/403 and errors, bounded by the floor")
+        
+        metrics = JobMetrics()
+        metrics.record_failure('download', RuntimeError('ERROR: unable to download video data: HTTP Error 429: Too Many Requests'))
+        if http_status(ValueError('nope')) is not None or metrics.http_errors.values() != {('429',): 1}:
+            print("  ✗ HTTP statuses are not extracted from the errors")
+            return False
+        print("  ✓ Throttling responses are counted from the download errors")
+        
+        import threading
+        import time
+        from job_queue import JobQueue
+        
+        release = threading.Event()
+        peak = [0]
+        running = [0]
+        running_lock = threading.Lock()
+        def job():
+            with running_lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+            release.wait(5)
+            with running_lock:
+                running[0] -= 1
+        
+        gate = AdaptiveLimit(2)
+        pool = JobQueue(job, num_workers=8, max_size=20, name='test-gated', gate=gate)
+        pool.start()
+        time.sleep(0.1)
+        controller = ConcurrencyController(gate, lambda: dict(counters), floor=1, ceiling=8, log=lambda message: None)
+        for _ in range(6):
+            controller.step()
+        if gate.active() != 0 or gate.limit != 2:
+            print(f"  ✗ An idle pool should not grow the limit (active {gate.active()}, limit {gate.limit})")
+            return False
+        for _ in range(5):
+            pool.submit()
+        time.sleep(0.2)
+        if gate.active() != 2 or peak[0] != 2:
+            print(f"  ✗ The gate should bound the running jobs (active {gate.active()}, peak {peak[0]})")
+            return False
+        if pool.depth() != 3 or pool.free_slots() != 17 or pool.active() != 2:
+            print(f"  ✗ Jobs waiting for the gate should count as queued (stats {pool.stats()})")
+            return False
+        release.set()
+        pool.stop()
+        print("  ✓ Idle workers hold no gate slot, running jobs are bounded by it, waiting ones count as queued")
+        
+        return True
+    except Exception as e:
+        print(f"  ✗ Error testing concurrency controller: {e}")
+        return False
+
+def test_retry_scheduler():
+    """Test error classification, backoff bounds and the circuit breaker"""
+    print("\nTesting retries and circuit breaker...")
+    try:
+        import threading
+        from retry import (RetryPolicy, CircuitBreaker, RetryScheduler, classify_error,
+                           RETRYABLE, PERMANENT, CLOSED, OPEN, HALF_OPEN)
+        
+        throttled = RuntimeError('ERROR: unable to download video data: HTTP Error 429: Too Many Requests')
+        removed = RuntimeError('ERROR: [youtube] abc: Private video. Sign in if you have access')
+        if classify_error(throttled) != RETRYABLE or classify_error(TimeoutError('read timed out')) != RETRYABLE:
+            print("  ✗ Throttling and timeouts should be retryable")
+            return False
+        if classify_error(removed) != PERMANENT or classify_error(RuntimeError('HTTP Error 404: Not Found')) != PERMANENT:
+            print("  ✗ Private videos and 404s should be permanent")
+            return False
+        print("  ✓ Errors classified as retryable or permanent")
+        
+        policy = RetryPolicy(max_attempts=3, base_delay=2, max_delay=5)
+        if not policy.should_retry(throttled, 2) or policy.should_retry(throttled, 3) or policy.should_retry(removed, 1):
+            print("  ✗ Retries should stop at max_attempts and skip permanent errors")
+            return False
+        delays = [policy.delay(attempt) for attempt in (1, 2, 3, 4) for _ in range(50)]
+        if not all(0 <= d <= 2 for d in delays[:50]) or not all(0 <= d <= 5 for d in delays) or len(set(delays)) < 100:
+            print("  ✗ Backoff should be jittered within its capped exponential window")
+            return False
+        print("  ✓ Jittered exponential backoff, capped and bounded by max_attempts")
+        
+        clock = [0.0]
+        breaker = CircuitBreaker(window=10, min_calls=4, threshold=0.5, cooldown=30, clock=lambda: clock[0])
+        for error in (None, removed, throttled, throttled):
+            breaker.record(error)
+        if breaker.state != OPEN or not 29 < breaker.admit()[0] <= 30:
+            print(f"  ✗ Breaker should open at 50% retryable failures ({breaker.state})")
+            return False
+        clock[0] += 31
+        delay, trial = breaker.admit()
+        if delay != 0 or trial is None or breaker.state != HALF_OPEN or breaker.admit()[0] <= 0:
+            print("  ✗ After the cooldown only one trial job should start")
+            return False
+        # Jobs admitted before the breaker opened finish during the trial
+        breaker.record()
+        breaker.record(throttled)
+        if breaker.state != HALF_OPEN:
+            print("  ✗ Only the trial should decide the half-open state")
+            return False
+        breaker.record(throttled, token=trial)
+        if breaker.state != OPEN:
+            print("  ✗ A failed trial should open the breaker again")
+            return False
+        clock[0] += 31
+        trial = breaker.wait()
+        breaker.record(token=trial)
+        if breaker.state != CLOSED or breaker.admit() != (0, None) or breaker.stats()['opened'] != 2:
+            print("  ✗ A successful trial should close the breaker")
+            return False
+        print("  ✓ Circuit breaker opens, probes with one trial and closes")
+        
+        scheduler = RetryScheduler()
+        order = []
+        done = threading.Event()
+        scheduler.schedule(0.05, order.append, 'second')
+        scheduler.schedule(0.0, order.append, 'first')
+        scheduler.schedule(0.06, done.set)
+        if not done.wait(2) or order != ['first', 'second']:
+            print(f"  ✗ Scheduled retries should run in due order ({order})")
+            return False
+        print("  ✓ Delayed retries run in order on one thread")
+        
+        return True
+    except Exception as e:
+        print(f"  ✗ Error testing retries: {e}")
+        return False
+
+def test_ydl_pool():
+    """Test the reuse and per-job reset of the warm YoutubeDL instances"""
+    print("\nTesting warm YoutubeDL pool...")
+    try:
+        import threading
+        from ydl_pool import YdlPool
+        
+        class FakeYoutubeDL:
+            """Stands in for yt_dlp.YoutubeDL: normalizes outtmpl and copies the hooks like it"""
+            def __init__(self, params):
+                self.params = dict(params)
+                self.params['outtmpl'] = {'default': params.get('outtmpl', '%(title)s.%(ext)s'), 'subtitle': 'sub'}
+                self._progress_hooks = list(params.get('progress_hooks', []))
+                self._postprocessor_hooks = []
+                self._download_retcode = 0
+                self.closed = False
+            
+            def close(self):
+                self.closed = True
+        
+        pool = YdlPool(FakeYoutubeDL, max_jobs=3)
+        base = {'format': 'bestaudio/best', 'quiet': True}
+        hook_a, hook_b = (lambda d: None), (lambda d: None)
+        
+        with pool.job(dict(base, outtmpl='/a/%(title)s.%(ext)s', progress_hooks=[hook_a])) as first:
+            first._download_retcode = 1
+        with pool.job(dict(base, outtmpl='/b/%(title)s.%(ext)s', progress_hooks=[hook_b])) as second:
+            state = (second.params['outtmpl'], second._progress_hooks, second._download_retcode)
+        if second is not first or pool.stats() != {'created': 1, 'reused': 1}:
+            print("  ✗ Jobs of the same thread and options should share one instance")
+            return False
+        if state != ({'default': '/b/%(title)s.%(ext)s', 'subtitle': 'sub'}, [hook_b], 0) or second._progress_hooks:
+            print(f"  ✗ Per-job state was not reset: {state}")
+            return False
+        print("  ✓ One instance per thread, with template, hooks and errors reset per job")
+        
+        with pool.job(dict(base, format='best')) as other:
+            with pool.job(dict(base, format='best')) as nested:
+                pass
+        if other is first or nested is other or not nested.closed:
+            print("  ✗ Different options or nested jobs should get their own instance")
+            return False
+        with pool.job(base) as third:
+            pass
+        with pool.job(base) as recycled:
+            pass
+        if third is not first or recycled is first or not first.closed:
+            print("  ✗ An instance should be rebuilt after max_jobs jobs")
+            return False
+        
+        seen = []
+        worker = threading.Thread(target=lambda: seen.append(pool.job(base).__enter__()))
+        worker.start()
+        worker.join()
+        if seen[0] is recycled:
+            print("  ✗ Each worker thread should keep its own instance")
+            return False
+        print("  ✓ Separate instances per options and thread, rebuilt after max_jobs")
+        
+        return True
+    except Exception as e:
+        print(f"  ✗ Error testing warm YoutubeDL pool: {e}")
+        return False
+
+def test_fast_start():
+    """Test that the CLI starts without loading yt-dlp and the startup benchmark helpers"""
+    print("\nTesting fast CLI start...")
+    try:
+        import tempfile
+        from benchmark_startup import measure_command, parse_importtime, find_regressions
+        
+        with tempfile.TemporaryDirectory() as work_dir:
+            results = [measure_command(name, 1, work_dir) for name in ('cli_version', 'cli_bad_args')]
+        for result in results:
+            if not result['ok'] or result['forbidden_imports']:
+                print(f"  ✗ {result['command']}: exit code {result['exit_code']}, imported {result['forbidden_imports']}")
+                return False
+        print("  ✓ --version and argument errors run without importing yt_dlp or asyncio")
+        
+        stderr = ("import time: self [us] | cumulative | imported package\n"
+                  "import time:       120 |        120 |   _abc\n"
+                  "import time:      3000 |      45000 | yt_dlp\n")
+        if parse_importtime(stderr) != {'_abc': 120, 'yt_dlp': 45000}:
+            print("  ✗ Unexpected -X importtime parsing")
+            return False
+        baseline = {'results': [{'command': 'cli_help', 'median_seconds': 0.1}, {'command': 'web_import', 'median_seconds': 0.5}]}
+        regressions = find_regressions(
+            [{'command': 'cli_help', 'median_seconds': 0.4}, {'command': 'web_import', 'median_seconds': 0.55}], baseline, 0.2
+        )
+        if [(r['command'], before) for r, before in regressions] != [('cli_help', 0.1)]:
+            print(f"  ✗ Unexpected regressions: {regressions}")
+            return False
+        print("  ✓ Start times beyond the tolerance are reported as regressions")
+        
+        return True
+    except Exception as e:
+        print(f"  ✗ Error testing fast start: {e}")
+        return False
+
+def test_file_serving():
+    """Test ETags, conditional requests and byte ranges of the file responses"""
+    print("\nTesting file serving...")
+    try:
+        import tempfile
+        import email.utils
+        from file_serving import (evaluate_request, parse_range, proxy_headers, iter_file_range,
+                                  file_etag, X_ACCEL, X_SENDFILE, DIRECT)
+        
+        with tempfile.TemporaryDirectory() as root:
+            path = os.path.join(root, 'sub dir', 'song.mp3')
+            os.makedirs(os.path.dirname(path))
+            with open(path, 'wb') as f:
+                f.write(bytes(range(256)) * 40)
+            stat = os.stat(path)
+            etag = file_etag(stat)
+            
+            status, headers, body = evaluate_request({}, stat)
+            if status != 200 or body != (0, 10240) or headers['ETag'] != etag or headers['Accept-Ranges'] != 'bytes':
+                print(f"  ✗ Unexpected full response: {status} {headers}")
+                return False
+            last_modified = headers['Last-Modified']
+            if evaluate_request({'If-None-Match': f'W/{etag}, "other"'}, stat)[0] != 304 or \
+                    evaluate_request({'If-Modified-Since': last_modified}, stat)[0] != 304 or \
+                    evaluate_request({'If-None-Match': '"other"', 'If-Modified-Since': last_modified}, stat)[0] != 200:
+                print("  ✗ Matching validators should get a 304 (If-None-Match taking precedence)")
+                return False
+            if evaluate_request({'If-Match': '"other"'}, stat)[0] != 412:
+                print("  ✗ A failed If-Match should get a 412")
+                return False
+            print("  ✓ Strong ETag and Last-Modified, 304 and 412 answers")
+            
+            status, headers, body = evaluate_request({'Range': 'bytes=100-199'}, stat)
+            if status != 206 or body != (100, 100) or headers['Content-Range'] != 'bytes 100-199/10240':
+                print(f"  ✗ Unexpected partial response: {status} {headers}")
+                return False
+            if parse_range('bytes=-500', 10240) != (9740, 500) or parse_range('bytes=10000-', 10240) != (10000, 240) or \
+                    parse_range('bytes=0-99999', 10240) != (0, 10240) or parse_range('bytes=0-1,5-9', 10240) is not None or \
+                    parse_range('items=0-1', 10240) is not None:
+                print("  ✗ Unexpected range parsing")
+                return False
+            status, headers, _ = evaluate_request({'Range': 'bytes=20000-'}, stat)
+            if status != 416 or headers['Content-Range'] != 'bytes */10240':
+                print("  ✗ An unsatisfiable range should get a 416")
+                return False
+            stale = email.utils.formatdate(stat.st_mtime - 3600, usegmt=True)
+            if evaluate_request({'Range': 'bytes=0-9', 'If-Range': '"stale"'}, stat)[0] != 200 or \
+                    evaluate_request({'Range': 'bytes=0-9', 'If-Range': stale}, stat)[0] != 200 or \
+                    evaluate_request({'Range': 'bytes=0-9', 'If-Range': etag}, stat)[0] != 206:
+                print("  ✗ If-Range should only keep the range for the current file")
+                return False
+            chunks = list(iter_file_range(open(path, 'rb'), 250, 12, chunk_size=5))
+            if b''.join(chunks) != bytes([250, 251, 252, 253, 254, 255, 0, 1, 2, 3, 4, 5]):
+                print("  ✗ Range body does not match the file")
+                return False
+            print("  ✓ Single byte ranges with 206, 416 and If-Range")
+            
+            if proxy_headers(X_ACCEL, path, root, '/internal/') != {'X-Accel-Redirect': '/internal/sub%20dir/song.mp3'} or \
+                    proxy_headers(X_ACCEL, path, os.path.join(root, 'sub dir', 'other')) is not None or \
+                    proxy_headers(X_SENDFILE, path, root) != {'X-Sendfile': os.path.abspath(path)} or \
+                    proxy_headers(DIRECT, path, root) is not None:
+                print("  ✗ Unexpected proxy hand-over headers")
+                return False
+            print("  ✓ X-Accel-Redirect and X-Sendfile hand-over")
+        
+        return True
+    except Exception as e:
+        print(f"  ✗ Error testing file serving: {e}")
+        return False
+
+def test_zip_export():
+    """Test the streamed ZIP of a batch"""
+    print("\nTesting ZIP export...")
+    try:
+        import io
+        import sqlite3
+        import tempfile
+        import zipfile
+        from job_store import JobStore
+        from zip_stream import iter_zip
+        
+        with tempfile.TemporaryDirectory() as root:
+            # A database of an older version, with the batch in 'extra'
+            db_path = os.path.join(root, 'jobs.db')
+            conn = sqlite3.connect(db_path)
+            conn.execute("CREATE TABLE jobs (id TEXT PRIMARY KEY, extra TEXT NOT NULL DEFAULT '{}', "
+                         "status TEXT, created_at TEXT)")
+            conn.execute("INSERT INTO jobs VALUES ('old', '{\"batch_id\": \"b1\"}', 'completed', '2024-01-01')")
+            conn.commit()
+            conn.close()
+            store = JobStore(db_path)
+            store.create_many([
+                {'id': 'new', 'batch_id': 'b1', 'status': 'completed', 'created_at': '2024-01-02'},
+                {'id': 'running', 'batch_id': 'b1', 'status': 'downloading', 'created_at': '2024-01-03'},
+                {'id': 'other', 'batch_id': 'b2', 'status': 'completed', 'created_at': '2024-01-04'},
+            ])
+            ids = [record['id'] for record in store.iter_by_batch('b1', ['completed'], batch_size=1)]
+            if ids != ['old', 'new'] or len(list(store.iter_by_batch('b1'))) != 3:
+                print(f"  ✗ Unexpected jobs of the batch: {ids}")
+                return False
+            print("  ✓ Jobs of a batch, including those of older databases")
+            
+            paths = []
+            for i in range(2):
+                path = os.path.join(root, f'{i}.mp3')
+                with open(path, 'wb') as f:
+                    f.write(os.urandom(5000 + i))
+                paths.append(path)
+            entries = [(paths[0], 'Song.mp3'), (os.path.join(root, 'gone.mp3'), 'Gone.mp3'), (paths[1], 'Song.mp3')]
+            chunks = list(iter_zip(iter(entries), chunk_size=1024))
+            if max(len(chunk) for chunk in chunks) > 1024 + 512:
+                print("  ✗ The archive should be produced in chunks")
+                return False
+            archive = zipfile.ZipFile(io.BytesIO(b''.join(chunks)))
+            if archive.namelist() != ['Song.mp3', 'Song (2).mp3'] or archive.testzip() is not None or \
+                    any(info.compress_type != zipfile.ZIP_STORED for info in archive.infolist()):
+                print(f"  ✗ Unexpected archive: {archive.namelist()}")
+                return False
+            with open(paths[1], 'rb') as f:
+                if archive.read('Song (2).mp3') != f.read():
+                    print("  ✗ Archived file does not match")
+                    return False
+            print("  ✓ Stored entries streamed in chunks, duplicate names renamed, missing files skipped")
+        
+        return True
+    except Exception as e:
+        print(f"  ✗ Error testing ZIP export: {e}")
+        return False
+
+def test_disk_quota():
+    """Test the LRU eviction of finished files"""
+    print("\nTesting disk quota...")
+    try:
+        import tempfile
+        from disk_quota import DiskQuota, InsufficientStorageError, select_evictions, parse_size
+        from job_store import JobStore
+        
+        if parse_size('20G') != 20 * 1024 ** 3 or parse_size('1.5K') != 1536 or parse_size('') is not None:
+            print("  ✗ Unexpected size parsing")
+            return False
+        files = [('a', 100, 10.0), ('b', 100, 30.0), ('c', 100, 20.0)]
+        if [f[0] for f in select_evictions(files, 40.0, max_bytes=150)] != ['a', 'c'] or \
+                [f[0] for f in select_evictions(files, 40.0, ttl=15)] != ['a', 'c'] or \
+                [f[0] for f in select_evictions(files, 40.0, bytes_to_free=50)] != ['a'] or \
+                select_evictions(files, 40.0, max_bytes=300, ttl=100):
+            print("  ✗ Unexpected eviction choice")
+            return False
+        print("  ✓ Expired files first, then least recently accessed until under the quota")
+        
+        with tempfile.TemporaryDirectory() as root:
+            store = JobStore(os.path.join(root, 'jobs.db'))
+            paths = {}
+            for name, accessed in (('old', 1000), ('new', 3000), ('served', 2000)):
+                paths[name] = os.path.join(root, f'{name}.mp3')
+                with open(paths[name], 'wb') as f:
+                    f.write(b'x' * 100)
+                os.utime(paths[name], (accessed, 500))
+            store.create_many([
+                {'id': 'j1', 'status': 'completed', 'filepath': paths['old'], 'created_at': '1'},
+                {'id': 'j2', 'status': 'completed', 'filepath': paths['old'], 'created_at': '2', 'cached': True},
+                {'id': 'j3', 'status': 'completed', 'filepath': paths['new'], 'created_at': '3'},
+                {'id': 'j4', 'status': 'completed', 'filepath': paths['served'], 'created_at': '4'},
+            ])
+            expired = []
+            quota = DiskQuota(
+                root, store.completed_filepaths,
+                lambda path: expired.extend(store.expire_filepath(path, 'now')),
+                max_bytes=150, clock=lambda: 4000.0
+            )
+            quota.touch(paths['served'])
+            if os.stat(paths['served']).st_mtime != 500:
+                print("  ✗ Serving a file must not change its modification time (ETag)")
+                return False
+            evicted = quota.sweep()
+            if [path for path, _ in evicted] != [paths['old'], paths['new']] or not os.path.exists(paths['served']):
+                print(f"  ✗ Unexpected evictions: {evicted}")
+                return False
+            if sorted(expired) != ['j1', 'j2', 'j3'] or store.get('j4')['status'] != 'completed' or \
+                    store.get('j1')['status'] != 'expired':
+                print(f"  ✗ Jobs of evicted files should be expired: {expired}")
+                return False
+            print("  ✓ Least recently served files evicted and their jobs expired")
+            
+            # Completions only wake the sweeper once the running total passes the quota
+            if quota.known_bytes != 100:
+                print(f"  ✗ Running total not taken from the sweep: {quota.known_bytes}")
+                return False
+            quota.max_bytes = 250
+            quota.add_file(paths['served'])
+            if quota._wake.is_set():
+                print("  ✗ A completion under the quota should not trigger a sweep")
+                return False
+            quota.add_file(paths['served'])
+            if not quota._wake.is_set():
+                print("  ✗ A completion over the quota should trigger a sweep")
+                return False
+            print("  ✓ Sweeps after completions coalesced until the quota is exceeded")
+            
+            quota.min_free_bytes = quota.free_bytes() * 2
+            try:
+                quota.check_free_space()
+                print("  ✗ A job should not start below the free-space floor")
+                return False
+            except InsufficientStorageError:
+                pass
+            if os.path.exists(paths['served']):
+                print("  ✗ The floor should evict files before failing")
+                return False
+            print("  ✓ Free-space floor enforced before new jobs")
+        
+        return True
+    except Exception as e:
+        print(f"  ✗ Error testing disk quota: {e}")
+        return False
+
+def test_event_loop_mode():
+    """Test the hand-offs between the event loop and the worker threads"""
+    print("\nTesting event loop serving mode...")
+    try:
+        import threading
+        from event_loop import Offloader, THREADING
+        from progress_rooms import ProgressBroadcaster, PROGRESS_EVENT, job_room
+        
+        offload = Offloader(THREADING)
+        body = [b'a', b'b']
+        if offload.iterate(body) is not body or offload.call(max, 1, 2) != 2:
+            print("  ✗ Threading mode should run everything in place")
+            return False
+        try:
+            Offloader('asyncio')
+            print("  ✗ Unknown modes should be rejected")
+            return False
+        except ValueError:
+            pass
+        
+        class FakeTpool:
+            def __init__(self):
+                self.threads = set()
+            def execute(self, function, *args, **kwargs):
+                result = []
+                thread = threading.Thread(target=lambda: result.append(function(*args, **kwargs)))
+                thread.start()
+                thread.join()
+                self.threads.add(thread.ident)
+                return result[0]
+        
+        closed = []
+        def chunks():
+            try:
+                yield b'1'
+                yield b'2'
+                yield b'3'
+            finally:
+                closed.append(True)
+        offload._tpool = FakeTpool()
+        body = offload.iterate(chunks())
+        if next(body) != b'1' or next(body) != b'2':
+            print("  ✗ Items should come through the thread pool")
+            return False
+        body.close()
+        if not closed or threading.get_ident() in offload._tpool.threads:
+            print("  ✗ Closing the body should close the source")
+            return False
+        print("  ✓ Blocking calls and response bodies handed to native threads")
+        
+        import concurrent.futures
+        import time
+        from streaming import StreamingTranscode, _EOF
+        
+        # Long waits are polled from the loop instead of holding a pool thread
+        naps = []
+        offload.sleep = lambda seconds: (naps.append(seconds), time.sleep(seconds))
+        offload._tpool = None
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+            if offload.run(executor, lambda: (time.sleep(0.15), 'done')[1]) != 'done' or not naps:
+                print("  ✗ Long calls should run on their executor and be polled")
+                return False
+        
+        transcode = StreamingTranscode('ffmpeg', None, 'out.mp3')
+        def produce():
+            for chunk in (b'x', b'y'):
+                time.sleep(0.1)
+                transcode._chunks.put(chunk)
+            transcode._chunks.put(_EOF)
+        naps.clear()
+        producer = threading.Thread(target=produce)
+        producer.start()
+        chunks = list(transcode.iter_chunks(sleep=offload.sleep, poll_interval=0.01))
+        producer.join()
+        if chunks != [b'x', b'y'] or len(naps) < 5:
+            print(f"  ✗ A live stream should poll its buffer on the loop ({chunks}, {len(naps)} polls)")
+            return False
+        print("  ✓ Long calls and live streams wait with cooperative polling, not pool threads")
+        
+        class FakeSocketIO:
+            def __init__(self):
+                self.sent = []
+                self.tasks = 0
+            def emit(self, event, data, to=None, namespace=None):
+                self.sent.append((event, to))
+            def start_background_task(self, target):
+                self.tasks += 1
+        
+        socket = FakeSocketIO()
+        progress = ProgressBroadcaster(socket, autostart=False)
+        worker = threading.Thread(target=lambda: (
+            progress.update('a', [job_room('a')], status='completed'),
+            progress.emit('download_complete', {'download_id': 'a'}, [job_room('a')])
+        ))
+        worker.start()
+        worker.join()
+        if socket.sent or socket.tasks:
+            print("  ✗ Worker threads must not emit or start tasks themselves")
+            return False
+        progress.start()
+        progress.start()
+        progress.flush()
+        if socket.tasks != 1 or socket.sent != [(PROGRESS_EVENT, job_room('a')), ('download_complete', [job_room('a')])]:
+            print(f"  ✗ Unexpected emits: {socket.sent}")
+            return False
+        print("  ✓ Worker events queued and emitted by the flusher after their progress")
+        
+        return True
+    except Exception as e:
+        print(f"  ✗ Error testing event loop mode: {e}")
+        return False
+
 def main():
     print("="*60)
     print("YouTube2MP3 Web Application - Validation Tests")
@@ -135,6 +1558,31 @@ def main():
     results.append(("Templates", test_templates()))
     results.append(("Static Files", test_static_files()))
     results.append(("Health Endpoint", test_health_endpoint()))
+    results.append(("Job Queue", test_job_queue()))
+    results.append(("Metadata Cache", test_metadata_cache()))
+    results.append(("Result Cache", test_result_cache()))
+    results.append(("Job Store", test_job_store()))
+    results.append(("Stream Formats", test_stream_format_selection()))
+    results.append(("Output Policy", test_output_policy()))
+    results.append(("Checkpoint Journal", test_checkpoint_journal()))
+    results.append(("Two-Stage Pipeline", test_two_stage_pipeline()))
+    results.append(("CSV Streaming", test_csv_streaming()))
+    results.append(("Progress Broadcaster", test_progress_broadcaster()))
+    results.append(("Progress Renderer", test_progress_renderer()))
+    results.append(("Structured Logging", test_structured_logging()))
+    results.append(("Metrics", test_metrics()))
+    results.append(("Tracing", test_tracing()))
+    results.append(("Benchmark Harness", test_benchmark_harness()))
+    results.append(("Playlist Expansion", test_playlist_expansion()))
+    results.append(("Bandwidth Limiter", test_bandwidth_limiter()))
+    results.append(("Concurrency Control", test_concurrency_controller()))
+    results.append(("Retries", test_retry_scheduler()))
+    results.append(("Warm YoutubeDL", test_ydl_pool()))
+    results.append(("Fast Start", test_fast_start()))
+    results.append(("File Serving", test_file_serving()))
+    results.append(("ZIP Export", test_zip_export()))
+    results.append(("Disk Quota", test_disk_quota()))
+    results.append(("Event Loop Mode", test_event_loop_mode()))
     
     print("\n" + "="*60)
     print("Test Summary")
@@ -0,0 +1,226 @@
+"""
+Per-job trace recording in the Chrome trace-event format (opens in
+Perfetto or chrome://tracing): one track per job with its phases, queue
+waits and yt-dlp hook transitions
+"""
+import collections
+import contextlib
+import itertools
+import json
+import os
+import threading
+import time
+
+PID = 1
+
+
+def now_us():
+    """Trace timestamp in microseconds"""
+    return time.perf_counter_ns() // 1000
+
+
+class TraceRecorder:
+    """
+    Collects trace events keyed by job. Spans can start and end on
+    different threads (e.g. a queue wait), and every job is drawn on its
+    own track named after it. Once the last event of a finished job leaves
+    a capped buffer, its track and name are forgotten too.
+    """
+
+    enabled = True
+
+    def __init__(self, max_events=None):
+        """
+        :param max_events: Keep only the most recent events (None: keep all)
+        """
+        self._lock = threading.Lock()
+        self._events = collections.deque(maxlen=max_events)
+        self._tracks = {}   # job_id -> track number
+        self._labels = {}   # job_id -> track name
+        self._counts = collections.Counter()  # job_id -> events in the buffer
+        self._open = {}     # (job_id, name) -> (start timestamp, args)
+        self._track_numbers = itertools.count(1)
+
+    def _track(self, job_id):
+        track = self._tracks.get(job_id)
+        if track is None:
+            track = self._tracks[job_id] = next(self._track_numbers)
+        return track
+
+    def _append(self, job_id, event):
+        """Buffer an event (lock held), pruning the job of the event it pushes out"""
+        if self._events.maxlen is not None and len(self._events) == self._events.maxlen:
+            dropped = self._events[0]['args']['job_id']
+            self._counts[dropped] -= 1
+            if self._counts[dropped] <= 0 and dropped != job_id:
+                self._prune(dropped)
+        self._events.append(event)
+        self._counts[job_id] += 1
+
+    def _prune(self, job_id):
+        """Forget the track of a job with no events left, unless it is still running"""
+        if any(key[0] == job_id for key in self._open):
+            return
+        del self._counts[job_id]
+        self._tracks.pop(job_id, None)
+        self._labels.pop(job_id, None)
+
+    def name_job(self, job_id, label):
+        """Name the track of a job (e.g. its ID and URL)"""
+        with self._lock:
+            self._track(job_id)
+            self._labels[job_id] = label
+
+    def complete(self, job_id, name, start, end=None, cat='phase', **args):
+        """Record a span that already finished (timestamps from now_us())"""
+        end = now_us() if end is None else end
+        args.setdefault('thread', threading.current_thread().name)
+        with self._lock:
+            self._append(job_id, {
+                'name': name, 'cat': cat, 'ph': 'X', 'ts': start, 'dur': max(end - start, 0),
+                'pid': PID, 'tid': self._track(job_id), 'args': dict(args, job_id=job_id),
+            })
+
+    def instant(self, job_id, name, cat='hook', **args):
+        """Record a point in time (e.g. a yt-dlp hook status change)"""
+        args.setdefault('thread', threading.current_thread().name)
+        with self._lock:
+            self._append(job_id, {
+                'name': name, 'cat': cat, 'ph': 'i', 's': 't', 'ts': now_us(),
+                'pid': PID, 'tid': self._track(job_id), 'args': dict(args, job_id=job_id),
+            })
+
+    @contextlib.contextmanager
+    def span(self, job_id, name, cat='phase', **args):
+        """Record the with block as a span of the job (also when it raises)"""
+        start = now_us()
+        try:
+            yield
+        finally:
+            self.complete(job_id, name, start, cat=cat, **args)
+
+    def start(self, job_id, name, **args):
+        """Open a span that another thread may end (see end())"""
+        with self._lock:
+            self._open[(job_id, name)] = (now_us(), args)
+
+    def end(self, job_id, name, cat='phase', **args):
+        """Close a span opened with start(); ignored if it was never opened"""
+        with self._lock:
+            opened = self._open.pop((job_id, name), None)
+        if opened is not None:
+            start, start_args = opened
+            self.complete(job_id, name, start, cat=cat, **dict(start_args, **args))
+
+    def finish_job(self, job_id, **args):
+        """Close the 'job' span of a job and drop any span left open"""
+        self.end(job_id, 'job', cat='job', **args)
+        with self._lock:
+            for key in [key for key in self._open if key[0] == job_id]:
+                del self._open[key]
+            if job_id in self._tracks and self._counts[job_id] <= 0:
+                self._prune(job_id)
+
+    def trace(self, job_id=None):
+        """
+        Chrome trace-event document with every event, or only a job's.
+
+        :return: Dict ready to be serialized to JSON, or None if the job has no events
+        """
+        with self._lock:
+            events = [e for e in self._events if job_id is None or e['args'].get('job_id') == job_id]
+            if job_id is not None and not events:
+                return None
+            tracks = {e['tid'] for e in events}
+            metadata = [{'name': 'process_name', 'ph': 'M', 'pid': PID, 'args': {'name': 'youtube2mp3'}}]
+            for known_job, track in self._tracks.items():
+                if track in tracks:
+                    metadata.append({
+                        'name': 'thread_name', 'ph': 'M', 'pid': PID, 'tid': track,
+                        'args': {'name': self._labels.get(known_job, str(known_job))},
+                    })
+        return {'traceEvents': metadata + events, 'displayTimeUnit': 'ms'}
+
+    def save(self, path, job_id=None):
+        """Write the trace to a JSON file (atomically)"""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.trace(job_id) or {'traceEvents': []}, f)
+        os.replace(tmp_path, path)
+
+
+class NullTracer:
+    """Stand-in used while tracing is off: every call is a no-op"""
+
+    enabled = False
+
+    def name_job(self, job_id, label):
+        pass
+
+    def complete(self, job_id, name, start, end=None, cat='phase', **args):
+        pass
+
+    def instant(self, job_id, name, cat='hook', **args):
+        pass
+
+    def span(self, job_id, name, cat='phase', **args):
+        return contextlib.nullcontext()
+
+    def start(self, job_id, name, **args):
+        pass
+
+    def end(self, job_id, name, cat='phase', **args):
+        pass
+
+    def finish_job(self, job_id, **args):
+        pass
+
+    def trace(self, job_id=None):
+        return None
+
+
+_tracer = NullTracer()
+
+
+def get_tracer():
+    """Process-wide tracer (a NullTracer unless enable_tracing() was called)"""
+    return _tracer
+
+
+def enable_tracing(max_events=None):
+    """Start recording trace events process-wide"""
+    global _tracer
+    if not _tracer.enabled:
+        _tracer = TraceRecorder(max_events)
+    return _tracer
+
+
+def hook_tracer(job_id):
+    """
+    yt-dlp progress hook that records an instant on every status change of
+    a job (downloading, finished, error); repeated updates are ignored
+    """
+    last_status = [None]
+
+    def hook(d):
+        status = d.get('status')
+        if status == last_status[0]:
+            return
+        last_status[0] = status
+        _tracer.instant(
+            job_id, f"yt-dlp {status}",
+            downloaded_bytes=d.get('downloaded_bytes'),
+            total_bytes=d.get('total_bytes') or d.get('total_bytes_estimate'),
+        )
+    return hook
+
+
+def postprocessor_tracer(job_id):
+    """yt-dlp postprocessor hook that records a span per postprocessor run"""
+    def hook(d):
+        name = f"postprocessor {d.get('postprocessor')}"
+        if d.get('status') == 'started':
+            _tracer.start(job_id, name)
+        elif d.get('status') == 'finished':
+            _tracer.end(job_id, name, cat='postprocessor')
+    return hook
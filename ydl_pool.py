@@ -0,0 +1,160 @@
+"""
+Warm YoutubeDL instances: each worker thread keeps one configured instance
+per set of options and reuses it across jobs, so extractors, the HTTP
+opener, the cookie jar and the FFmpeg lookup are set up once per worker
+instead of once per URL. The per-job state (output template, progress and
+postprocessor hooks, logger) is reset before every job.
+"""
+import contextlib
+import json
+import threading
+
+# Options that change from job to job: applied to the warm instance before
+# each job instead of being part of its identity
+PER_JOB_OPTIONS = ('outtmpl', 'progress_hooks', 'postprocessor_hooks', 'logger')
+
+# Jobs after which a thread rebuilds its instance (bounds the growth of the
+# cookie jar and the per-instance caches)
+DEFAULT_MAX_JOBS = 200
+
+
+def options_key(options):
+    """Identity of the options shared by every job (the per-job ones are left out)"""
+    shared = {key: value for key, value in options.items() if key not in PER_JOB_OPTIONS}
+    return json.dumps(shared, sort_keys=True, default=repr)
+
+
+class _WarmInstance:
+    """A YoutubeDL owned by one thread, with its pristine output templates"""
+
+    def __init__(self, ydl):
+        self.ydl = ydl
+        outtmpl = ydl.params.get('outtmpl')
+        self.outtmpl = dict(outtmpl) if isinstance(outtmpl, dict) else outtmpl
+        self.jobs = 0
+        self.busy = False
+
+
+class YdlPool:
+    """Per-thread cache of configured YoutubeDL instances"""
+
+    def __init__(self, factory=None, max_jobs=DEFAULT_MAX_JOBS):
+        """
+        :param factory: Callable building a YoutubeDL from options (default: yt_dlp.YoutubeDL)
+        :param max_jobs: Jobs served by an instance before it is rebuilt
+        """
+        self._factory = factory
+        self.max_jobs = max_jobs
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+
+    def _create(self, options):
+        factory = self._factory
+        if factory is None:
+            import yt_dlp
+            factory = yt_dlp.YoutubeDL
+        with self._lock:
+            self.created += 1
+        return _WarmInstance(factory({key: value for key, value in options.items() if key not in PER_JOB_OPTIONS}))
+
+    def _instances(self):
+        instances = getattr(self._local, 'instances', None)
+        if instances is None:
+            instances = self._local.instances = {}
+        return instances
+
+    @contextlib.contextmanager
+    def job(self, options):
+        """
+        YoutubeDL configured with options for one job on the calling thread.
+        Use it in place of `with yt_dlp.YoutubeDL(options) as ydl:`; the
+        instance stays open for the next job of the same thread.
+        """
+        instances = self._instances()
+        key = options_key(options)
+        warm = instances.get(key)
+        if warm is not None and warm.busy:
+            # Nested job on the same thread: a private instance, not cached
+            warm = self._create(options)
+        else:
+            if warm is None or warm.jobs >= self.max_jobs:
+                if warm is not None:
+                    _close(warm.ydl)
+                warm = instances[key] = self._create(options)
+            else:
+                with self._lock:
+                    self.reused += 1
+            warm.busy = True
+        warm.jobs += 1
+        _prepare(warm, options)
+        try:
+            yield warm.ydl
+        finally:
+            _release(warm.ydl)
+            if instances.get(key) is warm:
+                warm.busy = False
+            else:
+                _close(warm.ydl)
+
+    def close_thread(self):
+        """Close the instances of the calling thread (e.g. when a worker exits)"""
+        instances = self._instances()
+        for warm in instances.values():
+            _close(warm.ydl)
+        instances.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'created': self.created, 'reused': self.reused}
+
+
+def _prepare(warm, options):
+    """Apply the per-job options to a warm instance"""
+    ydl = warm.ydl
+    outtmpl = options.get('outtmpl')
+    if isinstance(warm.outtmpl, dict):
+        # yt-dlp keeps one template per output type; 'default' is the media file
+        templates = dict(warm.outtmpl)
+        if isinstance(outtmpl, dict):
+            templates.update(outtmpl)
+        elif outtmpl:
+            templates['default'] = outtmpl
+        ydl.params['outtmpl'] = templates
+    else:
+        ydl.params['outtmpl'] = outtmpl or warm.outtmpl
+    ydl.params['logger'] = options.get('logger')
+    ydl._progress_hooks = list(options.get('progress_hooks') or [])
+    ydl._postprocessor_hooks = list(options.get('postprocessor_hooks') or [])
+    # Error state of the previous job
+    ydl._download_retcode = 0
+
+
+def _release(ydl):
+    """Drop the job's hooks so they do not keep its state alive until the next job"""
+    ydl._progress_hooks = []
+    ydl._postprocessor_hooks = []
+    ydl.params['logger'] = None
+
+
+def _close(ydl):
+    close = getattr(ydl, 'close', None)
+    if close is not None:
+        try:
+            close()
+        except Exception:
+            pass
+
+
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+
+def get_ydl_pool():
+    """Process-wide pool of warm YoutubeDL instances"""
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None:
+            _default_pool = YdlPool()
+        return _default_pool